@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2020 Huawei Technologies Co., Ltd.
+# oec-hardware is licensed under the Mulan PSL v2.
+# You can use this software according to the terms and conditions of the Mulan PSL v2.
+# You may obtain a copy of Mulan PSL v2 at:
+#     http://license.coscl.org.cn/MulanPSL2
+# THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+# PURPOSE.
+# See the Mulan PSL v2 for more details.
+# Create: 2020-04-01
+
+"""Block device topology, to tell which disks are in use"""
+
+import os
+import re
+
+from .command import Command, CertCommandError
+from .sysfsutil import read_sysfs, listdir
+
+SYSFS_BLOCK = "/sys/class/block"
+
+_topology = None
+
+
+def read_lines(path):
+    """
+    Lines of a proc or config file, empty if it can not be read
+    :param path:
+    :return:
+    """
+    try:
+        with open(path) as text_file:
+            return text_file.read().splitlines()
+    except (IOError, OSError):
+        return []
+
+
+class BlockTopology:
+    """
+    Block devices with their partitions, holders (dm, md, LVM) and the
+    mounts, swaps and RAID/PV members found on them, built in one pass
+    """
+    def __init__(self):
+        self.devices = dict()
+        self.numbers = dict()
+        self.uses = dict()
+        self.busy = dict()
+        self.load()
+
+    def load(self):
+        """
+        Read the topology from sysfs and proc
+        :return:
+        """
+        self.devices = dict()
+        self.numbers = dict()
+        self.uses = dict()
+        self.busy = dict()
+
+        for name in listdir(SYSFS_BLOCK):
+            path = os.path.join(SYSFS_BLOCK, name)
+            parent = None
+            if os.path.exists(os.path.join(path, "partition")):
+                parent = os.path.basename(os.path.dirname(os.path.realpath(path)))
+            self.devices[name] = {"parent": parent,
+                                  "partitions": list(),
+                                  "holders": listdir(os.path.join(path, "holders")),
+                                  "label": read_sysfs(os.path.join(path, "dm", "name")) or name}
+            self.numbers[read_sysfs(os.path.join(path, "dev"))] = name
+        for name, device in self.devices.items():
+            if device["parent"] in self.devices:
+                self.devices[device["parent"]]["partitions"].append(name)
+
+        self._load_mounts()
+        self._load_swaps()
+        self._load_md_members()
+        self._load_physical_volumes()
+
+        for name in self.devices:
+            self._resolve(name, set())
+
+    def resolve(self, path):
+        """
+        Block device name of a device node or symlink such as /dev/mapper/x
+        :param path:
+        :return: name, or None if it is not a known block device
+        """
+        try:
+            stat = os.stat(path)
+        except (IOError, OSError):
+            return None
+        return self.numbers.get("%d:%d" % (os.major(stat.st_rdev), os.minor(stat.st_rdev)))
+
+    def add_use(self, name, use):
+        """
+        Record a direct use of a block device
+        :param name:
+        :param use:
+        :return:
+        """
+        if name in self.devices:
+            self.uses.setdefault(name, []).append(use)
+
+    def _load_mounts(self):
+        for line in read_lines("/proc/self/mountinfo"):
+            fields = line.split()
+            if " - " not in line or len(fields) < 5:
+                continue
+            name = self.numbers.get(fields[2])
+            if not name:
+                # btrfs and friends report an anonymous device number
+                source = line.split(" - ", 1)[1].split()
+                name = self.resolve(source[1]) if len(source) > 1 else None
+            if name:
+                self.add_use(name, "mounted on %s" % fields[4])
+
+    def _load_swaps(self):
+        for line in read_lines("/proc/swaps")[1:]:
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            if fields[1] == "partition":
+                self.add_use(self.resolve(fields[0]), "swap")
+                continue
+            try:
+                stat = os.stat(fields[0])
+            except (IOError, OSError):
+                continue
+            self.add_use(self.numbers.get("%d:%d" % (os.major(stat.st_dev), os.minor(stat.st_dev))),
+                         "swap file %s" % fields[0])
+
+        # swaps configured but not active yet are kept for the system too
+        for line in read_lines("/etc/fstab"):
+            fields = line.split()
+            if len(fields) < 3 or fields[0].startswith("#") or fields[2] != "swap":
+                continue
+            source = fields[0]
+            match = re.match(r"^(UUID|LABEL|PARTUUID|PARTLABEL)=(.+)$", source)
+            if match:
+                source = "/dev/disk/by-%s/%s" % (match.group(1).lower(), match.group(2).strip('"'))
+            self.add_use(self.resolve(source), "swap in /etc/fstab")
+
+    def _load_md_members(self):
+        for line in read_lines("/proc/mdstat"):
+            match = re.match(r"^(md\S*)\s*:\s*\S+\s+(.*)$", line)
+            if not match:
+                continue
+            for member in re.findall(r"(\S+)\[\d+\]", match.group(2)):
+                self.add_use(member, "member of %s" % match.group(1))
+
+    def _load_physical_volumes(self):
+        # one pvs for all disks, it also sees the PVs of inactive volume groups
+        try:
+            lines = Command("pvs --noheadings -o pv_name,vg_name 2>/dev/null").get_str(
+                regex=r"^\s*/dev/\S+.*", single_line=False, return_list=True)
+        except CertCommandError:
+            lines = []
+        for line in lines or []:
+            fields = line.split()
+            vg_name = fields[1] if len(fields) > 1 else ""
+            self.add_use(self.resolve(fields[0]), "LVM physical volume %s" % vg_name)
+
+    def _resolve(self, name, visiting):
+        """
+        Reasons a device is busy: its own uses, the uses of its partitions
+        and of the devices stacked on it
+        """
+        if name in self.busy:
+            return self.busy[name]
+        if name in visiting:
+            return []
+        visiting.add(name)
+        device = self.devices[name]
+        reasons = ["%s %s" % (name, use) for use in self.uses.get(name, [])]
+        for partition in device["partitions"]:
+            reasons.extend(self._resolve(partition, visiting))
+        for holder in device["holders"]:
+            if holder not in self.devices:
+                continue
+            holder_reasons = self._resolve(holder, visiting)
+            label = self.devices[holder]["label"]
+            reasons.append("%s held by %s" % (name, label))
+            reasons.extend(holder_reasons)
+        self.busy[name] = reasons
+        return reasons
+
+    def is_busy(self, name):
+        """
+        Whether a block device, one of its partitions or a device stacked
+        on them is mounted, used as swap, RAID member or LVM PV
+        :param name: sda, nvme0n1, ...
+        :return:
+        """
+        return bool(self.busy.get(name))
+
+    def get_reasons(self, name):
+        """
+        Why a block device is busy
+        :param name:
+        :return: list of str
+        """
+        return self.busy.get(name, [])
+
+
+def get_block_topology(refresh=False):
+    """
+    The shared block topology, built on first use
+    :param refresh: read sysfs and proc again
+    :return:
+    """
+    global _topology
+    if _topology is None:
+        _topology = BlockTopology()
+    elif refresh:
+        _topology.load()
+    return _topology
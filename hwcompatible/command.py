@@ -15,9 +15,14 @@
 import sys
 import re
 import subprocess
+import threading
 
 
 class Command:
+    # number of processes started through Command, tests run commands from
+    # worker threads too
+    spawned = 0
+    spawned_lock = threading.Lock()
 
     def __init__(self, command):
         """ Creates a Command object that wraps the shell command """
@@ -31,7 +36,14 @@ class Command:
         self.single_line = True
         self.regex_group = None
 
+    @staticmethod
+    def count_spawned():
+        """count a started process"""
+        with Command.spawned_lock:
+            Command.spawned += 1
+
     def _run(self):
+        Command.count_spawned()
         if sys.version_info.major < 3:
             self.pipe = subprocess.Popen(self.command, shell=True,
                                          stdin=subprocess.PIPE,
@@ -55,6 +67,7 @@ class Command:
 
     def start(self):
         """start command"""
+        Command.count_spawned()
         if sys.version_info.major < 3:
             self.pipe = subprocess.Popen(self.command, shell=True,
                                          stdin=subprocess.PIPE,
@@ -136,6 +149,7 @@ class Command:
         执行命令，并读取结果
         :return:
         """
+        Command.count_spawned()
         self.pipe = subprocess.Popen(self.command, shell=True,
                                      stdout=subprocess.PIPE,
                                      stderr=subprocess.STDOUT)
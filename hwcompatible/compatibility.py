@@ -18,6 +18,7 @@ import argparse
 import shutil
 import datetime
 import re
+import sqlite3
 
 from .document import CertDocument, DeviceDocument, FactoryDocument
 from .env import CertEnv
@@ -25,9 +26,14 @@ from .device import CertDevice, Device
 from .command import Command, CertCommandError
 from .commandUI import CommandUI
 from .job import Job
+from .jobstate import JobState, STATE_DB
+from .history import show_history, show_compare
+from .testregistry import get_test_registry
+from .inventoryutil import get_system_inventory
 from .reboot import Reboot
 from .client import Client
-from .dpdkutil import check_ib, get_devices_with_compatible_driver
+from .dpdkutil import check_ib, get_devices_with_compatible_driver, \
+    get_nvme_with_compatible_driver
 
 
 class EulerCertification():
@@ -48,6 +54,7 @@ class EulerCertification():
         """
         print("The openEuler Hardware Compatibility Test Suite")
         self.load()
+        self.resume()
         certdevice = CertDevice()
 
         while True:
@@ -73,6 +80,40 @@ class EulerCertification():
             job.run()
             self.save(job)
 
+    def resume(self):
+        """
+        Offer to resume a job interrupted by a crash or power loss
+        :return:
+        """
+        if os.path.exists(CertEnv.rebootfile):
+            # oech.service continues it after the reboot
+            return
+        try:
+            state = JobState()
+            interrupted = state.get_interrupted()
+        except sqlite3.Error as concrete_error:
+            print("Warning: could not read job state: %s" % concrete_error)
+            return
+        if not interrupted:
+            state.close()
+            return
+
+        job_id, test_factory, checkpoints = interrupted
+        completed = [status for status in checkpoints.values() if status in ["PASS", "FAIL"]]
+        total = len([test for test in test_factory if test["run"]])
+        print("Job %s was interrupted after %d of %d testcases." % (job_id, len(completed),
+                                                                     total))
+        if not self.ui.prompt_confirm("Resume it?"):
+            state.finish_job(job_id, "abandoned")
+            state.close()
+            return
+        state.close()
+
+        self.test_factory = test_factory
+        job = Job(argparse.Namespace(test_factory=self.test_factory, job_id=job_id))
+        job.run()
+        self.save(job)
+
     def run_rebootup(self):
         """
          rebootup
@@ -103,11 +144,25 @@ class EulerCertification():
                 Command("rm -rf %s" % CertEnv.certificationfile).run()
                 Command("rm -rf %s" % CertEnv.factoryfile).run()
                 Command("rm -rf %s" % CertEnv.devicefile).run()
+                Command("rm -rf %s %s-wal %s-shm" % (STATE_DB, STATE_DB, STATE_DB)).run()
             except Exception as e:
                 print(e)
                 return False
         return True
 
+    def history(self, compare=None):
+        """
+        Show the result history, or compare a run with a baseline
+        :param compare: [baseline] or [baseline, current], run ids or kernel versions
+        :return: False if the comparison finds a regression
+        """
+        if not os.path.exists(CertEnv.datadirectory):
+            os.mkdir(CertEnv.datadirectory)
+        if not compare:
+            show_history()
+            return True
+        return show_compare(compare[0], compare[1] if len(compare) > 1 else None)
+
     def load(self):
         """
         load certification
@@ -145,7 +200,7 @@ class EulerCertification():
         doc_dir = os.path.join(CertEnv.logdirectoy, job.job_id)
         if not os.path.exists(doc_dir):
             return
-        FactoryDocument(CertEnv.factoryfile, self.test_factory).save()
+        FactoryDocument(CertEnv.factoryfile, self.test_factory).save(sync=True)
         shutil.copy(CertEnv.certificationfile, doc_dir)
         shutil.copy(CertEnv.devicefile, doc_dir)
         shutil.copy(CertEnv.factoryfile, doc_dir)
@@ -222,15 +277,7 @@ class EulerCertification():
         sort_devices = self.sort_tests(devices)
         empty_device = Device()
         test_factory = list()
-        casenames = []
-        for (dirpath, dirs, filenames) in os.walk(CertEnv.testdirectoy):
-            dirs.sort()
-            for filename in filenames:
-                if filename.endswith(".py") and \
-                        not filename.startswith("__init__"):
-                    casenames.append(filename.split(".")[0])
-
-        for testname in casenames:
+        for testname in get_test_registry().names():
             if sort_devices.get(testname):
                 for device in sort_devices[testname]:
                     test = dict()
@@ -341,12 +388,18 @@ class EulerCertification():
             except KeyError:
                 sort_devices["dpdk"] = [Device(prop)]
 
-        try:
-            Command("dmidecode").get_str("IPMI Device Information",
-                                         single_line=False)
+        # nvme controllers handed over to spdk
+        for dev in get_nvme_with_compatible_driver():
+            prop = dict()
+            prop["DEVNAME"] = dev
+            prop["DEVPATH"] = ""
+            try:
+                sort_devices["spdk"].extend([Device(prop)])
+            except KeyError:
+                sort_devices["spdk"] = [Device(prop)]
+
+        if get_system_inventory().has_ipmi():
             sort_devices["ipmi"] = [empty_device]
-        except:
-            pass
 
         return sort_devices
 
@@ -485,7 +538,7 @@ class EulerCertification():
                     print("add %s test %s" % (test["name"],
                                               test["device"].get_name()))
         self.test_factory.sort(key=lambda k: k["name"])
-        FactoryDocument(CertEnv.factoryfile, self.test_factory).save()
+        FactoryDocument(CertEnv.factoryfile, self.test_factory).save(sync=True)
 
     def search_factory(self, obj_test, test_factory):
         """
@@ -14,11 +14,12 @@
 
 """Document processing"""
 
+import os
 import json
 from .commandUI import CommandUI
-from .command import Command
 from .device import Device
 from .sysinfo import SysInfo
+from .inventoryutil import get_system_inventory
 from .env import CertEnv
 
 
@@ -33,12 +34,35 @@ class Document():
     def new(self):
         print("doc new")
 
-    def save(self):
-        """save file"""
+    def save(self, sync=False):
+        """
+        save file
+        :param sync: for state files that must survive a crash or reboot,
+                     write a synced temporary file and rename it over the file
+        :return:
+        """
+        if not sync:
+            try:
+                with open(self.filename, "w+") as save_f:
+                    json.dump(self.document, save_f, indent=4)
+            except Exception as concrete_error:
+                print("Error: doc save fail.")
+                print(concrete_error)
+                return False
+            return True
+
+        tmpname = self.filename + ".tmp"
         try:
-            with open(self.filename, "w+") as save_f:
+            with open(tmpname, "w") as save_f:
                 json.dump(self.document, save_f, indent=4)
-                save_f.close()
+                save_f.flush()
+                os.fsync(save_f.fileno())
+            os.rename(tmpname, self.filename)
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.filename)), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
         except Exception as concrete_error:
             print("Error: doc save fail.")
             print(concrete_error)
@@ -74,24 +98,9 @@ class CertDocument(Document):
         new document object
         :return:
         """
-        try:
-            pipe = Command("/usr/sbin/dmidecode -t 1")
-            pipe.start()
-            self.document = dict()
-            while True:
-                line = pipe.readline()
-                if line:
-                    property_right = line.split(":", 1)
-                    if len(property_right) == 2:
-                        key = property_right[0].strip()
-                        value = property_right[1].strip()
-                        if key in ["Manufacturer", "Product Name", "Version"]:
-                            self.document[key] = value
-                else:
-                    break
-        except Exception as concrete_error:
+        self.document = get_system_inventory().get_system()
+        if not self.document["Product Name"]:
             print("Error: get hardware info fail.")
-            print(concrete_error)
 
         sysinfo = SysInfo(CertEnv.releasefile)
         self.document["OS"] = sysinfo.product + " " + sysinfo.get_version()
@@ -240,7 +249,7 @@ class ConfigFile:
         """
         add parameter
         """
-        if not self.getParameter(name):
+        if not self.get_parameter(name):
             self.parameters[name] = value
             self.config.append("%s %s\n" % (name, value))
             self.save()
@@ -253,7 +262,7 @@ class ConfigFile:
         :param name:
         :return:
         """
-        if self.getParameter(name):
+        if self.get_parameter(name):
             del self.parameters[name]
             newconfig = list()
             for line in self.config:
@@ -8,6 +8,8 @@ from os.path import exists, basename
 from os.path import join as path_join
 
 from hwcompatible.command import Command
+from hwcompatible.rdmautil import get_rdma_interfaces
+from hwcompatible.pciutil import get_pci_inventory, compile_match_rules, device_matches
 
 ## some of the codes are ported from dpdk official repo
 
@@ -25,6 +27,7 @@ avp_vnic = {'Class': '05', 'Vendor': '1af4', 'Device': '1110',
 
 supported_modules = ["igb_uio", "vfio-pci", "uio_pci_generic"]
 network_devices = [network_class, cavium_pkx, avp_vnic, ifpga_class]
+network_rules = compile_match_rules(network_devices)
 
 def is_module_loaded(supported_modules):
     comm = Command("lsmod")
@@ -46,96 +49,58 @@ def is_module_loaded(supported_modules):
     return not module_found_nb == 0
 
 def get_devices_with_compatible_driver():
-    global network_devices
     global supported_modules
 
     pci_slots = []
-    devices = get_devices(network_devices)
-    if len(devices) == 0:
-        return pci_slots
-    for d in devices.keys():
-        if "Driver_str" in devices[d]:
-            if devices[d]["Driver_str"] in supported_modules:
-                pci_slots.append(devices[d]["Slot"])
+    inventory = get_pci_inventory()
+    for dev in inventory.match(network_rules):
+        if inventory.get_driver(dev["Slot"]) in supported_modules:
+            pci_slots.append(dev["Slot"])
+    return pci_slots
+
+def get_nvme_with_compatible_driver():
+    global supported_modules
+
+    pci_slots = []
+    inventory = get_pci_inventory()
+    for dev in inventory.by_class.get("01", []):
+        # mass storage controller, non-volatile memory subclass
+        if dev["Class"] == "0108" and inventory.get_driver(dev["Slot"]) in supported_modules:
+            pci_slots.append(dev["Slot"])
     return pci_slots
 
 def is_device_bind():
-    global network_devices
     global supported_modules
 
-    devices = get_devices(network_devices)
+    inventory = get_pci_inventory()
+    devices = inventory.match(network_rules)
     if len(devices) == 0:
         print("[X] No interface detected.")
         return False
-    for d in devices.keys():
-        if "Driver_str" in devices[d]:
-            if devices[d]["Driver_str"] in supported_modules:
-                return True
+    for dev in devices:
+        if inventory.get_driver(dev["Slot"]) in supported_modules:
+            return True
     print('[X] No device was bound to DPDK suported drivers.'
             'Try solving this using "dpdk-devbind.py" provided by DPDK installation')
     return False
 
 def device_type_match(dev, devices_type):
-    for i in range(len(devices_type)):
-        param_count = len(
-            [x for x in devices_type[i].values() if x is not None])
-        match_count = 0
-        if dev["Class"][0:2] == devices_type[i]["Class"]:
-            match_count = match_count + 1
-            for key in devices_type[i].keys():
-                if key != 'Class' and devices_type[i][key]:
-                    value_list = devices_type[i][key].split(',')
-                    for value in value_list:
-                        if value.strip(' ') == dev[key]:
-                            match_count = match_count + 1
-            # count must be the number of non None parameters to match
-            if match_count == param_count:
-                return True
-    return False
+    return device_matches(dev, compile_match_rules(devices_type))
 
 def get_devices(device_type):
     devices = {}
-    dev = {}
-    comm = Command("lspci -Dvmmnnk")
-    comm.start()
-
-    while True:
-        line = comm.readline()
-        if not line:
-            break
-
-        if line == '\n':
-            if device_type_match(dev, device_type):
-                if "Driver" in dev.keys(): # for consistency of key names
-                    dev["Driver_str"] = dev.pop("Driver")
-                if "Module" in dev.keys():
-                    dev["Module_str"] = dev.pop("Module")
-                devices[dev["Slot"]] = dict(dev)
-            dev = {}
-        else:
-            line = line.strip()
-            name, value = line.split("\t", 1)
-            value_list = value.rsplit(' ', 1)
-            if len(value_list) == 2:
-                # String stored in <name>_str
-                dev[name.rstrip(":") + '_str'] = value_list[0]
-            # Numeric IDs stored in <name>
-            dev[name.rstrip(":")] = value_list[len(value_list) - 1] \
-                .strip().rstrip("]").lstrip("[")
-    
+    inventory = get_pci_inventory()
+    for dev in inventory.match(compile_match_rules(device_type)):
+        dev = dict(dev)
+        # the driver may have been rebound since the inventory was read
+        driver = inventory.get_driver(dev["Slot"])
+        dev.pop("Driver_str", None)
+        if driver:
+            dev["Driver_str"] = driver
+        devices[dev["Slot"]] = dev
     return devices
 
 def check_ib(interface):
     if interface == None:
         return False
-    ib_devices = []
-    pipe = Command("ls -d /sys/class/net/*/device/infiniband_verbs/uverbs* | cut -d / -f 5")
-    pipe.start()
-    while True:
-        line = pipe.readline()
-        if "No such file" in line:
-            break
-        if not line:
-            break
-        ib_devices.append(line.strip())
-    return interface in ib_devices
+    return interface in get_rdma_interfaces()
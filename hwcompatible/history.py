@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2020 Huawei Technologies Co., Ltd.
+# oec-hardware is licensed under the Mulan PSL v2.
+# You can use this software according to the terms and conditions of the Mulan PSL v2.
+# You may obtain a copy of Mulan PSL v2 at:
+#     http://license.coscl.org.cn/MulanPSL2
+# THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+# PURPOSE.
+# See the Mulan PSL v2 for more details.
+# Create: 2020-04-01
+
+"""Result history of every job, with performance regression detection"""
+
+import os
+import re
+import json
+import math
+import time
+import sqlite3
+
+from .env import CertEnv
+from .inventoryutil import get_system_inventory, DMI_TYPE_BIOS
+
+HISTORY_DB = os.path.join(CertEnv.datadirectory, "history.db")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT, started REAL, kernel TEXT, firmware TEXT, hardware TEXT);
+CREATE TABLE IF NOT EXISTS testcases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER REFERENCES runs(id), name TEXT, device TEXT, status TEXT,
+    started REAL, duration REAL);
+CREATE TABLE IF NOT EXISTS metrics (
+    testcase_id INTEGER REFERENCES testcases(id), source TEXT, metric TEXT,
+    value REAL, better TEXT);
+CREATE INDEX IF NOT EXISTS metrics_testcase ON metrics(testcase_id);
+"""
+# fields that name an element of a list of results, e.g. one point of a sweep
+LABEL_KEYS = ["name", "workload", "rw", "io_size", "size", "bytes", "frame_size", "qd",
+              "queue_depth", "qps", "node", "cpu_node", "mem_node", "pagesize", "pci",
+              "interface", "namespace", "disk", "device", "port"]
+HIGHER_IS_BETTER = re.compile(r"(^|_)(iops|bw|mbps|mibps|gbps|mpps|pps|bandwidth|throughput"
+                              r"|copy|scale|add|triad|speedup)$", re.I)
+LOWER_IS_BETTER = re.compile(r"((^|_)(lat|latency|ns|us|usec|nsec|runtime|cycles_per_io|t_typical"
+                             r"|t_avg|t_min)|^p\d+(\.\d+)?)$", re.I)
+# configured limits and extremes are not compared
+NOT_MEASURED = re.compile(r"^(target|link|expected|max)_", re.I)
+
+
+def item_label(item, index):
+    """
+    Label of a result in a list, from its identifying fields
+    :param item:
+    :param index:
+    :return:
+    """
+    labels = ["%s=%s" % (key, item[key]) for key in LABEL_KEYS
+              if key in item and isinstance(item[key], (str, int, float))]
+    return ",".join(labels) if labels else str(index)
+
+
+def metric_direction(path):
+    """
+    Whether a higher or a lower value of a metric is better
+    :param path: keys leading to the value
+    :return: "higher", "lower" or None if it is not a performance metric
+    """
+    key = path[-1]
+    if re.match(r"^[\d.]+$", key) and len(path) > 1:
+        # percentiles keyed by their rank, e.g. percentiles_us.99
+        key = path[-2]
+    if NOT_MEASURED.match(key):
+        return None
+    if HIGHER_IS_BETTER.search(key):
+        return "higher"
+    if LOWER_IS_BETTER.search(key):
+        return "lower"
+    return None
+
+
+def flatten(value, path, leaves):
+    """
+    Collect the numbers of a json document with the keys leading to them,
+    the numbers of a plain list are samples of the same metric
+    :param value:
+    :param path:
+    :param leaves: list of (path, number)
+    :return:
+    """
+    if isinstance(value, bool) or value is None:
+        return
+    if isinstance(value, (int, float)):
+        if path:
+            leaves.append((path, float(value)))
+    elif isinstance(value, dict):
+        for key in sorted(value, key=str):
+            flatten(value[key], path + [str(key)], leaves)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            if isinstance(item, dict):
+                flatten(item, path + [item_label(item, index)], leaves)
+            else:
+                flatten(item, path, leaves)
+
+
+def extract_metrics(document):
+    """
+    Performance metrics of a structured test output
+    :param document: loaded json
+    :return: list of (metric, value, better)
+    """
+    leaves = list()
+    flatten(document, [], leaves)
+    metrics = list()
+    for path, value in leaves:
+        better = metric_direction(path)
+        if better and not math.isnan(value) and not math.isinf(value):
+            metrics.append(("/".join(path), value, better))
+    return metrics
+
+
+def betacf(a, b, x):
+    """
+    Continued fraction of the incomplete beta function, by Lentz's method
+    :return:
+    """
+    tiny = 1e-300
+    qab, qap, qam = a + b, a + 1.0, a - 1.0
+    c, d = 1.0, 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, 201):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        result *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        result *= delta
+        if abs(delta - 1.0) < 3e-12:
+            break
+    return result
+
+
+def betainc(a, b, x):
+    """
+    Regularized incomplete beta function I_x(a, b)
+    :return:
+    """
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+                     + a * math.log(x) + b * math.log(1.0 - x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * betacf(a, b, x) / a
+    return 1.0 - front * betacf(b, a, 1.0 - x) / b
+
+
+def welch_ttest(samples_a, samples_b):
+    """
+    Two sided Welch's t-test of two sets of samples
+    :param samples_a:
+    :param samples_b:
+    :return: p-value, None if the samples are too few to test
+    """
+    count_a, count_b = len(samples_a), len(samples_b)
+    if count_a < 2 or count_b < 2:
+        return None
+    mean_a, mean_b = sum(samples_a) / count_a, sum(samples_b) / count_b
+    var_a = sum((x - mean_a) ** 2 for x in samples_a) / (count_a - 1) / count_a
+    var_b = sum((x - mean_b) ** 2 for x in samples_b) / (count_b - 1) / count_b
+    if var_a + var_b == 0:
+        return 0.0 if mean_a != mean_b else 1.0
+    t_value = (mean_a - mean_b) / math.sqrt(var_a + var_b)
+    dof = (var_a + var_b) ** 2 / (var_a ** 2 / (count_a - 1) + var_b ** 2 / (count_b - 1))
+    return betainc(dof / 2.0, 0.5, dof / (dof + t_value ** 2))
+
+
+class ResultHistory:
+    """
+    SQLite store of every testcase run and the metrics of its outputs
+    """
+    def __init__(self, filename=HISTORY_DB):
+        self.conn = sqlite3.connect(filename)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        """
+        Close the database
+        :return:
+        """
+        self.conn.close()
+
+    def get_run(self, job_id):
+        """
+        Run of a job, recorded on first use so that a job continued after
+        a reboot or resumed after a crash stays one run
+        :param job_id:
+        :return: run id
+        """
+        row = self.conn.execute("SELECT id FROM runs WHERE job_id = ?", (job_id,)).fetchone()
+        if row:
+            return row[0]
+        inventory = get_system_inventory()
+        bios = inventory.get_properties(DMI_TYPE_BIOS)
+        firmware = " ".join(bios.get(key, "") for key in ["Vendor", "Version", "Release Date"])
+        hardware = " ".join(inventory.get_system().values())
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs (job_id, started, kernel, firmware, hardware) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job_id, time.time(), os.uname().release, firmware.strip(), hardware.strip()))
+        return cursor.lastrowid
+
+    def add_testcase(self, run_id, testcase):
+        """
+        Record a completed testcase and the metrics of the json outputs it
+        registered, replacing an earlier record of it in the same run
+        :param run_id:
+        :param testcase:
+        :return:
+        """
+        device = testcase["device"].get_name() or ""
+        with self.conn:
+            self.conn.execute("DELETE FROM metrics WHERE testcase_id IN (SELECT id FROM "
+                              "testcases WHERE run_id = ? AND name = ? AND device = ?)",
+                              (run_id, testcase["name"], device))
+            self.conn.execute("DELETE FROM testcases WHERE run_id = ? AND name = ? AND "
+                              "device = ?", (run_id, testcase["name"], device))
+            cursor = self.conn.execute(
+                "INSERT INTO testcases (run_id, name, device, status, started, duration) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (run_id, testcase["name"], device, testcase["status"],
+                 testcase.get("started"), testcase.get("duration")))
+            testcase_id = cursor.lastrowid
+            for output in testcase.get("outputs", []):
+                try:
+                    with open(output) as output_file:
+                        document = json.load(output_file)
+                except (IOError, OSError, ValueError):
+                    continue
+                self.conn.executemany(
+                    "INSERT INTO metrics (testcase_id, source, metric, value, better) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(testcase_id, os.path.basename(output), metric, value, better)
+                     for metric, value, better in extract_metrics(document)])
+
+    def get_runs(self, limit=20):
+        """
+        The latest runs
+        :param limit:
+        :return: list of (id, job_id, started, kernel, firmware, testcases, passed)
+        """
+        return self.conn.execute(
+            "SELECT runs.id, job_id, runs.started, kernel, firmware, COUNT(testcases.id), "
+            "SUM(testcases.status = 'PASS') FROM runs "
+            "LEFT JOIN testcases ON testcases.run_id = runs.id "
+            "GROUP BY runs.id ORDER BY runs.id DESC LIMIT ?", (limit,)).fetchall()
+
+    def select_runs(self, selector):
+        """
+        Run ids of a run id, or of every run on a kernel version
+        :param selector:
+        :return:
+        """
+        if re.match(r"^\d+$", str(selector)):
+            rows = self.conn.execute("SELECT id FROM runs WHERE id = ?", (int(selector),))
+        else:
+            rows = self.conn.execute("SELECT id FROM runs WHERE kernel = ?", (selector,))
+        return [row[0] for row in rows]
+
+    def get_samples(self, run_ids):
+        """
+        Metric samples of some runs
+        :param run_ids:
+        :return: dict of (test, device, source, metric) -> (better, list of values)
+        """
+        samples = dict()
+        if not run_ids:
+            return samples
+        rows = self.conn.execute(
+            "SELECT name, device, source, metric, better, value FROM metrics "
+            "JOIN testcases ON testcases.id = metrics.testcase_id "
+            "WHERE testcases.run_id IN (%s)" % ",".join("?" * len(run_ids)), run_ids)
+        for name, device, source, metric, better, value in rows:
+            entry = samples.setdefault((name, device, source, metric), (better, list()))
+            entry[1].append(value)
+        return samples
+
+    def compare(self, baseline, current=None, threshold=0.05, alpha=0.05):
+        """
+        Compare the metrics of a run with a baseline. A change in the bad
+        direction beyond threshold is a regression when Welch's t-test finds
+        it significant. With less than two samples on a side there is nothing
+        to test, a change beyond threshold is only reported as changed
+        :param baseline: run id or kernel version
+        :param current: run id or kernel version, the latest run if not set
+        :param threshold: relative change to ignore
+        :param alpha: significance level
+        :return: list of comparison dicts, None if a run is not found
+        """
+        if current is None:
+            row = self.conn.execute("SELECT MAX(id) FROM runs").fetchone()
+            current = row[0] if row and row[0] is not None else ""
+        baseline_runs, current_runs = self.select_runs(baseline), self.select_runs(current)
+        if not baseline_runs or not current_runs:
+            return None
+
+        baseline_samples = self.get_samples(baseline_runs)
+        current_samples = self.get_samples(current_runs)
+        results = list()
+        for key in sorted(set(baseline_samples) & set(current_samples)):
+            better, old = baseline_samples[key]
+            new = current_samples[key][1]
+            old_mean, new_mean = sum(old) / len(old), sum(new) / len(new)
+            change = (new_mean - old_mean) / abs(old_mean) if old_mean else 0.0
+            worse = change < -threshold if better == "higher" else change > threshold
+            better_now = change > threshold if better == "higher" else change < -threshold
+            p_value = welch_ttest(old, new)
+            significant = p_value is not None and p_value < alpha
+            verdict = ""
+            if p_value is None and (worse or better_now):
+                verdict = "changed"
+            elif worse and significant:
+                verdict = "REGRESSION"
+            elif better_now and significant:
+                verdict = "improved"
+            results.append({"test": key[0], "device": key[1], "source": key[2],
+                            "metric": key[3], "better": better, "baseline": old_mean,
+                            "current": new_mean, "change": change, "p_value": p_value,
+                            "samples": [len(old), len(new)], "verdict": verdict})
+        return results
+
+
+def show_history(limit=20):
+    """
+    Print the latest runs
+    :param limit:
+    :return:
+    """
+    history = ResultHistory()
+    print("Run".ljust(6) + "Job".ljust(12) + "Date".ljust(21) + "Kernel".ljust(34)
+          + "Passed".ljust(10) + "Firmware")
+    for run_id, job_id, started, kernel, firmware, total, passed in history.get_runs(limit):
+        date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started))
+        print(str(run_id).ljust(6) + job_id.ljust(12) + date.ljust(21) + kernel.ljust(34)
+              + ("%d/%d" % (passed or 0, total)).ljust(10) + firmware)
+    history.close()
+
+
+def show_compare(baseline, current=None, verbose=False):
+    """
+    Print the comparison of a run with a baseline
+    :param baseline:
+    :param current:
+    :param verbose: print unchanged metrics too
+    :return: False if there is a regression
+    """
+    history = ResultHistory()
+    results = history.compare(baseline, current)
+    history.close()
+    if results is None:
+        print("Error: run %s not found in history." % (current if current else baseline))
+        return False
+
+    regressions = [result for result in results if result["verdict"] == "REGRESSION"]
+    for result in results:
+        if not verbose and not result["verdict"]:
+            continue
+        name = result["test"] + ("-" + result["device"] if result["device"] else "")
+        p_value = "%.4f" % result["p_value"] if result["p_value"] is not None else "-"
+        print("%-24s %-10s %s/%s" % (name, result["verdict"] or "same", result["source"],
+                                     result["metric"]))
+        print("    %.3f -> %.3f (%+.1f%%, %s is better, p=%s, n=%d/%d)" %
+              (result["baseline"], result["current"], result["change"] * 100,
+               result["better"], p_value, result["samples"][0], result["samples"][1]))
+    changed = [result for result in results if result["verdict"] == "changed"]
+    print("%d metrics compared, %d regressions." % (len(results), len(regressions)))
+    if changed:
+        print("%d metrics changed with too few samples to test, "
+              "run the tests again to compare them." % len(changed))
+    return not regressions
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2020 Huawei Technologies Co., Ltd.
+# oec-hardware is licensed under the Mulan PSL v2.
+# You can use this software according to the terms and conditions of the Mulan PSL v2.
+# You may obtain a copy of Mulan PSL v2 at:
+#     http://license.coscl.org.cn/MulanPSL2
+# THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+# PURPOSE.
+# See the Mulan PSL v2 for more details.
+# Create: 2020-04-01
+
+"""Huge page reservation per page size and numa node through sysfs"""
+
+import os
+import re
+import time
+from math import log2
+
+from .sysfsutil import read_sysfs, listdir
+
+SYSFS_NODE = "/sys/devices/system/node"
+SYSFS_HUGEPAGES = "/sys/kernel/mm/hugepages"
+
+
+def fmt_memsize(kb):
+    """
+    Format a memory size in kB, a code snippet from the dpdk repo
+    :param kb:
+    :return:
+    """
+    binary_prefix = "KMG"
+    logk = int(log2(kb) / 10)
+    suffix = binary_prefix[logk]
+    unit = 2 ** (logk * 10)
+    return '{}{}b'.format(int(kb / unit), suffix)
+
+
+def is_numa():
+    """
+    Test if numa is used on this system
+    :return:
+    """
+    return os.path.exists(SYSFS_NODE)
+
+
+def get_numa_nodes():
+    """
+    Numa nodes of the system, [0] without numa
+    :return:
+    """
+    if not is_numa():
+        return [0]
+    return sorted(int(name[4:]) for name in os.listdir(SYSFS_NODE)
+                  if re.match("^node[0-9]+$", name))
+
+
+def get_mountpoints():
+    """
+    Where the hugetlbfs filesystem is mounted
+    :return:
+    """
+    mounted = []
+    with open('/proc/mounts') as mounts:
+        for line in mounts:
+            fields = line.split()
+            if fields[2] != 'hugetlbfs':
+                continue
+            mounted.append(fields[1])
+    return mounted
+
+
+def get_default_pagesize():
+    """
+    Default huge page size in kB, from /proc/meminfo
+    :return:
+    """
+    with open('/proc/meminfo') as meminfo:
+        for line in meminfo:
+            if line.startswith('Hugepagesize:'):
+                return int(line.split()[1])
+    return 0
+
+
+def get_pagesizes():
+    """
+    Huge page sizes supported by the kernel, in kB
+    :return:
+    """
+    # hugepages-NNNkB
+    return sorted(int(name[10:-2]) for name in listdir(SYSFS_HUGEPAGES) if re.match(r"^hugepages-[0-9]+kB$", name))
+
+
+def get_pages_path(node, kb):
+    """
+    sysfs directory of the huge pages of one size, on a numa node or for
+    the whole system when node is None or there is no numa
+    :param node:
+    :param kb:
+    :return:
+    """
+    if node is None or not is_numa():
+        return os.path.join(SYSFS_HUGEPAGES, "hugepages-%dkB" % kb)
+    return os.path.join(SYSFS_NODE, "node%d" % node, "hugepages", "hugepages-%dkB" % kb)
+
+
+def get_node_pages(node, kb):
+    """
+    Number of reserved and free huge pages of size kb on a numa node
+    :param node:
+    :param kb:
+    :return: (nr_hugepages, free_hugepages)
+    """
+    path = get_pages_path(node, kb)
+    try:
+        nr_pages = int(read_sysfs(os.path.join(path, "nr_hugepages"), "0"))
+        free_pages = int(read_sysfs(os.path.join(path, "free_hugepages"), "0"))
+    except ValueError:
+        return 0, 0
+    return nr_pages, free_pages
+
+
+def set_node_pages(node, kb, nr_pages):
+    """
+    Set the number of huge pages of size kb reserved on a numa node
+    :param node:
+    :param kb:
+    :param nr_pages:
+    :return: True on success
+    """
+    try:
+        with open(os.path.join(get_pages_path(node, kb), "nr_hugepages"), "w") as nr_file:
+            nr_file.write(str(nr_pages))
+    except (IOError, OSError) as concrete_error:
+        print(concrete_error)
+        return False
+    return True
+
+
+def reserve_pages(node, kb, count):
+    """
+    Make sure count huge pages of size kb are free on a numa node, growing
+    the reservation of that node only
+    :param node:
+    :param kb:
+    :param count:
+    :return: (success, seconds spent reserving)
+    """
+    start = time.time()
+    nr_pages, free_pages = get_node_pages(node, kb)
+    if free_pages < count:
+        if not set_node_pages(node, kb, nr_pages + count - free_pages):
+            return False, time.time() - start
+        nr_pages, free_pages = get_node_pages(node, kb)
+    return free_pages >= count, time.time() - start
+
+
+def reserve_node_pages(node, memsize_mb, kb=None):
+    """
+    Make sure memsize_mb of huge pages are free on a numa node
+    :param node:
+    :param memsize_mb:
+    :param kb: page size, the default huge page size if not set
+    :return: True on success
+    """
+    kb = kb or get_default_pagesize()
+    if not kb:
+        return False
+    return reserve_pages(node, kb, (memsize_mb * 1024 + kb - 1) // kb)[0]
+
+
+def show_numa_pages():
+    """
+    Show huge page reservations on numa system
+    :return:
+    """
+    print('Node Pages Size Total')
+    for node in get_numa_nodes():
+        for kb in get_pagesizes():
+            pages = get_node_pages(node, kb)[0]
+            if pages > 0:
+                print('{:<4} {:<5} {:<6} {}'.format(node, pages, fmt_memsize(kb),
+                                                    fmt_memsize(pages * kb)))
+
+
+def show_non_numa_pages():
+    """
+    Show huge page reservations on non numa system
+    :return:
+    """
+    print('Pages Size Total')
+    for kb in get_pagesizes():
+        pages = get_node_pages(None, kb)[0]
+        if pages > 0:
+            print('{:<5} {:<6} {}'.format(pages, fmt_memsize(kb), fmt_memsize(pages * kb)))
+
+
+def check_hugepage_allocate(isnuma, numaid=0):
+    """
+    Check huge pages are reserved, on node numaid for numa systems
+    :param isnuma:
+    :param numaid:
+    :return:
+    """
+    node = numaid if isnuma else None
+    for kb in get_pagesizes():
+        if get_node_pages(node, kb)[0] != 0:
+            return True
+    return False
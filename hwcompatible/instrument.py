@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2020 Huawei Technologies Co., Ltd.
+# oec-hardware is licensed under the Mulan PSL v2.
+# You can use this software according to the terms and conditions of the Mulan PSL v2.
+# You may obtain a copy of Mulan PSL v2 at:
+#     http://license.coscl.org.cn/MulanPSL2
+# THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+# PURPOSE.
+# See the Mulan PSL v2 for more details.
+# Create: 2020-04-01
+
+"""Timing and resource usage of testcases, their phases and their own spans
+
+Tests can time parts of their work, report values of their own and
+register the structured outputs they save:
+
+    from hwcompatible import instrument
+    with instrument.span("fio randread"):
+        ...
+    instrument.metric("iops", iops, "IO/s")
+    instrument.output(filename)
+"""
+
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+from .command import Command
+
+IO_FIELDS = ["rchar", "wchar", "syscr", "syscw", "read_bytes", "write_bytes"]
+
+_current = None
+_lock = threading.Lock()
+
+
+def read_proc_io():
+    """
+    I/O counters of this process from /proc/self/io
+    :return: dict, empty if they can not be read
+    """
+    counters = dict()
+    try:
+        with open("/proc/self/io") as io_file:
+            for line in io_file:
+                key, _, value = line.partition(":")
+                if key in IO_FIELDS:
+                    counters[key] = int(value)
+    except (IOError, OSError, ValueError):
+        pass
+    return counters
+
+
+def snapshot():
+    """
+    Clocks and resource usage at this point
+    :return:
+    """
+    rself = resource.getrusage(resource.RUSAGE_SELF)
+    rchildren = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {"time": time.time(), "user": rself.ru_utime, "system": rself.ru_stime,
+            "maxrss_kb": rself.ru_maxrss, "children_user": rchildren.ru_utime,
+            "children_system": rchildren.ru_stime, "children_maxrss_kb": rchildren.ru_maxrss,
+            "command_runs": Command.spawned, "io": read_proc_io()}
+
+
+def usage(begin, end):
+    """
+    Resource usage between two snapshots
+    :param begin:
+    :param end:
+    :return:
+    """
+    return {"wall": end["time"] - begin["time"],
+            "cpu_user": end["user"] - begin["user"],
+            "cpu_system": end["system"] - begin["system"],
+            "children_user": end["children_user"] - begin["children_user"],
+            "children_system": end["children_system"] - begin["children_system"],
+            # high water marks, they only grow
+            "maxrss_kb": end["maxrss_kb"],
+            "children_maxrss_kb": end["children_maxrss_kb"],
+            # processes started through Command, not os.system or subprocess
+            "command_runs": end["command_runs"] - begin["command_runs"],
+            "io": {key: end["io"][key] - begin["io"].get(key, 0) for key in end["io"]}}
+
+
+class Recorder:
+    """
+    Spans and metrics of one testcase
+    """
+    def __init__(self, name):
+        self.name = name
+        self.spans = list()
+        self.metrics = list()
+        self.outputs = list()
+        self.stack = list()
+        self.begin = snapshot()
+        self.total = None
+
+    @contextmanager
+    def span(self, name):
+        """
+        Time a block, spans opened inside it are named after it
+        :param name:
+        :return:
+        """
+        path = "/".join(self.stack + [name])
+        self.stack.append(name)
+        begin = snapshot()
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            record = {"name": path, "start": begin["time"] - self.begin["time"]}
+            record.update(usage(begin, snapshot()))
+            self.spans.append(record)
+
+    def metric(self, name, value, unit=None):
+        """
+        Record a value reported by the test
+        :param name:
+        :param value:
+        :param unit:
+        :return:
+        """
+        self.metrics.append({"name": name, "value": value, "unit": unit,
+                             "span": "/".join(self.stack) or None})
+
+    def output(self, path):
+        """
+        Register a json output saved by the test
+        :param path:
+        :return:
+        """
+        if path not in self.outputs:
+            self.outputs.append(path)
+
+    def stop(self):
+        """
+        Close the testcase
+        :return:
+        """
+        self.total = usage(self.begin, snapshot())
+
+    def to_dict(self):
+        """
+        The recorded data as a json document
+        :return:
+        """
+        return {"name": self.name, "started": self.begin["time"], "total": self.total,
+                "spans": sorted(self.spans, key=lambda span: span["start"]),
+                "metrics": self.metrics, "outputs": self.outputs}
+
+
+def start_testcase(name):
+    """
+    Start recording a testcase, span() and metric() report to it
+    :param name:
+    :return:
+    """
+    global _current
+    with _lock:
+        _current = Recorder(name)
+    return _current
+
+
+def stop_testcase():
+    """
+    Stop recording the current testcase
+    :return: its recorder, None if there is none
+    """
+    global _current
+    with _lock:
+        recorder, _current = _current, None
+    if recorder:
+        recorder.stop()
+    return recorder
+
+
+@contextmanager
+def span(name):
+    """
+    Time a block of the current testcase, does nothing outside a job
+    :param name:
+    :return:
+    """
+    recorder = _current
+    if not recorder:
+        yield
+        return
+    with recorder.span(name):
+        yield
+
+
+def metric(name, value, unit=None):
+    """
+    Report a value of the current testcase, ignored outside a job
+    :param name:
+    :param value:
+    :param unit:
+    :return:
+    """
+    recorder = _current
+    if recorder:
+        recorder.metric(name, value, unit)
+
+
+def output(path):
+    """
+    Register a json output of the current testcase, its metrics are kept
+    in the result history, ignored outside a job
+    :param path:
+    :return:
+    """
+    recorder = _current
+    if recorder:
+        recorder.output(path)
+
+
+def format_duration(seconds):
+    """
+    Short human readable duration
+    :param seconds:
+    :return:
+    """
+    if seconds is None:
+        return "-"
+    if seconds < 60:
+        return "%.1fs" % seconds
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes < 60:
+        return "%dm%02ds" % (minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return "%dh%02dm%02ds" % (hours, minutes, seconds)
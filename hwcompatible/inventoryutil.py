@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2020 Huawei Technologies Co., Ltd.
+# oec-hardware is licensed under the Mulan PSL v2.
+# You can use this software according to the terms and conditions of the Mulan PSL v2.
+# You may obtain a copy of Mulan PSL v2 at:
+#     http://license.coscl.org.cn/MulanPSL2
+# THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+# PURPOSE.
+# See the Mulan PSL v2 for more details.
+# Create: 2020-04-01
+
+"""System inventory: SMBIOS records, uname and loaded modules"""
+
+import os
+import re
+import time
+import struct
+
+from .command import Command, CertCommandError
+
+DMI_TABLE = "/sys/firmware/dmi/tables/DMI"
+DMI_ENTRY_POINT = "/sys/firmware/dmi/tables/smbios_entry_point"
+DMI_TYPE_BIOS = 0
+DMI_TYPE_SYSTEM = 1
+DMI_TYPE_BASEBOARD = 2
+DMI_TYPE_CHASSIS = 3
+DMI_TYPE_PROCESSOR = 4
+DMI_TYPE_MEMORY_DEVICE = 17
+DMI_TYPE_IPMI = 38
+DMI_TYPE_END = 127
+# string fields decoded from the raw table when dmidecode is not installed,
+# as (offset in the formatted area, property name)
+RAW_STRING_FIELDS = {
+    DMI_TYPE_BIOS: [(0x04, "Vendor"), (0x05, "Version"), (0x08, "Release Date")],
+    DMI_TYPE_SYSTEM: [(0x04, "Manufacturer"), (0x05, "Product Name"), (0x06, "Version"),
+                      (0x07, "Serial Number"), (0x19, "SKU Number"), (0x1A, "Family")],
+    DMI_TYPE_BASEBOARD: [(0x04, "Manufacturer"), (0x05, "Product Name"), (0x06, "Version"),
+                         (0x07, "Serial Number")],
+    DMI_TYPE_CHASSIS: [(0x04, "Manufacturer"), (0x06, "Version"), (0x07, "Serial Number")],
+    DMI_TYPE_PROCESSOR: [(0x04, "Socket Designation"), (0x07, "Manufacturer"),
+                         (0x10, "Version")],
+    DMI_TYPE_MEMORY_DEVICE: [(0x10, "Locator"), (0x11, "Bank Locator"), (0x17, "Manufacturer"),
+                             (0x18, "Serial Number"), (0x1A, "Part Number")],
+}
+RAW_TYPE_NAMES = {
+    DMI_TYPE_BIOS: "BIOS Information",
+    DMI_TYPE_SYSTEM: "System Information",
+    DMI_TYPE_BASEBOARD: "Base Board Information",
+    DMI_TYPE_CHASSIS: "Chassis Information",
+    DMI_TYPE_PROCESSOR: "Processor Information",
+    DMI_TYPE_MEMORY_DEVICE: "Memory Device",
+    DMI_TYPE_IPMI: "IPMI Device Information",
+    DMI_TYPE_END: "End Of Table",
+}
+
+_inventory = None
+
+
+def parse_dmidecode(lines):
+    """
+    Parse the output of dmidecode into records
+    :param lines:
+    :return: (SMBIOS version, list of record dicts)
+    """
+    header = re.compile(r"^Handle (0x[0-9A-Fa-f]+), DMI type (\d+), (\d+) bytes")
+    version = ""
+    records = list()
+    record = None
+    key = None
+    for line in lines:
+        match = re.match(r"^SMBIOS ([\d.]+) present", line)
+        if match:
+            version = match.group(1)
+            continue
+        match = header.match(line)
+        if match:
+            record = {"handle": match.group(1), "type": int(match.group(2)),
+                      "length": int(match.group(3)), "name": "", "properties": dict()}
+            records.append(record)
+            key = None
+            continue
+        if record is None or not line.strip():
+            continue
+        if not line.startswith("\t"):
+            record["name"] = line.strip()
+        elif line.startswith("\t\t"):
+            # items of a list property such as Characteristics
+            if key:
+                record["properties"][key].append(line.strip())
+        else:
+            name, _, value = line.strip().partition(":")
+            value = value.strip()
+            if value:
+                record["properties"][name] = value
+                key = None
+            else:
+                record["properties"][name] = list()
+                key = name
+    return version, records
+
+
+def parse_dmi_table(data):
+    """
+    Parse a raw SMBIOS table into records, decoding the strings of the
+    common structure types only
+    :param data:
+    :return: list of record dicts
+    """
+    records = list()
+    pos = 0
+    while pos + 4 <= len(data):
+        dmi_type, length, handle = struct.unpack_from("<BBH", data, pos)
+        if length < 4:
+            break
+        end = data.find(b"\0\0", pos + length)
+        if end < 0:
+            break
+        strings = data[pos + length:end].split(b"\0")
+        properties = dict()
+        for offset, name in RAW_STRING_FIELDS.get(dmi_type, []):
+            if offset >= length:
+                continue
+            index = data[pos + offset]
+            if 0 < index <= len(strings):
+                properties[name] = strings[index - 1].decode("utf8", "replace").strip()
+        records.append({"handle": "0x%04X" % handle, "type": dmi_type, "length": length,
+                        "name": RAW_TYPE_NAMES.get(dmi_type, "DMI type %d" % dmi_type),
+                        "properties": properties})
+        if dmi_type == DMI_TYPE_END:
+            break
+        pos = end + 2
+    return records
+
+
+def read_smbios():
+    """
+    Read SMBIOS with a single dmidecode call, or from the sysfs table
+    when dmidecode is not available
+    :return: (SMBIOS version, list of record dicts, source)
+    """
+    comm = Command("dmidecode")
+    try:
+        comm.run_quiet()
+        version, records = parse_dmidecode(comm.output or [])
+        if records:
+            return version, records, "dmidecode"
+    except CertCommandError:
+        pass
+
+    try:
+        with open(DMI_TABLE, "rb") as table_file:
+            records = parse_dmi_table(table_file.read())
+        with open(DMI_ENTRY_POINT, "rb") as entry_file:
+            entry = entry_file.read()
+    except (IOError, OSError):
+        return "", [], None
+    version = ""
+    if entry[:5] == b"_SM3_":
+        version = "%d.%d.%d" % (entry[7], entry[8], entry[9])
+    elif entry[:4] == b"_SM_":
+        version = "%d.%d" % (entry[6], entry[7])
+    return version, records, "sysfs"
+
+
+def read_modules():
+    """
+    Loaded kernel modules from /proc/modules
+    :return: list of module dicts
+    """
+    modules = list()
+    try:
+        with open("/proc/modules") as modules_file:
+            lines = modules_file.readlines()
+    except (IOError, OSError):
+        return modules
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 6:
+            continue
+        taints = fields[6].strip("()") if len(fields) > 6 else ""
+        modules.append({"name": fields[0], "size": int(fields[1]), "refcount": fields[2],
+                        "used_by": [dep for dep in fields[3].split(",") if dep and dep != "-"],
+                        "state": fields[4], "taints": taints})
+    return modules
+
+
+class SystemInventory:
+    """
+    Snapshot of the system the job runs on, shared by everything that
+    used to run dmidecode, lsmod or uname on its own
+    """
+    def __init__(self):
+        self.smbios_version = ""
+        self.smbios_source = None
+        self.records = list()
+        self.uname = dict()
+        self.modules = list()
+        self.collected = None
+        self.load()
+
+    def load(self):
+        """
+        Collect the inventory
+        :return:
+        """
+        self.smbios_version, self.records, self.smbios_source = read_smbios()
+        uname = os.uname()
+        self.uname = {"sysname": uname.sysname, "nodename": uname.nodename,
+                      "release": uname.release, "version": uname.version,
+                      "machine": uname.machine}
+        self.modules = read_modules()
+        self.collected = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def get_records(self, dmi_type):
+        """
+        SMBIOS records of one type
+        :param dmi_type:
+        :return:
+        """
+        return [record for record in self.records if record["type"] == dmi_type]
+
+    def get_properties(self, dmi_type):
+        """
+        Properties of the first record of a type
+        :param dmi_type:
+        :return: dict, empty if there is no such record
+        """
+        records = self.get_records(dmi_type)
+        return records[0]["properties"] if records else dict()
+
+    def get_system(self):
+        """
+        Manufacturer, product name and version of the system
+        :return:
+        """
+        system = self.get_properties(DMI_TYPE_SYSTEM)
+        return {key: system.get(key, "") for key in ["Manufacturer", "Product Name", "Version"]}
+
+    def has_ipmi(self):
+        """
+        Whether the firmware describes an IPMI device
+        :return:
+        """
+        return bool(self.get_records(DMI_TYPE_IPMI))
+
+    def to_dict(self):
+        """
+        The inventory as a JSON document
+        :return:
+        """
+        return {"collected": self.collected, "uname": self.uname,
+                "smbios": {"version": self.smbios_version, "source": self.smbios_source,
+                           "records": self.records},
+                "modules": self.modules}
+
+    def show(self):
+        """
+        Print a summary of the inventory
+        :return:
+        """
+        print("%(sysname)s %(nodename)s %(release)s %(version)s %(machine)s" % self.uname)
+        print("")
+        print("Module".ljust(28) + "Size".rjust(8) + "  Used by")
+        for module in self.modules:
+            print(module["name"].ljust(28) + str(module["size"]).rjust(8) + "  "
+                  + module["refcount"] + " " + ",".join(module["used_by"]))
+        print("")
+        if not self.records:
+            print("Warning: SMBIOS is not available.")
+            return
+        print("SMBIOS %s present, %d structures." % (self.smbios_version, len(self.records)))
+        for dmi_type in [DMI_TYPE_BIOS, DMI_TYPE_SYSTEM, DMI_TYPE_BASEBOARD, DMI_TYPE_CHASSIS]:
+            for record in self.get_records(dmi_type):
+                print(record["name"])
+                for key, value in record["properties"].items():
+                    if not isinstance(value, list):
+                        print("    %s: %s" % (key, value))
+
+
+def get_system_inventory(refresh=False):
+    """
+    The shared system inventory, collected on first use
+    :param refresh: collect it again
+    :return:
+    """
+    global _inventory
+    if _inventory is None:
+        _inventory = SystemInventory()
+    elif refresh:
+        _inventory.load()
+    return _inventory
@@ -16,16 +16,22 @@
 
 import os
 import sys
+import time
 import string
 import random
 import argparse
+import sqlite3
 
-from .test import Test
+from . import rpmutil
 from .env import CertEnv
-from .command import Command, CertCommandError
 from .commandUI import CommandUI
 from .log import Logger
+from .document import Document
+from . import instrument
 from .reboot import Reboot
+from .testregistry import get_test_registry
+from .jobstate import JobState
+from .history import ResultHistory
 
 
 class Job():
@@ -43,9 +49,12 @@ class Job():
         self.args = args or argparse.Namespace()
         self.test_factory = getattr(args, "test_factory", [])
         self.test_suite = []
-        self.job_id = ''.join(random.sample(string.ascii_letters + string.digits, 10))
+        self.job_id = getattr(args, "job_id", None) or \
+            ''.join(random.sample(string.ascii_letters + string.digits, 10))
         self.com_ui = CommandUI()
         self.subtests_filter = getattr(args, "subtests_filter", None)
+        self.installer = None
+        self.state = None
 
         self.test_parameters = None
         if "test_parameters" in self.args:
@@ -64,40 +73,13 @@ class Job():
             print("testname not specified, discover test failed")
             return None
 
-        filename = testname + ".py"
-        dirpath = ''
-        for (dirpath, dirs, files) in os.walk(CertEnv.testdirectoy):
-            if filename in files:
-                break
-        pth = os.path.join(dirpath, filename)
-        if not os.access(pth, os.R_OK):
+        registry = get_test_registry()
+        entry = registry.get(testname)
+        if not entry:
             return None
-
-        sys.path.insert(0, dirpath)
-        # try:
-        module = __import__(testname, globals(), locals())
-        # except Exception as concrete_error:
-        #     print("Error: module import failed for %s" % testname)
-        #     print(concrete_error)
-        #     return None
-
-        for thing in dir(module):
-            test_class = getattr(module, thing)
-            try:
-                from types import ClassType as ct
-            except ImportError:
-                ct = type
-            if isinstance(test_class, ct) and issubclass(test_class, Test):
-                if "test" not in dir(test_class):
-                    continue
-                if (subtests_filter and not subtests_filter in dir(test_class)):
-                    continue
-                test = test_class()
-                if "pri" not in dir(test):
-                    continue
-                return test
-
-        return None
+        if subtests_filter and subtests_filter not in entry["methods"]:
+            return None
+        return registry.create(testname)
 
     def create_test_suite(self, subtests_filter=None):
         """
@@ -111,10 +93,12 @@ class Job():
         self.test_suite = []
         for test in self.test_factory:
             if test["run"]:
-                testclass = self.discover(test["name"], subtests_filter)
-                if testclass:
+                entry = get_test_registry().get(test["name"])
+                if entry and (not subtests_filter or subtests_filter in entry["methods"]):
                     testcase = dict()
-                    testcase["test"] = testclass
+                    # the test is instantiated when it runs
+                    testcase["test"] = None
+                    testcase["entry"] = entry
                     testcase["name"] = test["name"]
                     testcase["device"] = test["device"]
                     testcase["status"] = "FAIL"
@@ -129,30 +113,78 @@ class Job():
 
     def check_test_depends(self):
         """
-        Install  dependency packages
-        :return: depending
+        Check the packages required by the tests in one rpm query, the
+        missing ones are installed while the tests that neither need them
+        nor measure performance run
+        :return:
         """
-        required_rpms = []
-        for tests in self.test_suite:
-            for pkg in tests["test"].requirements:
-                try:
-                    Command("rpm -q " + pkg).run_quiet()
-                except CertCommandError:
-                    if not pkg in required_rpms:
-                        required_rpms.append(pkg)
+        needed_by = dict()
+        for testcase in self.test_suite:
+            if testcase.get("resumed"):
+                continue
+            for pkg in self.get_attribute(testcase, "requirements"):
+                needed_by.setdefault(pkg, set()).add(testcase["name"])
+        if not needed_by:
+            return
 
-        if len(required_rpms):
-            print("Installing required packages: %s" % ", ".join(required_rpms))
-            try:
-                cmd = Command("yum install -y " + " ".join(required_rpms))
-                cmd.echo()
-            except CertCommandError as concrete_error:
-                print(concrete_error)
-                print("Fail to install required packages.")
-                return False
+        missing = rpmutil.get_missing_packages(needed_by)
+        print("Package".ljust(28) + "Status".ljust(12) + "Needed by")
+        for pkg in sorted(needed_by):
+            status = "missing" if pkg in missing else "installed"
+            print(pkg.ljust(28) + status.ljust(12) + ", ".join(sorted(needed_by[pkg])))
+        print("")
+
+        if missing:
+            print("Installing required packages: %s" % ", ".join(sorted(missing)))
+            self.installer = rpmutil.PackageInstaller(missing)
+            self.installer.start()
 
+    def wait_test_depends(self, testcase):
+        """
+        Wait for the installation of the packages a test requires, and for
+        the whole installation before a benchmark so that yum does not skew
+        its numbers
+        :param testcase:
+        :return: True if they are installed
+        """
+        if not self.installer:
+            return True
+        requirements = set(self.get_attribute(testcase, "requirements"))
+        needed = requirements & set(self.installer.packages)
+        if not needed and not self.get_attribute(testcase, "benchmark"):
+            return True
+        if self.installer.wait() or not needed:
+            return True
+        missing = rpmutil.get_missing_packages(requirements)
+        if missing:
+            print("Error: %s requires %s, which could not be installed." %
+                  (testcase["name"], ", ".join(sorted(missing))))
+            return False
         return True
 
+    def get_test(self, testcase, subtests_filter=None):
+        """
+        Instantiate the test of a testcase on first use
+        :param testcase:
+        :param subtests_filter:
+        :return:
+        """
+        if not testcase["test"]:
+            testcase["test"] = self.discover(testcase["name"], subtests_filter)
+        return testcase["test"]
+
+    def get_attribute(self, testcase, name):
+        """
+        An attribute of a test, from the registry unless its constructor
+        computes it
+        :param testcase:
+        :param name: pri, requirements, reboot, rebootup or benchmark
+        :return:
+        """
+        if name not in testcase["entry"]["dynamic"]:
+            return testcase["entry"][name]
+        return getattr(self.get_test(testcase), name)
+
     def _run_test(self, testcase, subtests_filter=None):
         """
         Start a testing item
@@ -167,32 +199,48 @@ class Job():
         reboot = None
         test = None
         logger = None
+        recorder = instrument.start_testcase(name)
         try:
-            test = testcase["test"]
             logger = Logger(logname, self.job_id, sys.stdout, sys.stderr)
             logger.start()
+            with recorder.span("load"):
+                test = self.get_test(testcase, subtests_filter)
             if subtests_filter:
-                return_code = getattr(test, subtests_filter)()
+                with recorder.span(subtests_filter):
+                    return_code = getattr(test, subtests_filter)()
             else:
                 print("----  start to run test %s  ----" % name)
-                args = argparse.Namespace(device=testcase["device"], logdir=logger.log.dir)
-                test.setup(args)
+                # devices of the testcases of the same test in this job, for
+                # tests that run on several of them at once
+                devices = [other["device"] for other in self.test_suite
+                           if other["name"] == testcase["name"] and not other.get("resumed")]
+                args = argparse.Namespace(device=testcase["device"], devices=devices,
+                                          logdir=logger.log.dir)
+                with recorder.span("setup"):
+                    test.setup(args)
                 if test.reboot:
                     reboot = Reboot(testcase["name"], self, test.rebootup)
                     return_code = False
                     if reboot.setup():
-                        return_code = test.test()
+                        with recorder.span("test"):
+                            return_code = test.test()
                 else:
-                    return_code = test.test()
+                    with recorder.span("test"):
+                        return_code = test.test()
         except Exception as concrete_error:
             print(concrete_error)
             return_code = False
 
         if reboot:
             reboot.clean()
-        if not subtests_filter:
-            test.teardown()
-        logger.stop()
+        if test and not subtests_filter:
+            with recorder.span("teardown"):
+                test.teardown()
+        instrument.stop_testcase()
+        testcase["metrics"] = recorder.to_dict()
+        testcase["outputs"] = list(recorder.outputs)
+        if logger:
+            logger.stop()
         print("")
         return return_code
 
@@ -206,12 +254,59 @@ class Job():
             print("No test to run.")
             return
 
-        self.test_suite.sort(key=lambda k: k["test"].pri)
+        self.test_suite.sort(key=lambda k: self.get_attribute(k, "pri"))
         for testcase in self.test_suite:
-            if self._run_test(testcase, subtests_filter):
+            if testcase.get("resumed"):
+                continue
+            if not self.wait_test_depends(testcase):
+                testcase["status"] = "FAIL"
+                self.checkpoint(testcase, "FAIL")
+                self.record_history(testcase)
+                continue
+            self.checkpoint(testcase, "running")
+            testcase["started"] = time.time()
+            return_code = self._run_test(testcase, subtests_filter)
+            testcase["duration"] = time.time() - testcase["started"]
+            if return_code:
                 testcase["status"] = "PASS"
             else:
                 testcase["status"] = "FAIL"
+            self.checkpoint(testcase, testcase["status"])
+            self.record_history(testcase)
+            self.save_metrics()
+
+    def record_history(self, testcase):
+        """
+        Record a completed testcase in the result history, right away so
+        that the testcases before a crash or reboot test are kept too
+        :param testcase:
+        :return:
+        """
+        try:
+            history = ResultHistory()
+            history.add_testcase(history.get_run(self.job_id), testcase)
+            history.close()
+        except sqlite3.Error as concrete_error:
+            print("Warning: could not record %s in result history: %s"
+                  % (testcase["name"], concrete_error))
+
+    def save_metrics(self):
+        """
+        Save the timing and resource usage of the testcases run so far
+        :return:
+        """
+        metrics = [testcase["metrics"] for testcase in self.test_suite if "metrics" in testcase]
+        logdir = os.path.join(CertEnv.logdirectoy, self.job_id)
+        if not metrics or not os.path.isdir(logdir):
+            return
+        metrics_doc = Document(os.path.join(logdir, "metrics.json"))
+        if metrics_doc.load():
+            # testcases of the run this job resumed
+            names = [recorder["name"] for recorder in metrics]
+            metrics = [recorder for recorder in metrics_doc.document
+                       if recorder["name"] not in names] + metrics
+        metrics_doc.document = metrics
+        metrics_doc.save()
 
     def run(self):
         """
@@ -221,37 +316,119 @@ class Job():
         logger = Logger("job.log", self.job_id, sys.stdout, sys.stderr)
         logger.start()
         self.create_test_suite(self.subtests_filter)
-        if not self.check_test_depends():
-            print("Required rpm package not installed, test stopped.")
-        else:
-            self.run_tests(self.subtests_filter)
+        self.load_checkpoints()
+        self.check_test_depends()
+        self.run_tests(self.subtests_filter)
+        if self.installer:
+            self.installer.wait()
         self.save_result()
+        if self.state:
+            self.state.finish_job(self.job_id)
+            self.state.close()
         logger.stop()
         self.show_summary()
 
+    def load_checkpoints(self):
+        """
+        Open the job state store, testcases a previous run of this job
+        completed are not run again
+        :return:
+        """
+        try:
+            self.state = JobState()
+            self.state.start_job(self.job_id, self.test_factory)
+            checkpoints = self.state.get_testcases(self.job_id)
+        except sqlite3.Error as concrete_error:
+            print("Warning: job state not available, the job can not be resumed: %s"
+                  % concrete_error)
+            self.state = None
+            return
+
+        for testcase in self.test_suite:
+            status = checkpoints.get((testcase["name"], testcase["device"].path or ""))
+            if status in ["PASS", "FAIL"]:
+                testcase["status"] = status
+                testcase["resumed"] = True
+                print("%s already completed: %s" % (testcase["name"], status))
+            elif status == "running" and not self.subtests_filter:
+                # it crashed or hung the system, do not run it in a loop
+                testcase["status"] = "FAIL"
+                testcase["resumed"] = True
+                print("Error: %s was interrupted." % testcase["name"])
+
+    def checkpoint(self, testcase, status):
+        """
+        Record the status of a testcase in the job state store
+        :param testcase:
+        :param status:
+        :return:
+        """
+        if not self.state:
+            return
+        try:
+            self.state.set_testcase(self.job_id, testcase, status)
+        except sqlite3.Error as concrete_error:
+            print("Warning: could not save job state: %s" % concrete_error)
+
     def show_summary(self):
         """
         Command line interface display summary
         :return:
         """
         print("-------------  Summary  -------------")
+        print("Test".ljust(33) + "Status".ljust(8) + "Time".ljust(12) + "Setup".ljust(10)
+              + "Test".ljust(12) + "CPU".ljust(10) + "Command runs")
         for test in self.test_factory:
             if test["run"]:
                 name = test["name"]
                 if test["device"].get_name():
                     name = test["name"] + "-" + test["device"].get_name()
                 if test["status"] == "PASS":
-                    print(name.ljust(33) + "\033[0;32mPASS\033[0m")
+                    status = "\033[0;32mPASS\033[0m    "
                 else:
-                    print(name.ljust(33) + "\033[0;31mFAIL\033[0m")
+                    status = "\033[0;31mFAIL\033[0m    "
+                timing = "-"
+                recorder = self.get_metrics(test)
+                if recorder and recorder["total"]:
+                    total = recorder["total"]
+                    phases = dict((span["name"], span["wall"]) for span in recorder["spans"])
+                    cpu = total["cpu_user"] + total["cpu_system"] + total["children_user"] \
+                        + total["children_system"]
+                    timing = instrument.format_duration(total["wall"]).ljust(12) \
+                        + instrument.format_duration(phases.get("setup")).ljust(10) \
+                        + instrument.format_duration(phases.get("test")).ljust(12) \
+                        + instrument.format_duration(cpu).ljust(10) + str(total["command_runs"])
+                print(name.ljust(33) + status + timing)
         print("")
 
+    def get_metrics(self, test):
+        """
+        Timing and resource usage recorded for a test of the factory
+        :param test:
+        :return: dict, None if it did not run in this job
+        """
+        for testcase in self.test_suite:
+            if test["name"] == testcase["name"] and test["device"].path == \
+                    testcase["device"].path:
+                return testcase.get("metrics")
+        return None
+
     def save_result(self):
         """
-        Get test status
+        Get test status, for the testcases run before a reboot from the job
+        state store
         :return:
         """
+        checkpoints = dict()
+        if self.state:
+            try:
+                checkpoints = self.state.get_testcases(self.job_id)
+            except sqlite3.Error as concrete_error:
+                print("Warning: could not read job state: %s" % concrete_error)
         for test in self.test_factory:
+            status = checkpoints.get((test["name"], test["device"].path or ""))
+            if status in ["PASS", "FAIL"]:
+                test["status"] = status
             for testcase in self.test_suite:
                 if test["name"] == testcase["name"] and test["device"].path == \
                         testcase["device"].path:
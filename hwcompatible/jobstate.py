@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2020 Huawei Technologies Co., Ltd.
+# oec-hardware is licensed under the Mulan PSL v2.
+# You can use this software according to the terms and conditions of the Mulan PSL v2.
+# You may obtain a copy of Mulan PSL v2 at:
+#     http://license.coscl.org.cn/MulanPSL2
+# THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+# PURPOSE.
+# See the Mulan PSL v2 for more details.
+# Create: 2020-04-01
+
+"""Checkpoints of the running job, to resume it after a crash or power loss"""
+
+import os
+import json
+import time
+import sqlite3
+
+from .env import CertEnv
+from .document import FactoryDocument
+
+STATE_DB = os.path.join(CertEnv.datadirectory, "jobstate.db")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY, state TEXT, created REAL, updated REAL, factory TEXT);
+CREATE TABLE IF NOT EXISTS testcases (
+    job_id TEXT, name TEXT, device TEXT, status TEXT, updated REAL,
+    PRIMARY KEY (job_id, name, device));
+"""
+
+
+class JobState:
+    """
+    SQLite store of the job in progress and of the status of each of its
+    testcases, every update is one small synced transaction in the
+    write-ahead log instead of a rewrite of factory.json
+    """
+    def __init__(self, filename=STATE_DB):
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        """
+        Close the store
+        :return:
+        """
+        self.conn.close()
+
+    def start_job(self, job_id, test_factory):
+        """
+        Record a job, a job already recorded keeps its testcases
+        :param job_id:
+        :param test_factory:
+        :return:
+        """
+        factory = json.dumps(FactoryDocument(None, test_factory).document) \
+            if test_factory else "[]"
+        now = time.time()
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO jobs (job_id, state, created, updated, "
+                              "factory) VALUES (?, 'running', ?, ?, ?)",
+                              (job_id, now, now, factory))
+            self.conn.execute("UPDATE jobs SET state = 'running', updated = ? WHERE job_id = ?",
+                              (now, job_id))
+
+    def set_testcase(self, job_id, testcase, status):
+        """
+        Record the status of a testcase: running, PASS or FAIL
+        :param job_id:
+        :param testcase:
+        :param status:
+        :return:
+        """
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO testcases (job_id, name, device, status, "
+                              "updated) VALUES (?, ?, ?, ?, ?)",
+                              (job_id, testcase["name"], testcase["device"].path or "",
+                               status, time.time()))
+
+    def get_testcases(self, job_id):
+        """
+        Recorded status of the testcases of a job
+        :param job_id:
+        :return: dict of (name, device path) -> status
+        """
+        rows = self.conn.execute("SELECT name, device, status FROM testcases WHERE job_id = ?",
+                                 (job_id,))
+        return {(name, device): status for name, device, status in rows}
+
+    def finish_job(self, job_id, state="done"):
+        """
+        Mark a job as finished or abandoned, its checkpoints are dropped
+        :param job_id:
+        :param state: done or abandoned
+        :return:
+        """
+        with self.conn:
+            self.conn.execute("UPDATE jobs SET state = ?, updated = ? WHERE job_id = ?",
+                              (state, time.time(), job_id))
+            self.conn.execute("DELETE FROM testcases WHERE job_id = ?", (job_id,))
+
+    def get_interrupted(self):
+        """
+        The latest job that did not finish
+        :return: (job_id, test_factory, testcase status dict), None if there is none
+        """
+        row = self.conn.execute("SELECT job_id, factory FROM jobs WHERE state = 'running' "
+                                "ORDER BY updated DESC LIMIT 1").fetchone()
+        if not row:
+            return None
+        factory_doc = FactoryDocument(None)
+        factory_doc.document = json.loads(row[1])
+        return row[0], factory_doc.get_factory(), self.get_testcases(row[0])
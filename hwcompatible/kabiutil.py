@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2020 Huawei Technologies Co., Ltd.
+# oec-hardware is licensed under the Mulan PSL v2.
+# You can use this software according to the terms and conditions of the Mulan PSL v2.
+# You may obtain a copy of Mulan PSL v2 at:
+#     http://license.coscl.org.cn/MulanPSL2
+# THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+# PURPOSE.
+# See the Mulan PSL v2 for more details.
+# Create: 2020-04-01
+
+"""kABI check of kernel modules against the whitelist and symbol CRCs"""
+
+import os
+import gzip
+import lzma
+import json
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .command import Command
+from .env import CertEnv
+
+CACHE_FILE = os.path.join(CertEnv.datadirectory, "kabi-cache.json")
+# struct modversion_info is 64 bytes: an unsigned long crc, then the name
+MODVERSION_SIZE = 64
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def open_module(path):
+    """
+    Open a module file, uncompressing .ko.xz and .ko.gz
+    :param path:
+    :return: file object
+    """
+    if path.endswith(".xz"):
+        return lzma.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_modversions(path):
+    """
+    Read the symbol CRCs a module was built against from the __versions
+    section of its ELF file
+    :param path: .ko, .ko.xz or .ko.gz
+    :return: dict of symbol -> crc
+    """
+    with open_module(path) as module_file:
+        data = module_file.read()
+    if data[:4] != b"\x7fELF":
+        raise ValueError("%s is not an ELF file" % path)
+
+    endian = "<" if data[5] == 1 else ">"
+    if data[4] == 2:
+        e_shoff = struct.unpack_from(endian + "Q", data, 0x28)[0]
+        e_shentsize, e_shnum, e_shstrndx = struct.unpack_from(endian + "HHH", data, 0x3A)
+        # sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size
+        section_format = endian + "IIQQQQ"
+        crc_format = endian + "Q"
+        word = 8
+    else:
+        e_shoff = struct.unpack_from(endian + "I", data, 0x20)[0]
+        e_shentsize, e_shnum, e_shstrndx = struct.unpack_from(endian + "HHH", data, 0x2E)
+        section_format = endian + "IIIIII"
+        crc_format = endian + "I"
+        word = 4
+
+    sections = [struct.unpack_from(section_format, data, e_shoff + index * e_shentsize)
+                for index in range(e_shnum)]
+    names_offset = sections[e_shstrndx][4]
+    versions = dict()
+    for section in sections:
+        start = names_offset + section[0]
+        if data[start:data.index(b"\0", start)] != b"__versions":
+            continue
+        offset, size = section[4], section[5]
+        for pos in range(offset, offset + size, MODVERSION_SIZE):
+            crc = struct.unpack_from(crc_format, data, pos)[0] & 0xffffffff
+            name = data[pos + word:pos + MODVERSION_SIZE].split(b"\0", 1)[0]
+            versions[name.decode("utf8", "ignore")] = crc
+        break
+    return versions
+
+
+def parse_whitelist(path):
+    """
+    Symbols of a kabi whitelist or greylist, group headers such as
+    [openeuler_x86_64_whitelist] are skipped
+    :param path:
+    :return: list of symbols
+    """
+    symbols = list()
+    with open(path, "r") as whitelist_file:
+        for line in whitelist_file:
+            line = line.strip()
+            if line and not line.startswith("["):
+                symbols.append(line)
+    return symbols
+
+
+def parse_symvers(path):
+    """
+    Symbol CRCs exported by the kernel, from Module.symvers or
+    /boot/symvers-<kernel>.gz
+    :param path:
+    :return: dict of symbol -> crc
+    """
+    crcs = dict()
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as symvers_file:
+        for line in symvers_file:
+            fields = line.split()
+            if len(fields) >= 2:
+                try:
+                    crcs[fields[1]] = int(fields[0], 16)
+                except ValueError:
+                    continue
+    return crcs
+
+
+def load_cache():
+    """
+    Parsed whitelists and symvers saved by previous runs
+    :return:
+    """
+    global _cache
+    if _cache is None:
+        try:
+            with open(CACHE_FILE, "r") as cache_file:
+                _cache = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            _cache = dict()
+    return _cache
+
+
+def save_cache():
+    """
+    Save the parsed files for the next run
+    :return:
+    """
+    try:
+        with open(CACHE_FILE, "w") as cache_file:
+            json.dump(load_cache(), cache_file)
+    except (IOError, OSError) as concrete_error:
+        print("Warning: could not save kabi cache: %s" % concrete_error)
+
+
+def load_cached(path, parser):
+    """
+    Parse a file once, then reuse the result until its mtime or size changes
+    :param path:
+    :param parser: parse_whitelist or parse_symvers
+    :return: result of the parser
+    """
+    stat = os.stat(path)
+    key = "%s:%s" % (parser.__name__, path)
+    with _cache_lock:
+        cache = load_cache()
+        entry = cache.get(key)
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return entry["data"]
+    data = parser(path)
+    with _cache_lock:
+        load_cache()[key] = {"mtime": stat.st_mtime, "size": stat.st_size, "data": data}
+        save_cache()
+    return data
+
+
+def find_whitelist(arch, kernel):
+    """
+    Path of the kabi whitelist of the running kernel
+    :param arch:
+    :param kernel:
+    :return: path, None if there is none
+    """
+    for whitelist in ["/lib/modules/kabi-current/kabi_whitelist_" + arch,
+                      "/lib/modules/kabi/kabi_whitelist_" + arch,
+                      "/usr/src/kernels/%s/kabi_whitelist" % kernel]:
+        if os.path.exists(whitelist):
+            return whitelist
+    return None
+
+
+def find_symvers(kernel):
+    """
+    Path of the symbol CRCs of the running kernel
+    :param kernel:
+    :return: path, None if there is none
+    """
+    for symvers in ["/boot/symvers-%s.gz" % kernel,
+                    "/usr/src/kernels/%s/Module.symvers" % kernel,
+                    "/lib/modules/%s/build/Module.symvers" % kernel]:
+        if os.path.exists(symvers):
+            return symvers
+    return None
+
+
+def get_module_file(module):
+    """
+    File of a loaded module
+    :param module:
+    :return: path, None if modinfo does not know it
+    """
+    try:
+        module_file = Command("modinfo -F filename %s" % module).get_str()
+    except Exception:
+        return None
+    return os.path.realpath(module_file)
+
+
+def check_module(module, whitelist, symvers):
+    """
+    Check the symbols a module uses against the whitelist, the greylist
+    shipped with its kmod package and the kernel CRCs
+    :param module:
+    :param whitelist: set of symbols
+    :param symvers: dict of symbol -> crc, may be empty
+    :return: dict with the not whitelisted symbols and CRC mismatches
+    """
+    result = {"module": module, "file": None, "symbols": 0,
+              "not_whitelisted": [], "crc_mismatch": [], "error": None}
+    module_file = get_module_file(module)
+    if not module_file:
+        result["error"] = "can not find module file"
+        return result
+    result["file"] = module_file
+    try:
+        versions = read_modversions(module_file)
+    except (IOError, OSError, ValueError, struct.error, lzma.LZMAError) as concrete_error:
+        result["error"] = str(concrete_error)
+        return result
+
+    result["symbols"] = len(versions)
+    extra_symbols = set(versions) - whitelist
+    greylist = "/usr/share/doc/kmod-%s/greylist.txt" % module
+    if extra_symbols and os.path.exists(greylist):
+        extra_symbols -= set(load_cached(greylist, parse_whitelist))
+    result["not_whitelisted"] = sorted(extra_symbols)
+    for symbol, crc in sorted(versions.items()):
+        if symbol in symvers and symvers[symbol] != crc:
+            result["crc_mismatch"].append({"symbol": symbol, "module_crc": "0x%08x" % crc,
+                                           "kernel_crc": "0x%08x" % symvers[symbol]})
+    return result
+
+
+def check_modules(modules, arch, kernel, workers=8):
+    """
+    Check several modules in parallel
+    :param modules: module names
+    :param arch:
+    :param kernel: uname -r
+    :param workers:
+    :return: list of results of check_module, None if there is no whitelist
+    """
+    whitelist_path = find_whitelist(arch, kernel)
+    if not whitelist_path:
+        return None
+    whitelist = set(load_cached(whitelist_path, parse_whitelist))
+    symvers_path = find_symvers(kernel)
+    symvers = load_cached(symvers_path, parse_symvers) if symvers_path else dict()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda module: check_module(module, whitelist, symvers), modules))
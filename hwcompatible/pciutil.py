@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2020 Huawei Technologies Co., Ltd.
+# oec-hardware is licensed under the Mulan PSL v2.
+# You can use this software according to the terms and conditions of the Mulan PSL v2.
+# You may obtain a copy of Mulan PSL v2 at:
+#     http://license.coscl.org.cn/MulanPSL2
+# THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+# PURPOSE.
+# See the Mulan PSL v2 for more details.
+# Create: 2020-04-01
+
+"""PCI device inventory from sysfs, built once and shared"""
+
+import os
+
+from .sysfsutil import read_sysfs, read_link, listdir
+
+SYSFS_PCI = "/sys/bus/pci/devices"
+SYSFS_NET = "/sys/class/net"
+
+_inventory = None
+
+
+def read_id(path):
+    """
+    Read a hex id such as 0x8086 the way lspci -n prints it
+    :param path:
+    :return:
+    """
+    value = read_sysfs(path)
+    if value.startswith("0x"):
+        value = value[2:]
+    return value.lower()
+
+
+def compile_match_rules(device_types):
+    """
+    Turn device type dicts such as {'Class': '02', 'Vendor': '8086',
+    'Device': '0b30,0b31', ...} into (class, {key: set of values}) rules
+    :param device_types:
+    :return:
+    """
+    rules = list()
+    for device_type in device_types:
+        ids = dict()
+        for key, value in device_type.items():
+            if key != 'Class' and value:
+                ids[key] = set(item.strip().lower() for item in value.split(','))
+        rules.append((device_type['Class'], ids))
+    return rules
+
+
+def device_matches(dev, rules):
+    """
+    Check a device against compiled match rules
+    :param dev: dict with Class, Vendor, Device, SVendor and SDevice
+    :param rules: result of compile_match_rules
+    :return:
+    """
+    for class_prefix, ids in rules:
+        if dev["Class"][0:2] != class_prefix:
+            continue
+        if all(dev.get(key) in values for key, values in ids.items()):
+            return True
+    return False
+
+
+class PciInventory:
+    """
+    All PCI devices read from /sys/bus/pci/devices, with lookups by slot
+    and class prefix
+    """
+    def __init__(self):
+        self.devices = dict()
+        self.by_class = dict()
+        self.load()
+
+    def load(self):
+        """
+        Read every device of the PCI bus and index it
+        :return:
+        """
+        self.devices = dict()
+        self.by_class = dict()
+        for slot in sorted(listdir(SYSFS_PCI)):
+            path = os.path.join(SYSFS_PCI, slot)
+            try:
+                numa_node = int(read_sysfs(os.path.join(path, "numa_node"), "-1"))
+            except ValueError:
+                numa_node = -1
+            dev = {
+                "Slot": slot,
+                "Class": read_id(os.path.join(path, "class"))[0:4],
+                "Vendor": read_id(os.path.join(path, "vendor")),
+                "Device": read_id(os.path.join(path, "device")),
+                "SVendor": read_id(os.path.join(path, "subsystem_vendor")),
+                "SDevice": read_id(os.path.join(path, "subsystem_device")),
+                "numa_node": numa_node,
+            }
+            driver = read_link(os.path.join(path, "driver"))
+            if driver:
+                dev["Driver_str"] = driver
+            module = read_link(os.path.join(path, "driver", "module"))
+            if module:
+                dev["Module_str"] = module
+
+            self.devices[slot] = dev
+            self.by_class.setdefault(dev["Class"][0:2], []).append(dev)
+
+    def get(self, slot):
+        """
+        Get a device by PCI slot
+        :param slot: domain:bus:device.function
+        :return: dict, or None
+        """
+        return self.devices.get(slot)
+
+    def get_driver(self, slot):
+        """
+        Driver currently bound to a device, read live since drivers can be
+        rebound (for example by dpdk-devbind.py) after the inventory is built
+        :param slot:
+        :return:
+        """
+        return read_link(os.path.join(SYSFS_PCI, slot, "driver"))
+
+    def match(self, rules):
+        """
+        Devices matching any of the compiled rules
+        :param rules: result of compile_match_rules
+        :return: list of dict
+        """
+        matched = list()
+        for class_prefix in sorted(set(rule[0] for rule in rules)):
+            for dev in self.by_class.get(class_prefix, []):
+                if device_matches(dev, rules):
+                    matched.append(dev)
+        return matched
+
+
+def get_pci_inventory(refresh=False):
+    """
+    The shared PCI inventory, built on first use
+    :param refresh: read sysfs again
+    :return:
+    """
+    global _inventory
+    if _inventory is None:
+        _inventory = PciInventory()
+    elif refresh:
+        _inventory.load()
+    return _inventory
+
+
+def get_netdev_slot(interface):
+    """
+    PCI slot of a network interface, empty for virtual interfaces
+    :param interface:
+    :return:
+    """
+    path = os.path.realpath(os.path.join(SYSFS_NET, interface, "device"))
+    if not path.startswith("/sys/devices/pci"):
+        return ""
+    return os.path.basename(path)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2020 Huawei Technologies Co., Ltd.
+# oec-hardware is licensed under the Mulan PSL v2.
+# You can use this software according to the terms and conditions of the Mulan PSL v2.
+# You may obtain a copy of Mulan PSL v2 at:
+#     http://license.coscl.org.cn/MulanPSL2
+# THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+# PURPOSE.
+# See the Mulan PSL v2 for more details.
+# Create: 2020-04-01
+
+"""RDMA topology from sysfs, shared by the client and the server"""
+
+import os
+import socket
+import subprocess
+
+from .pciutil import get_pci_inventory
+from .sysfsutil import read_sysfs, listdir
+
+SYSFS_IB = "/sys/class/infiniband"
+SYSFS_NET = "/sys/class/net"
+ZERO_GID = "0000:0000:0000:0000:0000:0000:0000:0000"
+
+
+def get_netdev_ports():
+    """
+    Map every netdev backed by an RDMA device to its (ib device, port)
+    :return: dict of (ib_device, ib_port) -> interface
+    """
+    netdev_ports = dict()
+    for interface in listdir(SYSFS_NET):
+        path_dev = os.path.join(SYSFS_NET, interface, "device")
+        ib_devices = listdir(os.path.join(path_dev, "infiniband"))
+        if not ib_devices:
+            continue
+        dev_port = read_sysfs(os.path.join(SYSFS_NET, interface, "dev_port"), "0")
+        dev_id = read_sysfs(os.path.join(SYSFS_NET, interface, "dev_id"), "0x0")
+        try:
+            ib_port = int(dev_port) + 1 if int(dev_port) else int(dev_id, 16) + 1
+        except ValueError:
+            continue
+        for ib_device in ib_devices:
+            netdev_ports[(ib_device, ib_port)] = interface
+    return netdev_ports
+
+
+def get_interface_ips(interface):
+    """
+    Get the IPv4 and IPv6 addresses of an interface, secondary addresses
+    included
+    :param interface:
+    :return: list of addresses
+    """
+    ips = list()
+    try:
+        output = subprocess.run(["ip", "-o", "-4", "addr", "show", "dev", interface],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True).stdout
+    except (IOError, OSError):
+        output = ""
+    # 2: eth0    inet 192.168.1.2/24 brd 192.168.1.255 scope global eth0 ...
+    for line in output.splitlines():
+        fields = line.split()
+        if "inet" in fields[:-1]:
+            ips.append(fields[fields.index("inet") + 1].split("/")[0])
+
+    try:
+        with open("/proc/net/if_inet6") as if_inet6:
+            for line in if_inet6:
+                fields = line.split()
+                if len(fields) == 6 and fields[5] == interface:
+                    ips.append(socket.inet_ntop(socket.AF_INET6, bytes.fromhex(fields[0])))
+    except (IOError, OSError, ValueError):
+        pass
+    return ips
+
+
+def get_rdma_ports():
+    """
+    Read the attributes of all RDMA ports in one pass
+    :return: list of dict, one per (ib device, port)
+    """
+    rdma_ports = list()
+    netdev_ports = get_netdev_ports()
+    inventory = get_pci_inventory()
+    for ib_device in sorted(listdir(SYSFS_IB)):
+        path_ibdev = os.path.join(SYSFS_IB, ib_device)
+        pci = os.path.basename(os.path.realpath(os.path.join(path_ibdev, "device")))
+        pci_dev = inventory.get(pci) or dict()
+        for port in sorted(listdir(os.path.join(path_ibdev, "ports")), key=int):
+            path_port = os.path.join(path_ibdev, "ports", port)
+            ib_port = int(port)
+            rate = read_sysfs(os.path.join(path_port, "rate"))
+            try:
+                speed = int(float(rate.split()[0]) * 1024)   # Mb/s
+            except (IndexError, ValueError):
+                speed = 0
+            try:
+                lid = int(read_sysfs(os.path.join(path_port, "lid"), "0x0"), 16)
+                sm_lid = int(read_sysfs(os.path.join(path_port, "sm_lid"), "0x0"), 16)
+            except ValueError:
+                lid = sm_lid = 0
+
+            gids = list()
+            path_gids = os.path.join(path_port, "gids")
+            for index in sorted(listdir(path_gids), key=int):
+                gid = read_sysfs(os.path.join(path_gids, index), ZERO_GID)
+                if gid != ZERO_GID:
+                    gids.append(gid)
+
+            interface = read_sysfs(os.path.join(path_port, "gid_attrs", "ndevs", "0")) or \
+                netdev_ports.get((ib_device, ib_port))
+            rdma_ports.append({
+                "ib_device": ib_device,
+                "ib_port": ib_port,
+                "pci": pci,
+                "driver": inventory.get_driver(pci),
+                "numa_node": pci_dev.get("numa_node", -1),
+                "interface": interface,
+                "state": read_sysfs(os.path.join(path_port, "state")),
+                "phys_state": read_sysfs(os.path.join(path_port, "phys_state")),
+                "lid": lid,
+                "sm_lid": sm_lid,
+                "rate": rate,
+                "speed": speed,
+                "link_layer": read_sysfs(os.path.join(path_port, "link_layer")),
+                "gids": gids,
+                "gid": gids[0] if gids else ZERO_GID,
+            })
+    return rdma_ports
+
+
+def get_rdma_port(interface):
+    """
+    Get the RDMA port behind a netdev
+    :param interface:
+    :return: dict, or None if the interface is not RDMA capable
+    """
+    for rdma_port in get_rdma_ports():
+        if rdma_port["interface"] == interface:
+            return rdma_port
+    return None
+
+
+def get_rdma_port_by_ip(ip_addr):
+    """
+    Get the RDMA port whose netdev owns an IP address
+    :param ip_addr:
+    :return: dict, or None if no RDMA netdev has this address
+    """
+    for rdma_port in get_rdma_ports():
+        if rdma_port["interface"] and ip_addr in get_interface_ips(rdma_port["interface"]):
+            return rdma_port
+    return None
+
+
+def get_rdma_interfaces():
+    """
+    Get all netdevs backed by an RDMA device
+    :return:
+    """
+    return sorted(set(get_netdev_ports().values()))
@@ -16,10 +16,24 @@
 
 import datetime
 
-from .document import Document, FactoryDocument
+from .document import Document
 from .env import CertEnv
 from .command import Command, CertCommandError
 
+BOOT_ID_FILE = "/proc/sys/kernel/random/boot_id"
+
+
+def get_boot_id():
+    """
+    Id of the current boot, a new one is generated by every kernel start
+    :return: None if it can not be read
+    """
+    try:
+        with open(BOOT_ID_FILE) as boot_id_file:
+            return boot_id_file.read().strip()
+    except (IOError, OSError):
+        return None
+
 
 class Reboot:
     """
@@ -55,20 +69,18 @@ class Reboot:
             print("Error: invalid reboot input.")
             return False
 
-        self.job.save_result()
+        # the status of the testcases is kept in the job state store, the
+        # job after the reboot saves the test factory
         for test in self.job.test_factory:
             if test["run"] and self.testname == test["name"]:
                 test["reboot"] = True
-                test["status"] = "FAIL"
-        if not FactoryDocument(CertEnv.factoryfile, self.job.test_factory).save():
-            print("Error: save testfactory doc fail before reboot.")
-            return False
 
         self.reboot["job_id"] = self.job.job_id
         self.reboot["time"] = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
         self.reboot["test"] = self.testname
         self.reboot["rebootup"] = self.rebootup
-        if not Document(CertEnv.rebootfile, self.reboot).save():
+        self.reboot["boot_id"] = get_boot_id()
+        if not Document(CertEnv.rebootfile, self.reboot).save(sync=True):
             print("Error: save reboot doc fail.")
             return False
 
@@ -101,6 +113,14 @@ class Reboot:
             print("Error: reboot file format not as expect.")
             return False
 
+        boot_id = self.reboot.get("boot_id")
+        if boot_id:
+            if boot_id == get_boot_id():
+                print("Error: system has not rebooted since %s." % self.reboot["time"])
+                return False
+            return True
+
+        # reboot file written by an older version
         time_now = datetime.datetime.now()
         time_delta = (time_now - time_reboot).seconds
         cmd = Command("last reboot -s '%s seconds ago'" % time_delta)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2020 Huawei Technologies Co., Ltd.
+# oec-hardware is licensed under the Mulan PSL v2.
+# You can use this software according to the terms and conditions of the Mulan PSL v2.
+# You may obtain a copy of Mulan PSL v2 at:
+#     http://license.coscl.org.cn/MulanPSL2
+# THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+# PURPOSE.
+# See the Mulan PSL v2 for more details.
+# Create: 2020-04-01
+
+"""RPM package queries, installation and file verification"""
+
+import os
+import re
+import stat
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .command import Command
+from .env import CertEnv
+
+VERIFY_CACHE = os.path.join(CertEnv.datadirectory, "rpmverify-cache.json")
+# PGPHASHALGO values of the FILEDIGESTALGO tag
+DIGEST_ALGOS = {1: "md5", 2: "sha1", 8: "sha256", 9: "sha384", 10: "sha512", 11: "sha224"}
+RPMFILE_GHOST = 1 << 6
+FILE_FIELDS = ["path", "digest", "size", "mode", "flags", "linkto"]
+
+_cache = None
+_cache_lock = threading.Lock()
+_installed = set()
+
+
+def get_package_files(package):
+    """
+    Read the file list of an installed package from its header, in one
+    rpm query
+    :param package:
+    :return: (digest algorithm name, list of file dicts)
+    """
+    comm = Command("rpm -q --qf '%%{FILEDIGESTALGO}\\n[%%{FILENAMES}\\t%%{FILEDIGESTS}\\t"
+                   "%%{FILESIZES}\\t%%{FILEMODES}\\t%%{FILEFLAGS}\\t%%{FILELINKTOS}\\n]' %s"
+                   % package)
+    comm.run_quiet()
+    lines = comm.output or []
+    try:
+        algo = DIGEST_ALGOS.get(int(lines[0]), "md5")
+    except (IndexError, ValueError):
+        # packages built without the tag use md5
+        algo = "md5"
+    files = list()
+    for line in lines[1:]:
+        fields = line.split("\t")
+        if len(fields) != len(FILE_FIELDS):
+            continue
+        entry = dict(zip(FILE_FIELDS, fields))
+        entry["size"] = int(entry["size"])
+        entry["mode"] = int(entry["mode"])
+        entry["flags"] = int(entry["flags"])
+        files.append(entry)
+    return algo, files
+
+
+def load_cache():
+    """
+    Digests computed by previous runs
+    :return: dict of path -> [inode, mtime_ns, ctime_ns, size, algo, digest]
+    """
+    global _cache
+    if _cache is None:
+        try:
+            with open(VERIFY_CACHE, "r") as cache_file:
+                _cache = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            _cache = dict()
+    return _cache
+
+
+def save_cache():
+    """
+    Save the digests for the next run
+    :return:
+    """
+    try:
+        with open(VERIFY_CACHE, "w") as cache_file:
+            json.dump(load_cache(), cache_file)
+    except (IOError, OSError) as concrete_error:
+        print("Warning: could not save rpm verify cache: %s" % concrete_error)
+
+
+def file_digest(path, algo, file_stat):
+    """
+    Digest of a file, reused from the cache while its inode, mtime, ctime
+    and size do not change, a rewrite that restores the mtime still
+    changes the ctime
+    :param path:
+    :param algo:
+    :param file_stat:
+    :return:
+    """
+    key = [file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_ctime_ns,
+           file_stat.st_size, algo]
+    with _cache_lock:
+        entry = load_cache().get(path)
+    if entry and entry[:5] == key:
+        return entry[5]
+
+    digest = hashlib.new(algo)
+    with open(path, "rb") as data_file:
+        for block in iter(lambda: data_file.read(1024 * 1024), b""):
+            digest.update(block)
+    digest = digest.hexdigest()
+    with _cache_lock:
+        load_cache()[path] = key + [digest]
+    return digest
+
+
+def verify_file(entry, algo):
+    """
+    Verify one file of a package the way rpm -V --nomtime --nomode does
+    for content: existence, size, digest and link target
+    :param entry:
+    :param algo:
+    :return: rpm -V style line, None if the file is unchanged
+    """
+    path = entry["path"]
+    if entry["flags"] & RPMFILE_GHOST:
+        return None
+    try:
+        file_stat = os.lstat(path)
+    except (IOError, OSError):
+        return "missing     %s" % path
+
+    if stat.S_ISLNK(entry["mode"]):
+        if not stat.S_ISLNK(file_stat.st_mode) or os.readlink(path) != entry["linkto"]:
+            return "....L....   %s" % path
+        return None
+    if not stat.S_ISREG(entry["mode"]) or not entry["digest"]:
+        return None
+
+    size = "S" if file_stat.st_size != entry["size"] else "."
+    try:
+        digest = "5" if file_digest(path, algo, file_stat) != entry["digest"] else "."
+    except (IOError, OSError):
+        digest = "?"
+    if size == "." and digest == ".":
+        return None
+    return "%s.%s......   %s" % (size, digest, path)
+
+
+def verify_package(package, excludes=None, workers=8):
+    """
+    Verify the files of an installed package in parallel
+    :param package:
+    :param excludes: regular expressions of paths not to report
+    :param workers:
+    :return: list of rpm -V style lines of changed files
+    :raise CertCommandError: when the package is not installed
+    """
+    algo, files = get_package_files(package)
+    if excludes:
+        pattern = re.compile("|".join(excludes))
+        files = [entry for entry in files if not pattern.search(entry["path"])]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        changes = [change for change in pool.map(lambda entry: verify_file(entry, algo), files)
+                   if change]
+    with _cache_lock:
+        save_cache()
+    return changes
+
+
+def get_missing_packages(packages, refresh=False):
+    """
+    Query all packages in one rpm call, packages found installed are
+    remembered for the rest of the job
+    :param packages:
+    :param refresh: query the packages already found installed again
+    :return: set of packages that are not installed
+    """
+    if refresh:
+        _installed.clear()
+    unknown = sorted(set(packages) - _installed)
+    if not unknown:
+        return set()
+    comm = Command("rpm -q %s" % " ".join(unknown))
+    comm.run(ignore_errors=True)
+    missing = set()
+    for line in comm.output or []:
+        match = re.match(r"^package (\S+) is not installed", line)
+        if match:
+            missing.add(match.group(1))
+    _installed.update(set(unknown) - missing)
+    return missing
+
+
+class PackageInstaller:
+    """
+    Install packages with yum in a background thread
+    """
+    def __init__(self, packages):
+        self.packages = sorted(packages)
+        self.comm = Command("yum install -y %s" % " ".join(self.packages))
+        self.thread = threading.Thread(target=self.comm.run, kwargs={"ignore_errors": True})
+        self.result = None
+
+    def start(self):
+        """
+        Start the installation
+        :return:
+        """
+        self.thread.start()
+
+    def wait(self):
+        """
+        Wait for the installation, then check the packages again
+        :return: True if every package is installed
+        """
+        if self.result is not None:
+            return self.result
+        self.thread.join()
+        self.comm.print_output()
+        self.comm.print_errors()
+        missing = get_missing_packages(self.packages)
+        if missing:
+            print("Error: fail to install %s." % ", ".join(sorted(missing)))
+        self.result = not missing
+        return self.result
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2020 Huawei Technologies Co., Ltd.
+# oec-hardware is licensed under the Mulan PSL v2.
+# You can use this software according to the terms and conditions of the Mulan PSL v2.
+# You may obtain a copy of Mulan PSL v2 at:
+#     http://license.coscl.org.cn/MulanPSL2
+# THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+# PURPOSE.
+# See the Mulan PSL v2 for more details.
+# Create: 2020-04-01
+
+
+"""Readers of sysfs attributes and directories that tolerate missing entries"""
+
+import os
+
+
+def read_sysfs(path, default=""):
+    """
+    Read a sysfs attribute
+    :param path:
+    :param default: returned when the attribute can not be read
+    :return:
+    """
+    try:
+        with open(path) as sysfs_file:
+            return sysfs_file.read().strip()
+    except (IOError, OSError):
+        return default
+
+
+def read_link(path):
+    """
+    Name of the target of a sysfs symlink, empty if there is no link
+    :param path:
+    :return:
+    """
+    try:
+        return os.path.basename(os.readlink(path))
+    except (IOError, OSError):
+        return ""
+
+
+def listdir(path):
+    """
+    List a sysfs directory, empty if it does not exist
+    :param path:
+    :return:
+    """
+    try:
+        return os.listdir(path)
+    except (IOError, OSError):
+        return []
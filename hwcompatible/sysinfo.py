@@ -58,15 +58,14 @@ class SysInfo:
             results = pattern.findall(text)
             self.version = results[0].strip() if results else ""
 
-        with os.popen('uname -m') as pop:
-            self.arch = pop.readline().strip()
-            self.debug_kernel = "debug" in self.arch
+        uname = os.uname()
+        self.arch = uname.machine
+        self.debug_kernel = "debug" in self.arch
 
-        with os.popen('uname -r') as pop:
-            self.kernel = pop.readline().strip()
-            self.kernel_rpm = "kernel-{}".format(self.kernel)
-            self.kerneldevel_rpm = "kernel-devel-{}".format(self.kernel)
-            self.kernel_version = self.kernel.split('-')[0]
+        self.kernel = uname.release
+        self.kernel_rpm = "kernel-{}".format(self.kernel)
+        self.kerneldevel_rpm = "kernel-devel-{}".format(self.kernel)
+        self.kernel_version = self.kernel.split('-')[0]
 
     def get_version(self):
         """
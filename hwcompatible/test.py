@@ -24,6 +24,8 @@ class Test:
         self.requirements = list()
         self.reboot = False
         self.rebootup = None
+        # measures performance, it does not run next to a package install
+        self.benchmark = False
 
     def setup(self, args=None):
         """
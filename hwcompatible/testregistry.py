@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Copyright (c) 2020 Huawei Technologies Co., Ltd.
+# oec-hardware is licensed under the Mulan PSL v2.
+# You can use this software according to the terms and conditions of the Mulan PSL v2.
+# You may obtain a copy of Mulan PSL v2 at:
+#     http://license.coscl.org.cn/MulanPSL2
+# THIS SOFTWARE IS PROVIDED ON AN "AS IS" BASIS, WITHOUT WARRANTIES OF ANY KIND, EITHER EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO NON-INFRINGEMENT, MERCHANTABILITY OR FIT FOR A PARTICULAR
+# PURPOSE.
+# See the Mulan PSL v2 for more details.
+# Create: 2020-04-01
+
+"""Registry of the test modules, built without importing them"""
+
+import os
+import sys
+import ast
+import json
+import time
+import tempfile
+import importlib
+
+from .env import CertEnv
+
+REGISTRY_FILE = os.path.join(CertEnv.datadirectory, "test-registry.json")
+REGISTRY_VERSION = 2
+# attributes of Test read from the constructors, with the Test defaults
+TEST_ATTRIBUTES = {"pri": 0, "requirements": [], "reboot": False, "rebootup": None,
+                   "benchmark": False}
+
+_registry = None
+
+
+def get_signature(testdir):
+    """
+    Path, mtime and size of every test source file, to tell when the
+    registry is out of date
+    :param testdir:
+    :return: sorted list of [path, mtime_ns, size]
+    """
+    signature = list()
+    for (dirpath, dirs, filenames) in os.walk(testdir):
+        dirs[:] = [dirname for dirname in dirs if dirname != "__pycache__"]
+        for filename in filenames:
+            if filename.endswith(".py"):
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                signature.append([path, stat.st_mtime_ns, stat.st_size])
+    signature.sort()
+    return signature
+
+
+def scan_module(path):
+    """
+    Classes of a test module, read from its syntax tree
+    :param path:
+    :return: dict of class name -> bases, methods and constructor attributes
+    """
+    with open(path, "r") as source_file:
+        tree = ast.parse(source_file.read(), path)
+    classes = dict()
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        bases = [base.id if isinstance(base, ast.Name) else getattr(base, "attr", "")
+                 for base in node.bases]
+        methods = [item.name for item in node.body if isinstance(item, ast.FunctionDef)]
+        attributes = dict()
+        dynamic = list()
+        for item in node.body:
+            if not isinstance(item, ast.FunctionDef) or item.name != "__init__":
+                continue
+            for statement in item.body:
+                if not isinstance(statement, ast.Assign):
+                    continue
+                for target in statement.targets:
+                    if isinstance(target, ast.Attribute) and isinstance(target.value, ast.Name) \
+                            and target.value.id == "self" and target.attr in TEST_ATTRIBUTES:
+                        try:
+                            attributes[target.attr] = ast.literal_eval(statement.value)
+                        except ValueError:
+                            dynamic.append(target.attr)
+        classes[node.name] = {"bases": bases, "methods": methods,
+                              "attributes": attributes, "dynamic": dynamic}
+    return classes
+
+
+def resolve_class(name, module, modules, seen=None):
+    """
+    Merge a class with its bases, looked up in its own module first
+    :param name:
+    :param module:
+    :param modules: dict of module name -> scan_module result
+    :param seen:
+    :return: (is a Test subclass, methods, attributes, dynamic attributes)
+    """
+    seen = seen or set()
+    if name == "Test":
+        return True, ["setup", "teardown"], dict(TEST_ATTRIBUTES), []
+    owner = module if name in modules.get(module, {}) else None
+    if not owner:
+        owner = next((other for other in sorted(modules) if name in modules[other]), None)
+    if not owner or (owner, name) in seen:
+        return False, [], dict(), []
+    seen.add((owner, name))
+
+    info = modules[owner][name]
+    is_test, methods, attributes, dynamic = False, list(), dict(), list()
+    for base in info["bases"]:
+        base_test, base_methods, base_attributes, base_dynamic = \
+            resolve_class(base, owner, modules, seen)
+        if base_test:
+            is_test = True
+            methods.extend(method for method in base_methods if method not in methods)
+            attributes.update(base_attributes)
+            dynamic.extend(base_dynamic)
+    methods.extend(method for method in info["methods"] if method not in methods)
+    attributes.update(info["attributes"])
+    dynamic = [attr for attr in dynamic if attr not in info["attributes"]] + info["dynamic"]
+    return is_test, methods, attributes, dynamic
+
+
+def build_registry(testdir):
+    """
+    Find the test class of every test module
+    :param testdir:
+    :return: dict of test name -> entry
+    """
+    paths = dict()
+    modules = dict()
+    for (dirpath, dirs, filenames) in os.walk(testdir):
+        dirs.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith(".py") or filename.startswith("__init__"):
+                continue
+            name = filename[:-3]
+            path = os.path.join(dirpath, filename)
+            if name in paths:
+                continue
+            try:
+                modules[name] = scan_module(path)
+            except (IOError, OSError, SyntaxError, UnicodeDecodeError) as concrete_error:
+                print("Warning: can not scan %s: %s" % (path, concrete_error))
+                continue
+            paths[name] = path
+
+    tests = dict()
+    for name, path in paths.items():
+        # like the dir() order the classes used to be searched in
+        for class_name in sorted(modules[name]):
+            is_test, methods, attributes, dynamic = resolve_class(class_name, name, modules)
+            if not is_test or "test" not in methods:
+                continue
+            entry = {"name": name, "path": path, "dir": os.path.dirname(path),
+                     "class": class_name, "methods": methods, "dynamic": sorted(set(dynamic))}
+            entry.update(attributes)
+            tests[name] = entry
+            break
+    return tests
+
+
+class TestRegistry:
+    """
+    Test name -> module, class and declared attributes, reused across
+    runs until a test file changes
+    """
+    def __init__(self, testdir=None, filename=REGISTRY_FILE):
+        self.testdir = testdir or CertEnv.testdirectoy
+        self.filename = filename
+        self.tests = dict()
+        self.load()
+
+    def load(self):
+        """
+        Load the saved registry, rebuild it when the test files changed
+        :return:
+        """
+        signature = get_signature(self.testdir)
+        try:
+            with open(self.filename, "r") as registry_file:
+                saved = json.load(registry_file)
+            if saved.get("version") == REGISTRY_VERSION and \
+                    saved.get("testdir") == self.testdir and saved.get("signature") == signature:
+                self.tests = saved["tests"]
+                return
+        except (IOError, OSError, ValueError):
+            pass
+
+        self.tests = build_registry(self.testdir)
+        try:
+            with open(self.filename, "w") as registry_file:
+                json.dump({"version": REGISTRY_VERSION, "testdir": self.testdir,
+                           "signature": signature, "tests": self.tests}, registry_file)
+        except (IOError, OSError) as concrete_error:
+            print("Warning: could not save test registry: %s" % concrete_error)
+
+    def names(self):
+        """
+        Test names, in test directory order
+        :return:
+        """
+        return sorted(self.tests, key=lambda name: self.tests[name]["path"])
+
+    def get(self, name):
+        """
+        Registry entry of a test
+        :param name:
+        :return: dict, None if there is no such test
+        """
+        return self.tests.get(name)
+
+    def get_class(self, name):
+        """
+        Import the module of a test and return its class
+        :param name:
+        :return:
+        """
+        entry = self.tests[name]
+        if entry["dir"] not in sys.path:
+            sys.path.insert(0, entry["dir"])
+        module = importlib.import_module(name)
+        return getattr(module, entry["class"])
+
+    def create(self, name):
+        """
+        Instantiate a test
+        :param name:
+        :return:
+        """
+        return self.get_class(name)()
+
+
+def get_test_registry(refresh=False):
+    """
+    The shared test registry, loaded on first use
+    :param refresh: check the test files again
+    :return:
+    """
+    global _registry
+    if _registry is None:
+        _registry = TestRegistry()
+    elif refresh:
+        _registry.load()
+    return _registry
+
+
+def benchmark(testdir=None):
+    """
+    Compare the registry with importing and instantiating every test, as
+    discovery used to do
+    :param testdir:
+    :return:
+    """
+    testdir = testdir or CertEnv.testdirectoy
+    handle, filename = tempfile.mkstemp(suffix=".json")
+    os.close(handle)
+    os.remove(filename)
+
+    start = time.time()
+    registry = TestRegistry(testdir, filename)
+    build_time = time.time() - start
+    start = time.time()
+    registry = TestRegistry(testdir, filename)
+    load_time = time.time() - start
+    os.remove(filename)
+    print("Registry build:".ljust(30) + "%8.1f ms (%d tests)" % (build_time * 1000,
+                                                               len(registry.tests)))
+    print("Registry load:".ljust(30) + "%8.1f ms" % (load_time * 1000))
+
+    total = 0.0
+    for name in registry.names():
+        start = time.time()
+        try:
+            registry.create(name)
+            status = ""
+        except Exception as concrete_error:
+            status = "  (%s)" % concrete_error
+        elapsed = time.time() - start
+        total += elapsed
+        print(("Import %s:" % name).ljust(30) + "%8.1f ms%s" % (elapsed * 1000, status))
+    print("Import all tests:".ljust(30) + "%8.1f ms" % (total * 1000))
+
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -24,7 +24,7 @@ Requires:       python3
 %package server
 Summary:        openEuler Hardware Compatibility Test Server
 Group:          Development/Tools
-Requires:       python3, python3-devel, nginx, tar, qperf, psmisc
+Requires:       python3, python3-devel, nginx, tar, qperf, psmisc, iproute
 
 %description
 openEuler Hardware Compatibility Test Suite
@@ -48,6 +48,7 @@ DESTDIR=$RPM_BUILD_ROOT make install
 %pre
 
 %post
+cd /usr/share/oech/lib && /usr/bin/python3 -c "from hwcompatible.testregistry import get_test_registry; get_test_registry()" >/dev/null 2>&1 || :
 
 %files
 %defattr(-,root,root)
@@ -65,6 +66,10 @@ DESTDIR=$RPM_BUILD_ROOT make install
 /usr/share/oech/lib/server
 /usr/share/oech/lib/server/uwsgi.ini
 /usr/share/oech/lib/server/uwsgi.conf
+/usr/share/oech/lib/hwcompatible/__init__.py
+/usr/share/oech/lib/hwcompatible/rdmautil.py
+/usr/share/oech/lib/hwcompatible/pciutil.py
+/usr/share/oech/lib/hwcompatible/sysfsutil.py
 /usr/lib/systemd/system/oech-server.service
 
 %postun
@@ -33,6 +33,9 @@ from flask import Flask, render_template, redirect, url_for, abort, request, \
                   make_response, send_from_directory, flash, jsonify
 from flask_bootstrap import Bootstrap
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from hwcompatible.rdmautil import get_rdma_port_by_ip
+
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
@@ -321,10 +324,19 @@ def dpdk_test_server(act):
     if act not in valid_act:
         abort(400)
 
+    try:
+        nb_ports = int(request.values.get('ports', 1))
+    except ValueError:
+        abort(400)
+    if nb_ports < 1:
+        abort(400)
+
     if act == 'stop':
         cmd = "killall -9 dpdk-testpmd"
     elif act == 'start':
-        cmd = "dpdk-testpmd -l 0-1 -n 1 -- --forward-mode=icmpecho"
+        # one forwarding core per port, plus the main lcore
+        cmd = "dpdk-testpmd -l 0-%d -n 1 -- --forward-mode=icmpecho --nb-cores=%d" % \
+              (nb_ports, nb_ports)
 
     if sys.version_info.major < 3:
         pipe = subprocess.Popen(cmd, shell=True,
@@ -345,15 +357,19 @@ def dpdk_test_server(act):
     print(cmd)
 
     if act == 'start':
-        pattern = re.compile("Port [0-9]*: [0-9a-fA-F:]*")
-        while True:
+        # testpmd prints "Port N: MAC" for every port it starts
+        pattern = re.compile("Port [0-9]+: ([0-9a-fA-F]{2}(:[0-9a-fA-F]{2}){5})")
+        macs = []
+        while len(macs) < nb_ports:
             line = pipe.stdout.readline()
+            if not line or "Press enter to exit" in line:
+                break
             match = pattern.match(line)
             if match:
-                # get (one of) the MAC of address
-                break
-        mac = match.group().split(':', 1)[1].strip()
-        dic = {'mac': mac}
+                macs.append(match.group(1))
+        if not macs:
+            abort(400)
+        dic = {'mac': macs[0], 'macs': macs}
         return jsonify(dic)
     elif act == 'stop':
         return render_template('index.html')
@@ -365,7 +381,7 @@ def test_server(act):
     test server
     """
     valid_commands = ['rping', 'rcopy', 'ib_read_bw', 'ib_write_bw', 'ib_send_bw',
-                      'qperf']
+                      'ib_read_lat', 'ib_write_lat', 'ib_send_lat', 'qperf']
     cmd = request.values.get('cmd', '')
     cmd = cmd.split()
     if (not cmd) or (cmd[0] not in valid_commands + ['all']):
@@ -405,33 +421,11 @@ def test_server(act):
 
 
 def __get_ib_dev_port(ib_server_ip):
-    try:
-        cmd = "ip -o a | grep -w %s | awk '{print $2}'" % ib_server_ip
-        # print(cmd)
-        netdev = os.popen(cmd).read().strip()
-
-        cmd = "udevadm info --export-db | grep DEVPATH | grep -w %s | awk -F= '{print $2}'" % netdev
-        # print(cmd)
-        path_netdev = ''.join(['/sys', os.popen(cmd).read().strip()])
-        path_pci = path_netdev.split('net')[0]
-        path_ibdev = 'infiniband_verbs/uverb*/ibdev'
-        path_ibdev = ''.join([path_pci, path_ibdev])
-
-        cmd = "cat %s" % path_ibdev
-        # print(cmd)
-        ibdev = os.popen(cmd).read().strip()
-
-        path_ibport = '/sys/class/net/%s/dev_id' % netdev
-        cmd = "cat %s" % path_ibport
-        # print(cmd)
-        ibport = os.popen(cmd).read().strip()
-        ibport = int(ibport, 16) + 1
-        ibport = str(ibport)
-
-        return ibdev, ibport
-    except Exception as concrete_error:
-        print(concrete_error)
+    rdma_port = get_rdma_port_by_ip(ib_server_ip)
+    if not rdma_port:
+        print("No RDMA port found for %s" % ib_server_ip)
         return None, None
+    return rdma_port['ib_device'], str(rdma_port['ib_port'])
 
 
 if __name__ == '__main__':
@@ -14,12 +14,16 @@
 
 """cpufreq test"""
 
+import os
+import argparse
 from random import randint
 from time import sleep
 
 from hwcompatible.env import CertEnv
 from hwcompatible.test import Test
 from hwcompatible.command import Command
+from hwcompatible.document import Document
+from hwcompatible import instrument
 
 
 class CPU:
@@ -181,8 +185,21 @@ class CPUFreqTest(Test):
     def __init__(self):
         Test.__init__(self)
         self.requirements = ['util-linux', 'kernel-tools']
+        self.benchmark = True
         self.cpu = CPU()
         self.original_governor = self.cpu.get_governor(0)
+        self.args = None
+        self.logdir = None
+        self.results = dict()
+
+    def setup(self, args=None):
+        """
+        Initialization before test
+        :param args:
+        :return:
+        """
+        self.args = args or argparse.Namespace()
+        self.logdir = getattr(self.args, "logdir", None)
 
     def test_userspace(self):
         """
@@ -253,6 +270,10 @@ class CPUFreqTest(Test):
             return False
         print("[.] The speedup(%.2f) is between %.2f and %.2f" %
               (measured_speedup, min_speedup, max_speedup))
+        self.results["userspace"] = {
+            "min_freq": {"khz": self.cpu.min_freq, "runtime": max_average_runtime},
+            "max_freq": {"khz": self.cpu.max_freq, "runtime": min_average_runtime},
+            "speedup": measured_speedup, "expected_speedup": expected_speedup}
 
         return True
 
@@ -294,6 +315,7 @@ class CPUFreqTest(Test):
         load_test_time = load_test.get_runtime()
         print("[.] Time of CPU%s ondemand load test: %.2f" %
               (target_cpu, load_test_time))
+        self.results["ondemand"] = {"runtime": load_test_time}
         target_cpu_freq = self.cpu.get_freq(target_cpu)
         if not target_cpu_freq <= self.cpu.max_freq:
             print("[X] The freq of CPU%s(%d) is not less equal than %d." %
@@ -342,6 +364,7 @@ class CPUFreqTest(Test):
         load_test_time = load_test.get_runtime()
         print("[.] Time of CPU%s conservative load test: %.2f" %
               (target_cpu, load_test_time))
+        self.results["conservative"] = {"runtime": load_test_time}
         target_cpu_freq = self.cpu.get_freq(target_cpu)
         print("[.] Current freq of CPU%s is %d." % (target_cpu, target_cpu_freq))
 
@@ -378,6 +401,7 @@ class CPUFreqTest(Test):
         load_test_time = load_test.get_runtime()
         print("[.] Time of CPU%s powersave load test: %.2f" %
               (target_cpu, load_test_time))
+        self.results["powersave"] = {"runtime": load_test_time}
         target_cpu_freq = self.cpu.get_freq(target_cpu)
         print("[.] Current freq of CPU%s is %d." % (target_cpu, target_cpu_freq))
 
@@ -414,6 +438,7 @@ class CPUFreqTest(Test):
         load_test_time = load_test.get_runtime()
         print("[.] Time of CPU%s performance load test: %.2f" %
               (target_cpu, load_test_time))
+        self.results["performance"] = {"runtime": load_test_time}
         target_cpu_freq = self.cpu.get_freq(target_cpu)
         print("[.] Current freq of CPU%s is %d." % (target_cpu, target_cpu_freq))
 
@@ -457,6 +482,10 @@ class CPUFreqTest(Test):
             ret = False
 
         self.cpu.set_governor(self.original_governor)
+        if self.logdir and self.results:
+            filename = os.path.join(self.logdir, "cpufreq.json")
+            if Document(filename, self.results).save():
+                instrument.output(filename)
         return ret
 
 
@@ -22,6 +22,7 @@ from hwcompatible.test import Test
 from hwcompatible.command import Command, CertCommandError
 from hwcompatible.commandUI import CommandUI
 from hwcompatible.device import CertDevice
+from hwcompatible.blockutil import get_block_topology
 
 
 class DiskTest(Test):
@@ -30,6 +31,7 @@ class DiskTest(Test):
     """
     def __init__(self):
         Test.__init__(self)
+        self.benchmark = True
         self.disks = list()
         self.filesystems = ["ext4"]
         self.com_ui = CommandUI()
@@ -100,33 +102,12 @@ class DiskTest(Test):
                 if "/host" in device.get_property("DEVPATH"):
                     disks.append(device.get_name())
 
-        partition_file = open("/proc/partitions", "r")
-        partition = partition_file.read()
-        partition_file.close()
-
-        os.system("swapon -a 2>/dev/null")
-        swap_file = open("/proc/swaps", "r")
-        swap = swap_file.read()
-        swap_file.close()
-
-        mdstat_file = open("/proc/mdstat", "r")
-        mdstat = mdstat_file.read()
-        mdstat_file.close()
-
-        mtab_file = open("/etc/mtab", "r")
-        mtab = mtab_file.read()
-        mtab_file.close()
-
-        mount_file = open("/proc/mounts", "r")
-        mounts = mount_file.read()
-        mount_file.close()
-
+        topology = get_block_topology(refresh=True)
         for disk in disks:
-            if disk not in partition or ("/dev/%s" % disk) in swap:
-                continue
-            if ("/dev/%s" % disk) in mounts or ("/dev/%s" % disk) in mtab:
+            if disk not in topology.devices:
                 continue
-            if disk in mdstat or os.system("pvs 2>/dev/null | grep -q '/dev/%s'" % disk) == 0:
+            if topology.is_busy(disk):
+                print("%s is in use: %s" % (disk, ", ".join(topology.get_reasons(disk))))
                 continue
             self.disks.append(disk)
 
@@ -7,6 +7,8 @@
 #include <rte_bus_pci.h>
 #include <rte_gro.h>
 #include <rte_gso.h>
+#include <rte_lcore.h>
+#include <rte_per_lcore.h>
 #include <cmdline.h>
 
 #define TX_DEF_PACKET_LEN 64
@@ -27,6 +29,8 @@
 #define BURST_TX_WAIT_US 1
 #define BURST_TX_RETRIES 64
 #define MIN_TX_AFTER_DELAY 1000
+#define DEF_TEST_DURATION_US 10e6 /* 10s of testing */
+#define DEF_ECHO_COUNT 1000
 
 
 typedef uint8_t  lcoreid_t;
@@ -85,6 +89,7 @@ struct fwd_stream {
 	streamid_t peer_addr; /**< index of peer ethernet address of packets */
 
 	unsigned int retry_enabled;
+	uint32_t   pkt_idx;   /**< next entry of the tx packet size pattern */
 
 	/* "read-write" results */
 	uint64_t rx_packets;  /**< received packets */
@@ -103,7 +108,7 @@ struct fwd_stream {
 	struct pkt_burst_stats tx_burst_stats;
 #endif
 	int done;
-};
+} __rte_cache_aligned;
 
 /**
  * The data structure associated with each forwarding logical core.
@@ -131,6 +136,8 @@ struct fwd_lcore {
 extern uint16_t tx_pkt_length; /**< Length of TXONLY packet */
 extern uint16_t tx_pkt_seg_lengths[RTE_MAX_SEGS_PER_PKT]; /**< Seg. lengths */
 extern uint8_t  tx_pkt_nb_segs; /**< Number of segments in TX packets */
+extern uint8_t  tx_pkt_imix; /**< send a simple IMIX instead of tx_pkt_length */
+extern uint64_t test_duration_us; /**< duration of a tx/rx test phase */
 extern uint16_t nb_pkt_per_burst;
 extern uint32_t burst_tx_retry_num;  /**< Burst tx retry number for mac-retry. */
 extern uint32_t burst_tx_delay_time; /**< Burst tx delay time(us) for mac-retry. */
@@ -138,11 +145,13 @@ extern uint32_t burst_tx_delay_time; /**< Burst tx delay time(us) for mac-retry.
 extern struct rte_port ports[RTE_MAX_ETHPORTS];	       /**< For all probed ethernet ports. */
 // extern portid_t nb_peer_eth_addrs; /**< Number of peer ethernet addresses. */
 extern struct rte_ether_addr peer_eth_addrs[RTE_MAX_ETHPORTS];
-extern struct fwd_lcore  fwd_lcores;
-// extern unsigned int fwd_lcores_cpuids[RTE_MAX_LCORE];
+extern struct fwd_lcore  fwd_lcores[RTE_MAX_LCORE];
+RTE_DECLARE_PER_LCORE(struct fwd_lcore *, _fwd_lcore);
 
-extern struct fwd_stream fwd_streams;
+extern struct fwd_stream *fwd_streams;
 extern char *file_to_transmit;
+extern char *latency_file; /**< where the latency histogram is saved */
+extern uint64_t latency_echo_count; /**< number of echo requests to send */
 
 typedef void (*fwd_callback_t)(void *);
 typedef void (*packet_fwd_t)(struct fwd_stream *fs);
@@ -168,15 +177,15 @@ extern struct fwd_engine icmp_echo_engine;
 
 struct fwd_config {
 	struct fwd_engine	*fwd_eng;
-	int					 nb_fwd_streams; /* only one in our case*/
-	int 				 nb_fwd_lcores; /* only one in our case*/
-	int 				 nb_fwd_ports; /* only one in our case*/
+	int					 nb_fwd_streams; /* one per forwarding lcore */
+	int 				 nb_fwd_lcores; /* all enabled lcores for tx/rx, 1 otherwise */
+	int 				 nb_fwd_ports; /* enabled ports for tx/rx, 1 otherwise */
 } global_config;
 
 static inline struct fwd_lcore *
 current_fwd_lcore(void)
 {
-	return &fwd_lcores;
+	return RTE_PER_LCORE(_fwd_lcore);
 }
 
 /*
@@ -49,8 +49,7 @@ static struct rte_ipv4_hdr pkt_ip_hdr; /**< IP header of transmitted packets. */
 //RTE_DEFINE_PER_LCORE(uint8_t, _ip_var); /**< IP address variation */
 struct rte_icmp_hdr pkt_icmp_hdr; /**< ICMP header of tx packets. */
 
-#define TEST_ECHO_TIMES_NB 10  /* 10 burst of echo packets */
-#define TEST_INTERVAL_US 1e6
+#define TEST_INTERVAL_US 1e3 /* one echo request per ms */
 #define PING_REQUEST_PKT_LEN 64
 
 static uint64_t timer_start_tsc;
@@ -61,8 +60,8 @@ static uint64_t timer_diff_tsc;
 
 static uint64_t echo_seq_nb = 0;
 
-/* an array to hold all pkt send time */
-static uint64_t send_time[16];
+/* tsc at which each echo request was sent, indexed by icmp sequence number */
+static uint64_t send_time[UINT16_MAX + 1];
 
 static inline uint16_t
 icmp_cksum(const struct rte_icmp_hdr *hdr)
@@ -211,19 +210,21 @@ check_echo_response(struct rte_mbuf *buff)
 	return false;
 }
 
+/* record the round trip time of an echo reply received at tsc "now" */
 static void
-print_latency(struct rte_mbuf *buff)
+record_latency(struct rte_mbuf *buff, uint64_t now)
 {
 	struct rte_icmp_hdr *icmp;
+	uint16_t seq;
+
 	icmp = rte_pktmbuf_mtod_offset(buff, struct rte_icmp_hdr *,
 			sizeof(struct rte_ether_hdr) + sizeof(struct rte_ipv4_hdr));
-	uint16_t seq = rte_be_to_cpu_16(icmp->icmp_seq_nb);
-	if (send_time[seq - 1] != 0) {
-		uint64_t now = rte_rdtsc();
-		uint64_t lat = now - send_time[seq - 1];
-		printf("rtt: %.2fms\n", 1.0 * lat / rte_get_tsc_hz() * MS_PER_S);
+	seq = rte_be_to_cpu_16(icmp->icmp_seq_nb);
+	if (likely(send_time[seq] != 0)) {
+		latency_stats_record(now - send_time[seq]);
+		send_time[seq] = 0; /* a duplicate reply is not counted twice */
 	} else {
-		printf("wrong seq nb being %d!\n", seq);
+		latency_stats_record_unexpected();
 	}
 }
 
@@ -258,15 +259,18 @@ pkt_burst_transmit(struct fwd_stream *fs)
 	/** TODO: recv here */
 
 	struct rte_mbuf *mb;
+	uint64_t rx_tsc;
 	nb_rx = rte_eth_rx_burst(fs->rx_port, fs->rx_queue, pkts_burst,
 				 nb_pkt_per_burst);
+	/* one timestamp for the whole burst, taken right after polling */
+	rx_tsc = rte_rdtsc();
 	for (i = 0; i < nb_rx; i++) {
 		if (likely(i < nb_rx - 1))
 			rte_prefetch0(rte_pktmbuf_mtod(pkts_burst[i + 1],
 						       void *));
 		mb = pkts_burst[i];
 		if (check_echo_response(mb)) {
-			print_latency(mb);
+			record_latency(mb, rx_tsc);
 		}
 	}
 
@@ -282,7 +286,7 @@ pkt_burst_transmit(struct fwd_stream *fs)
     timer_prev_tsc = timer_curr_tsc;
 
     echo_seq_nb++;
-    if (echo_seq_nb > TEST_ECHO_TIMES_NB) {
+    if (echo_seq_nb > latency_echo_count) {
         fs->done = true;
 		return;
     }
@@ -323,7 +327,8 @@ pkt_burst_transmit(struct fwd_stream *fs)
 
 	nb_pkt = 1;
 
-	send_time[echo_seq_nb - 1] = rte_rdtsc();
+	send_time[(uint16_t) echo_seq_nb] = rte_rdtsc();
+	latency_stats_record_sent();
 
 	nb_tx = rte_eth_tx_burst(fs->tx_port, fs->tx_queue, &pkt, 1);
 	/*
@@ -366,16 +371,19 @@ latency_begin(void *arg)
 					sizeof(struct rte_ipv4_hdr) +
 					sizeof(struct rte_icmp_hdr)));
 	setup_pkt_icmp_ip_headers(&pkt_ip_hdr, &pkt_icmp_hdr, pkt_data_len);
+	echo_seq_nb = 0;
+	memset(send_time, 0, sizeof(send_time));
+	latency_stats_reset();
 	timer_start_tsc = rte_rdtsc();
     timer_prev_tsc = timer_start_tsc;
-	// fwd_stats_reset();
 }
 
 static void
 latency_end(void *arg)
 {
-    // latency_stats_display();
-	// fwd_stats_display();
+	latency_stats_display();
+	if (latency_file != NULL)
+		latency_stats_save(latency_file);
 }
 
 struct fwd_engine latency_engine = {
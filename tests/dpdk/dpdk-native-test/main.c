@@ -41,6 +41,7 @@
 #include <rte_ethdev.h>
 #include <rte_mempool.h>
 #include <rte_mbuf.h>
+#include <rte_string_fns.h>
 
 #include "config.h"
 #include "stats.h"
@@ -77,15 +78,14 @@ struct rte_eth_txmode tx_mode = {
 /*
  * Probed Target Environment.
  */
-struct fwd_lcore fwd_lcores; /**< For all probed logical cores. */
-// lcoreid_t nb_lcores;      /**< Number of probed logical cores. it's 1 in our case*/
+struct fwd_lcore fwd_lcores[RTE_MAX_LCORE]; /**< For all forwarding logical cores. */
+RTE_DEFINE_PER_LCORE(struct fwd_lcore *, _fwd_lcore); /**< fwd_lcore of the running lcore */
 
 uint16_t nb_pkt_per_burst = DEF_PKT_BURST;
 uint32_t burst_tx_retry_num = BURST_TX_RETRIES;  /**< Burst tx retry number for mac-retry. */
 uint32_t burst_tx_delay_time = BURST_TX_WAIT_US; /**< Burst tx delay time(us) for mac-retry. */
 
 enum tx_pkt_split tx_pkt_split = TX_PKT_SPLIT_OFF; /** we don't want to split packet */
-// unsigned int fwd_lcores_cpuids[RTE_MAX_LCORE]; /** we only use the first lcore */
 
 /*
  * Configuration of packet segments used by the "txonly" processing engine.
@@ -96,6 +96,17 @@ uint16_t tx_pkt_seg_lengths[RTE_MAX_SEGS_PER_PKT] = {
 };
 /**< Number of segments in TXONLY packets, only 1 in our case to keep it simple */
 uint8_t  tx_pkt_nb_segs = 1;
+uint8_t  tx_pkt_imix = 0;
+uint64_t test_duration_us = DEF_TEST_DURATION_US;
+
+/*
+ * Frame sizes of the tx sweep, including the 4-byte CRC as in RFC 2544.
+ * 0 stands for the simple IMIX.
+ */
+static const uint16_t sweep_frame_sizes[] = {
+	64, 128, 256, 512, 1024, 1280, 1518, 0,
+};
+static uint8_t tx_sweep = 0;
 
 
 /*
@@ -111,10 +122,12 @@ struct rte_port ports[RTE_MAX_ETHPORTS];	       /**< For all probed ethernet por
 
 portid_t ports_ids[RTE_MAX_ETHPORTS];		/* store port ids */
 struct rte_ether_addr peer_eth_addrs[RTE_MAX_ETHPORTS];
-struct fwd_stream fwd_streams;		/* we only have one stream */
+struct fwd_stream *fwd_streams;	/* one stream per lcore and port */
 // portid_t nb_peer_eth_addrs = 0;
 char *peer_addr_str;
 char *file_to_transmit = NULL;
+char *latency_file = NULL;
+uint64_t latency_echo_count = DEF_ECHO_COUNT;
 
 /* Per-port statistics struct */
 struct l2fwd_port_statistics {
@@ -130,10 +143,13 @@ struct l2fwd_port_statistics port_statistics[RTE_MAX_ETHPORTS];
 */
 static void
 signal_handler(int signum) {
+	unsigned int i;
+
 	if (signum == SIGINT || signum == SIGTERM) {
 		printf("\n\nSignal %d received, preparing to exit...\n",
 				signum);
-		fwd_lcores.stopped = 1;
+		for (i = 0; i < RTE_MAX_LCORE; i++)
+			fwd_lcores[i].stopped = 1;
 		force_quit = true;
 		// signal(signum, SIG_DFL);
 		// kill(getpid(), signum);
@@ -144,42 +160,81 @@ signal_handler(int signum) {
 static int
 start_remote_callback(void *arg) {
 	struct fwd_lcore *fc = (struct fwd_lcore *)arg;
+	struct fwd_stream *fs;
 	packet_fwd_t packet_fwd = global_config.fwd_eng->packet_fwd;
+	streamid_t sm_id, nb_done;
+
+	RTE_PER_LCORE(_fwd_lcore) = fc;
+	/* poll the streams of this lcore, one per port, until all are done */
 	do {
-		(*packet_fwd)(&fwd_streams);
-		if (fwd_streams.done) {
-			break;
+		nb_done = 0;
+		for (sm_id = 0; sm_id < fc->stream_nb; sm_id++) {
+			fs = &fwd_streams[fc->stream_idx + sm_id];
+			if (fs->done) {
+				nb_done++;
+				continue;
+			}
+			(*packet_fwd)(fs);
 		}
-	} while (!fc->stopped);
+	} while (nb_done < fc->stream_nb && !fc->stopped);
 	return 0;
 }
 
+/* run one test phase: every forwarding lcore polls its own stream */
 static void
-launch_pkt_fwd() {
-	/* initialize */
+run_fwd_phase(void) {
 	fwd_callback_t fwd_begin = global_config.fwd_eng->port_fwd_begin;
 	fwd_callback_t fwd_end = global_config.fwd_eng->port_fwd_end;
+	lcoreid_t lc_id;
+	streamid_t sm_id;
 	int error;
+
+	for (sm_id = 0; sm_id < global_config.nb_fwd_streams; sm_id++) {
+		fwd_streams[sm_id].done = 0;
+		fwd_streams[sm_id].pkt_idx = 0;
+	}
 	if (fwd_begin) {
-		/* for each port */
-		(*fwd_begin)(&fwd_streams);
+		(*fwd_begin)(fwd_streams);
 	}
 
-	/* for now we only have one lcore, call it on master */
-	// for (i = 0; i < cur_fwd_config.nb_fwd_lcores; i++) {
-		/* calling run_pkt_fwd_on_lcore */
-
-	// error = rte_eal_remote_launch(start_remote_callback,
-	// 		(void *) &fwd_lcores, fwd_lcores.cpuid_idx);
-
-	error = start_remote_callback((void *) &fwd_lcores);
+	/* fwd_lcores[0] is the main lcore, launch the others first */
+	for (lc_id = 1; lc_id < global_config.nb_fwd_lcores; lc_id++) {
+		error = rte_eal_remote_launch(start_remote_callback,
+				(void *) &fwd_lcores[lc_id], fwd_lcores[lc_id].cpuid_idx);
+		if (error < 0) {
+			rte_exit(EXIT_FAILURE, "core %u busy\n",
+					fwd_lcores[lc_id].cpuid_idx);
+		}
+	}
+	start_remote_callback((void *) &fwd_lcores[0]);
+	rte_eal_mp_wait_lcore();
 	rte_delay_ms(MIN_TX_AFTER_DELAY); /* allow NIC to consume all due packets */
 
 	if (fwd_end) {
 		(*fwd_end)(NULL);
 	}
-	if (error < 0) {
-		rte_exit(EXIT_FAILURE, "core busy\n");
+}
+
+static void
+launch_pkt_fwd() {
+	unsigned int i;
+
+	if (!tx_sweep) {
+		run_fwd_phase();
+		return;
+	}
+
+	for (i = 0; i < RTE_DIM(sweep_frame_sizes) && !force_quit; i++) {
+		if (sweep_frame_sizes[i] == 0) {
+			tx_pkt_imix = 1;
+			printf("sweep-size: imix\n");
+		} else {
+			tx_pkt_imix = 0;
+			tx_pkt_length = sweep_frame_sizes[i] - RTE_ETHER_CRC_LEN;
+			tx_pkt_seg_lengths[0] = tx_pkt_length;
+			printf("sweep-size: %u\n", sweep_frame_sizes[i]);
+		}
+		run_fwd_phase();
 	}
 }
 
@@ -188,10 +243,18 @@ static void
 usage(const char *prgname)
 {
 	printf("./%s -l 0 -n number_of_memory_channels [EAL parameters] -- [app parameters]\n"
-			"tx parameters: (--peer peer_mac_address) \n"
+			"tx parameters: (--peer peer_mac_address[,peer_mac_address...]) \n"
+			"	one peer per enabled port, the last one is used for the remaining ports\n"
 			"	(-l length) the length of each packet(burstlet)\n"
 			"	(--tx-mode) for testing only. send 0 filled packets\n"
+			"	(--rx-mode) receive and drop packets\n"
 			"	(--latency-mode) send icmp ping requests\n"
+			"	(--echo-count n) number of ping requests, 1000 by default\n"
+			"	(--latency-file path) save the latency histogram as json\n"
+			"	(--imix) send a simple IMIX (7:4:1 of 64, 576 and 1518 bytes)\n"
+			"	(--sweep) tx from 64 to 1518 bytes and IMIX, one phase per size\n"
+			"	(--duration seconds) length of each tx/rx phase, 10 by default\n"
+			"tx and rx modes use one queue per enabled lcore on each enabled port\n"
 			, prgname);
 }
 
@@ -219,6 +282,7 @@ tx_parse_args(int argc, char **argv)
 	int opt, ret;
 	char **argvopt;
 	int option_index;
+	int duration, echo_count;
 	char *prgname = argv[0];
 
 	argvopt = argv;
@@ -237,6 +301,11 @@ tx_parse_args(int argc, char **argv)
 			{"tx-mode", no_argument, NULL, '2'},
 			{"latency-mode", no_argument, NULL, '3'},
 			{"icmpecho", no_argument, NULL, '4'},
+			{"imix", no_argument, NULL, '5'},
+			{"sweep", no_argument, NULL, '6'},
+			{"duration", required_argument, NULL, '7'},
+			{"echo-count", required_argument, NULL, '8'},
+			{"latency-file", required_argument, NULL, '9'},
 			{0, 0, 0, 0}
     };
 
@@ -280,6 +349,33 @@ tx_parse_args(int argc, char **argv)
 		case '4':
 			global_config.fwd_eng = &icmp_echo_engine;
 			break;
+		case '5':
+			tx_pkt_imix = 1;
+			break;
+		case '6':
+			tx_sweep = 1;
+			break;
+		case '7':
+			duration = atoi(optarg);
+			if (duration <= 0) {
+				printf("invalid duration\n");
+				usage(prgname);
+				return -1;
+			}
+			test_duration_us = (uint64_t) duration * US_PER_S;
+			break;
+		case '8':
+			echo_count = atoi(optarg);
+			if (echo_count <= 0) {
+				printf("invalid echo count\n");
+				usage(prgname);
+				return -1;
+			}
+			latency_echo_count = echo_count;
+			break;
+		case '9':
+			latency_file = optarg;
+			break;
 			
 		case 1:
 			peer_addr_str = optarg;
@@ -298,6 +394,12 @@ tx_parse_args(int argc, char **argv)
 		return -1;
 	}
 
+	if (tx_sweep && global_config.fwd_eng != &tx_engine) {
+		printf("--sweep only applies to --tx-mode\n");
+		usage(prgname);
+		return -1;
+	}
+
 	if (optind >= 0)
 		argv[optind-1] = prgname;
 
@@ -373,25 +475,6 @@ check_all_ports_link_status(uint32_t port_mask)
 	}
 }
 
-// /* TODO: implement this to use multiple lcore */
-// static void
-// init_fwd_lcore_config(void)
-// {	
-// 	unsigned int i;
-// 	unsigned int nb_lc = 0;
-// 	// unsigned int sock_num;
-
-// 	for (i = 0; i < RTE_MAX_LCORE; i++) {
-// 		if (!rte_lcore_is_enabled(i))
-// 			continue;
-// 		// sock_num = rte_lcore_to_socket_id(i);
-// 		if (i == rte_get_master_lcore())
-// 			continue;
-// 		fwd_lcores_cpuids[nb_lc++] = i;
-// 	}
-// 	nb_lcores = (lcoreid_t) nb_lc;
-// }
-
 static int
 parse_ether_addr_str(const char *addr, struct rte_ether_addr *eth_addr)
 {
@@ -426,82 +509,139 @@ parse_ether_addr_str(const char *addr, struct rte_ether_addr *eth_addr)
 	return 0;
 }
 
+/* "--peer" takes one MAC address per enabled port, in port order */
 static void
 set_def_peer_eth_addrs(void)
 {
-	portid_t i;
+	char addrs[RTE_MAX_ETHPORTS * 18];
+	char *addr = NULL, *next, *saveptr = NULL;
+	portid_t i, portid;
 	int error;
 
 	if (peer_addr_str == NULL)
 		return;
-	for (i = 0; i < RTE_MAX_ETHPORTS; i++) {
-		error = parse_ether_addr_str(peer_addr_str, &peer_eth_addrs[i]);
+	strlcpy(addrs, peer_addr_str, sizeof(addrs));
+	next = strtok_r(addrs, ",", &saveptr);
+	for (i = 0; i < global_config.nb_fwd_ports; i++) {
+		if (next != NULL)
+			addr = next;
+		portid = ports_ids[i];
+		error = parse_ether_addr_str(addr, &peer_eth_addrs[portid]);
 		if (error < 0) {
 			rte_exit(EXIT_FAILURE, "Invalid peer MAC address\n");
 		}
+		printf("Port %u peer MAC address: %02X:%02X:%02X:%02X:%02X:%02X\n",
+					portid,
+					peer_eth_addrs[portid].addr_bytes[0],
+					peer_eth_addrs[portid].addr_bytes[1],
+					peer_eth_addrs[portid].addr_bytes[2],
+					peer_eth_addrs[portid].addr_bytes[3],
+					peer_eth_addrs[portid].addr_bytes[4],
+					peer_eth_addrs[portid].addr_bytes[5]
+					);
+		if (next != NULL)
+			next = strtok_r(NULL, ",", &saveptr);
 	}
-
-	printf("Peer MAC address: %02X:%02X:%02X:%02X:%02X:%02X\n\n",
-				peer_eth_addrs[0].addr_bytes[0],
-				peer_eth_addrs[0].addr_bytes[1],
-				peer_eth_addrs[0].addr_bytes[2],
-				peer_eth_addrs[0].addr_bytes[3],
-				peer_eth_addrs[0].addr_bytes[4],
-				peer_eth_addrs[0].addr_bytes[5]
-				);
+	printf("\n");
 }
 
-/* TODO: implement this to use multiple ports */
-// set_default_fwd_ports_config(void)
-
-static bool
-check_nb_ports()
+/*
+ * Collect the enabled ports. tx and rx modes drive all of them at once,
+ * the other modes only use the first one.
+ */
+static void
+init_fwd_ports(void)
 {
-	int count = 0;
 	portid_t portid;
+	int count = 0;
+
 	RTE_ETH_FOREACH_DEV(portid) {
-		ports_ids[count] = portid;
-		count++;
-	}
-	if (count != 1) {
-		return -1;
+		if ((enabled_port_mask & (1 << portid)) == 0)
+			continue;
+		ports_ids[count++] = portid;
 	}
-	return 0;
+	if (count == 0)
+		rte_exit(EXIT_FAILURE,
+			"All available ports are disabled. Please set portmask.\n");
+	if (global_config.fwd_eng != &tx_engine
+			&& global_config.fwd_eng != &rx_engine)
+		count = 1;
+	global_config.nb_fwd_ports = count;
 }
 
 
 
+/*
+ * tx and rx modes run one stream on every enabled lcore, the other modes
+ * keep a single stream on the main lcore. fwd_lcores[0] is always the
+ * main lcore.
+ */
 static void
-init_fwd_lcore(void)
+init_fwd_lcores(void)
 {
 	unsigned int i, nb_mbufs;
-	fwd_lcores.stopped = 0;
-	for (i = 0; i < RTE_MAX_LCORE; i++) {
-		if (rte_lcore_is_enabled(i)) {
-			fwd_lcores.cpuid_idx = i;
-			break;
+	unsigned int main_lcore = rte_lcore_id();
+	lcoreid_t nb_lc = 0;
+	char pool_name[RTE_MEMPOOL_NAMESIZE];
+	struct fwd_lcore *fc;
+
+	fwd_lcores[nb_lc++].cpuid_idx = main_lcore;
+	if (global_config.fwd_eng == &tx_engine
+			|| global_config.fwd_eng == &rx_engine) {
+		for (i = 0; i < RTE_MAX_LCORE; i++) {
+			if (!rte_lcore_is_enabled(i) || i == main_lcore)
+				continue;
+			fwd_lcores[nb_lc++].cpuid_idx = i;
 		}
 	}
-
-	nb_mbufs = RTE_MAX(1 * (nb_rxd + nb_txd + MAX_PKT_BURST +
-		1 * MEMPOOL_CACHE_SIZE), 8192U);
-
-	/* create the mbuf pool */
-	fwd_lcores.mbp = rte_pktmbuf_pool_create("mbuf_pool", nb_mbufs,
-		MEMPOOL_CACHE_SIZE, 0, RTE_MBUF_DEFAULT_BUF_SIZE,
-		rte_socket_id());
-	if (fwd_lcores.mbp == NULL)
-		rte_exit(EXIT_FAILURE, "Cannot init mbuf pool\n");
+	global_config.nb_fwd_lcores = nb_lc;
+	global_config.nb_fwd_streams = nb_lc * global_config.nb_fwd_ports;
+
+	fwd_streams = rte_zmalloc("fwd_streams", sizeof(struct fwd_stream) *
+			global_config.nb_fwd_streams, RTE_CACHE_LINE_SIZE);
+	if (fwd_streams == NULL)
+		rte_exit(EXIT_FAILURE, "Cannot allocate forwarding streams\n");
+
+	/* one mbuf pool per lcore, so lcores never contend on a pool */
+	for (i = 0; i < nb_lc; i++) {
+		fc = &fwd_lcores[i];
+		fc->stopped = 0;
+		fc->stream_idx = i * global_config.nb_fwd_ports;
+		fc->stream_nb = global_config.nb_fwd_ports;
+		fc->tx_queue = i;
+		/* the pool fills the rx and tx rings of every queue the lcore serves */
+		nb_mbufs = RTE_MAX(fc->stream_nb * (nb_rxd + nb_txd + MAX_PKT_BURST) +
+			MEMPOOL_CACHE_SIZE, 8192U);
+		snprintf(pool_name, sizeof(pool_name), "mbuf_pool_%u", i);
+		fc->mbp = rte_pktmbuf_pool_create(pool_name, nb_mbufs,
+			MEMPOOL_CACHE_SIZE, 0, RTE_MBUF_DEFAULT_BUF_SIZE,
+			rte_lcore_to_socket_id(fc->cpuid_idx));
+		if (fc->mbp == NULL)
+			rte_exit(EXIT_FAILURE, "Cannot init mbuf pool for lcore %u\n",
+				fc->cpuid_idx);
+	}
+	printf("Forwarding on %u lcore(s) and %d port(s), one queue per lcore and port\n",
+			nb_lc, global_config.nb_fwd_ports);
 }
 
+/* stream i * nb_fwd_ports + k is queue i of the k-th port, polled by lcore i */
 static void
-init_fwd_stream(portid_t portid) {
-	fwd_streams.rx_port = portid;
-	fwd_streams.rx_queue = 0;
-	fwd_streams.tx_port = portid;
-	fwd_streams.rx_queue = 0;
-	fwd_streams.peer_addr = fwd_streams.tx_port;
-	fwd_streams.retry_enabled = 1;
+init_fwd_streams(void) {
+	streamid_t sm_id;
+	struct fwd_stream *fs;
+	portid_t portid;
+
+	for (sm_id = 0; sm_id < global_config.nb_fwd_streams; sm_id++) {
+		fs = &fwd_streams[sm_id];
+		portid = ports_ids[sm_id % global_config.nb_fwd_ports];
+		fs->rx_port = portid;
+		fs->rx_queue = sm_id / global_config.nb_fwd_ports;
+		fs->tx_port = portid;
+		fs->tx_queue = fs->rx_queue;
+		fs->peer_addr = fs->tx_port;
+		fs->retry_enabled = 1;
+		fs->pkt_idx = 0;
+	}
 }
 
 static void
@@ -511,22 +651,15 @@ init_port(portid_t portid) {
 		struct rte_eth_rxconf *rx_conf;
 		struct rte_eth_txconf *tx_conf;
 		struct rte_port *port;
+		queueid_t nb_queues, q;
 		int ret;
 
 		port = &ports[portid];
 		dev_info = &(port->dev_info);
 		dev_conf = &(port->dev_conf);
-		rx_conf = &port->rx_conf[0];
-		tx_conf = &port->tx_conf[0];
+		nb_queues = global_config.nb_fwd_lcores;
 
-		/* TODO: we only have one queue per port */
-		port->nb_rx_desc[0] = RTE_TEST_RX_DESC_DEFAULT;
-		port->nb_tx_desc[0] = RTE_TEST_TX_DESC_DEFAULT;
 		port->socket_id = rte_eth_dev_socket_id(portid);
-		dev_conf->rx_adv_conf.rss_conf.rss_key = NULL;
-		dev_conf->rx_adv_conf.rss_conf.rss_hf = 0;
-		dev_conf->rxmode.mq_mode = ETH_MQ_RX_NONE;
-
 
 		ret = rte_eth_dev_info_get(portid, dev_info);
 		if (ret != 0)
@@ -534,56 +667,80 @@ init_port(portid_t portid) {
 				"Error during getting device (port %u) info: %s\n",
 				portid, strerror(-ret));
 
+		if (nb_queues > dev_info->max_rx_queues
+				|| nb_queues > dev_info->max_tx_queues)
+			rte_exit(EXIT_FAILURE,
+				"Port %u supports %u rx / %u tx queues, use fewer lcores\n",
+				portid, dev_info->max_rx_queues, dev_info->max_tx_queues);
+
+		/* spread received flows over the queues with RSS */
+		dev_conf->rx_adv_conf.rss_conf.rss_key = NULL;
+		dev_conf->rx_adv_conf.rss_conf.rss_hf = 0;
+		dev_conf->rxmode.mq_mode = ETH_MQ_RX_NONE;
+		if (nb_queues > 1) {
+			dev_conf->rx_adv_conf.rss_conf.rss_hf =
+				(ETH_RSS_IP | ETH_RSS_UDP | ETH_RSS_TCP) &
+				dev_info->flow_type_rss_offloads;
+			if (dev_conf->rx_adv_conf.rss_conf.rss_hf != 0)
+				dev_conf->rxmode.mq_mode = ETH_MQ_RX_RSS;
+		}
+
 		if (dev_info->tx_offload_capa & DEV_TX_OFFLOAD_MBUF_FAST_FREE)
 			dev_conf->txmode.offloads |=
 				DEV_TX_OFFLOAD_MBUF_FAST_FREE;
 		/* port id to configure, number of rx queue for that device, 
 			number of tx queue for that device, andd config structure */
-		ret = rte_eth_dev_configure(portid, 1, 1, dev_conf);
+		ret = rte_eth_dev_configure(portid, nb_queues, nb_queues, dev_conf);
 		if (ret < 0)
 			rte_exit(EXIT_FAILURE, "Cannot configure device: err=%d, port=%u\n",
 				  ret, portid);
 
-		/* Check that numbers of Rx and Tx descriptors satisfy 
-		descriptors limits from the ethernet device information,
-		otherwise adjust them to boundaries. */
-		ret = rte_eth_dev_adjust_nb_rx_tx_desc(portid, &port->nb_rx_desc[0],
-						       &port->nb_tx_desc[0]);
-		if (ret < 0)
-			rte_exit(EXIT_FAILURE,
-				 "Cannot adjust number of descriptors: err=%d, port=%u\n",
-				 ret, portid);
-
 		ret = rte_eth_macaddr_get(portid, &port->eth_addr);
 		if (ret < 0)
 			rte_exit(EXIT_FAILURE,
 				 "Cannot get MAC address: err=%d, port=%u\n",
 				 ret, portid);
 
-		/* init one RX queue */
-		fflush(stdout);
-		*rx_conf = dev_info->default_rxconf;
-		rx_conf->offloads = dev_conf->rxmode.offloads;
-		/* port, queue id, number of descriptor, socket id, config,
-			from which to allocate*/
-		ret = rte_eth_rx_queue_setup(portid, 0, port->nb_rx_desc[0],
-					     port->socket_id,
-					     rx_conf,
-					     fwd_lcores.mbp);
-		if (ret < 0)
-			rte_exit(EXIT_FAILURE, "rte_eth_rx_queue_setup:err=%d, port=%u\n",
-				  ret, portid);
+		/* one RX and one TX queue per forwarding lcore */
+		for (q = 0; q < nb_queues; q++) {
+			rx_conf = &port->rx_conf[q];
+			tx_conf = &port->tx_conf[q];
+			port->nb_rx_desc[q] = nb_rxd;
+			port->nb_tx_desc[q] = nb_txd;
+
+			/* Check that numbers of Rx and Tx descriptors satisfy 
+			descriptors limits from the ethernet device information,
+			otherwise adjust them to boundaries. */
+			ret = rte_eth_dev_adjust_nb_rx_tx_desc(portid,
+					&port->nb_rx_desc[q], &port->nb_tx_desc[q]);
+			if (ret < 0)
+				rte_exit(EXIT_FAILURE,
+					 "Cannot adjust number of descriptors: err=%d, port=%u\n",
+					 ret, portid);
 
-		/* init one TX queue on each port */
-		fflush(stdout);
-		*tx_conf = dev_info->default_txconf;
-		tx_conf->offloads = dev_conf->txmode.offloads;
-		ret = rte_eth_tx_queue_setup(portid, 0, port->nb_tx_desc[0],
-				port->socket_id,
-				tx_conf);
-		if (ret < 0)
-			rte_exit(EXIT_FAILURE, "rte_eth_tx_queue_setup:err=%d, port=%u\n",
-				ret, portid);
+			fflush(stdout);
+			*rx_conf = dev_info->default_rxconf;
+			rx_conf->offloads = dev_conf->rxmode.offloads;
+			/* port, queue id, number of descriptor, socket id, config,
+				from which to allocate*/
+			ret = rte_eth_rx_queue_setup(portid, q, port->nb_rx_desc[q],
+						     port->socket_id,
+						     rx_conf,
+						     fwd_lcores[q].mbp);
+			if (ret < 0)
+				rte_exit(EXIT_FAILURE, "rte_eth_rx_queue_setup:err=%d, port=%u, queue=%u\n",
+					  ret, portid, q);
+
+			fflush(stdout);
+			*tx_conf = dev_info->default_txconf;
+			tx_conf->offloads = dev_conf->txmode.offloads;
+			ret = rte_eth_tx_queue_setup(portid, q, port->nb_tx_desc[q],
+					port->socket_id,
+					tx_conf);
+			if (ret < 0)
+				rte_exit(EXIT_FAILURE, "rte_eth_tx_queue_setup:err=%d, port=%u, queue=%u\n",
+					ret, portid, q);
+		}
 
 		/* XXX what is this */
 		ret = rte_eth_dev_set_ptypes(portid, RTE_PTYPE_UNKNOWN, NULL,
@@ -623,6 +780,7 @@ main(int argc, char **argv)
 	uint16_t nb_ports_available = 0;
 	uint16_t portid;
 	int do_mlockall = 0;
+	int i;
 
 	/* init EAL */
 	ret = rte_eal_init(argc, argv);
@@ -661,8 +819,8 @@ main(int argc, char **argv)
 		rte_exit(EXIT_FAILURE, "Invalid portmask; possible (0x%x)\n",
 			(1 << nb_ports) - 1);
 
-	init_fwd_lcore();
-	check_nb_ports();
+	init_fwd_ports();
+	init_fwd_lcores();
 	set_def_peer_eth_addrs();
 
 	/* Initialise each port */
@@ -677,8 +835,6 @@ main(int argc, char **argv)
 		printf("Initializing port %u... ", portid);
 		fflush(stdout);
 		init_port(portid);
-
-		init_fwd_stream(portid);
 		printf("done: \n");
 		
 		// /* Initialize TX buffers */ we don't need buffers
@@ -708,11 +864,12 @@ main(int argc, char **argv)
 			"All available ports are disabled. Please set portmask.\n");
 	}
 
+	init_fwd_streams();
 	check_all_ports_link_status(enabled_port_mask);
 
 	ret = 0;
 
-	/* we run on main, no need to wait */
+	/* main lcore runs the first streams and waits for the others */
 	launch_pkt_fwd();
 
 	RTE_ETH_FOREACH_DEV(portid) {
@@ -723,9 +880,11 @@ main(int argc, char **argv)
 		rte_eth_dev_close(portid);
 		printf(" Done\n");
 	}
-	if (fwd_lcores.mbp != NULL) {
-		rte_mempool_free(fwd_lcores.mbp);
+	for (i = 0; i < global_config.nb_fwd_lcores; i++) {
+		if (fwd_lcores[i].mbp != NULL)
+			rte_mempool_free(fwd_lcores[i].mbp);
 	}
+	rte_free(fwd_streams);
 	printf("Bye...\n");
 
 	return ret;
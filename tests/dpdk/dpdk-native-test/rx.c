@@ -39,6 +39,12 @@
 #include <rte_flow.h>
 
 #include "config.h"
+#include "stats.h"
+
+/* written once in rx_only_begin, read only by the forwarding lcores */
+static uint64_t timer_start_tsc;
+static uint64_t timer_period;
+
 /*
  * Received a burst of packets.
  */
@@ -62,8 +68,11 @@ pkt_burst_receive(struct fwd_stream *fs)
 	 */
 	nb_rx = rte_eth_rx_burst(fs->rx_port, fs->rx_queue, pkts_burst,
 				 nb_pkt_per_burst);
-	if (unlikely(nb_rx == 0))
+	if (unlikely(nb_rx == 0)) {
+		if (unlikely(rte_rdtsc() - timer_start_tsc > timer_period))
+			fs->done = true;
 		return;
+	}
 
 #ifdef RTE_TEST_PMD_RECORD_BURST_STATS
 	fs->rx_burst_stats.pkt_burst_spread[nb_rx]++;
@@ -77,11 +86,31 @@ pkt_burst_receive(struct fwd_stream *fs)
 	core_cycles = (end_tsc - start_tsc);
 	fs->core_cycles = (uint64_t) (fs->core_cycles + core_cycles);
 #endif
+
+	if (unlikely(rte_rdtsc() - timer_start_tsc > timer_period))
+		fs->done = true;
+}
+
+static void
+rx_only_begin(void *arg)
+{
+	timer_period = (rte_get_tsc_hz() + US_PER_S - 1) / US_PER_S *
+			test_duration_us;
+
+	printf("receiving... press ctrl + c to quit and see statistics\n");
+	timer_start_tsc = rte_rdtsc();
+	fwd_stats_reset();
+}
+
+static void
+rx_only_end(void *arg)
+{
+	fwd_stats_display_neat();
 }
 
 struct fwd_engine rx_engine = {
 	.fwd_mode_name  = "rxonly",
-	.port_fwd_begin = NULL,
-	.port_fwd_end   = NULL,
+	.port_fwd_begin = rx_only_begin,
+	.port_fwd_end   = rx_only_end,
 	.packet_fwd     = pkt_burst_receive,
 };
@@ -137,6 +137,7 @@ void fwd_stats_display_neat(void)
 		uint64_t rx_bad_ip_csum;
 		uint64_t rx_bad_l4_csum;
 		uint64_t rx_bad_outer_l4_csum;
+		uint64_t rx_packets;
 	} ports_stats[RTE_MAX_ETHPORTS];
 
 	uint64_t total_rx_dropped = 0;
@@ -158,18 +159,29 @@ void fwd_stats_display_neat(void)
     uint64_t hz = rte_get_tsc_hz();
     uint64_t elapsed = (curr_tsc - start_tsc_stats) - hz * (MIN_TX_AFTER_DELAY) / 1000;
 
-    struct fwd_stream *fs = &fwd_streams;
+    struct fwd_stream *fs;
+    streamid_t sm_id;
 
-    ports_stats[fs->tx_port].tx_stream = fs;
-    ports_stats[fs->rx_port].rx_stream = fs;
+    for (sm_id = 0; sm_id < global_config.nb_fwd_streams; sm_id++) {
+        fs = &fwd_streams[sm_id];
 
-    ports_stats[fs->tx_port].tx_dropped += fs->fwd_dropped;
-    ports_stats[fs->tx_port].tx_packets += fs->tx_packets;
+        ports_stats[fs->tx_port].tx_stream = fs;
+        ports_stats[fs->rx_port].rx_stream = fs;
 
-    ports_stats[fs->rx_port].rx_bad_ip_csum += fs->rx_bad_ip_csum;
-    ports_stats[fs->rx_port].rx_bad_l4_csum += fs->rx_bad_l4_csum;
-    ports_stats[fs->rx_port].rx_bad_outer_l4_csum +=
-            fs->rx_bad_outer_l4_csum;
+        ports_stats[fs->tx_port].tx_dropped += fs->fwd_dropped;
+        ports_stats[fs->tx_port].tx_packets += fs->tx_packets;
+        ports_stats[fs->rx_port].rx_packets += fs->rx_packets;
+
+        ports_stats[fs->rx_port].rx_bad_ip_csum += fs->rx_bad_ip_csum;
+        ports_stats[fs->rx_port].rx_bad_l4_csum += fs->rx_bad_l4_csum;
+        ports_stats[fs->rx_port].rx_bad_outer_l4_csum +=
+                fs->rx_bad_outer_l4_csum;
+
+        printf("port %d queue %d: tx-pps: %-14.2f rx-pps: %-14.2f\n",
+                fs->tx_port, fs->tx_queue,
+                1.0 * fs->tx_packets / elapsed * hz,
+                1.0 * fs->rx_packets / elapsed * hz);
+    }
 
     RTE_ETH_FOREACH_DEV(pt_id) {
 		if ((enabled_port_mask & (1 << pt_id)) == 0)
@@ -197,9 +209,13 @@ void fwd_stats_display_neat(void)
 		printf("port %d: tx-pps: %-14.2f\n",
 				pt_id,
 				1.0 * ports_stats[pt_id].tx_packets / elapsed * hz);
+		printf("port %d: rx-pps: %-14.2f\n",
+				pt_id,
+				1.0 * ports_stats[pt_id].rx_packets / elapsed * hz);
     }
 
 	printf("all: tx-pps: %-14.2f\n", 1.0 * total_xmit / elapsed * hz);
+	printf("all: rx-pps: %-14.2f\n", 1.0 * total_recv / elapsed * hz);
 }
 
 void
@@ -236,22 +252,27 @@ fwd_stats_display(void)
     uint64_t hz = rte_get_tsc_hz();
     uint64_t elapsed = (curr_tsc - start_tsc_stats) - hz * (MIN_TX_AFTER_DELAY) / 1000;
 
-    struct fwd_stream *fs = &fwd_streams;
+    struct fwd_stream *fs;
+    streamid_t sm_id;
 
-    ports_stats[fs->tx_port].tx_stream = fs;
-    ports_stats[fs->rx_port].rx_stream = fs;
+    for (sm_id = 0; sm_id < global_config.nb_fwd_streams; sm_id++) {
+        fs = &fwd_streams[sm_id];
 
-    ports_stats[fs->tx_port].tx_dropped += fs->fwd_dropped;
-    ports_stats[fs->tx_port].tx_packets += fs->tx_packets;
+        ports_stats[fs->tx_port].tx_stream = fs;
+        ports_stats[fs->rx_port].rx_stream = fs;
 
-    ports_stats[fs->rx_port].rx_bad_ip_csum += fs->rx_bad_ip_csum;
-    ports_stats[fs->rx_port].rx_bad_l4_csum += fs->rx_bad_l4_csum;
-    ports_stats[fs->rx_port].rx_bad_outer_l4_csum +=
-            fs->rx_bad_outer_l4_csum;
+        ports_stats[fs->tx_port].tx_dropped += fs->fwd_dropped;
+        ports_stats[fs->tx_port].tx_packets += fs->tx_packets;
+
+        ports_stats[fs->rx_port].rx_bad_ip_csum += fs->rx_bad_ip_csum;
+        ports_stats[fs->rx_port].rx_bad_l4_csum += fs->rx_bad_l4_csum;
+        ports_stats[fs->rx_port].rx_bad_outer_l4_csum +=
+                fs->rx_bad_outer_l4_csum;
 
 #ifdef RTE_TEST_PMD_RECORD_CORE_CYCLES
-    fwd_cycles += fs->core_cycles;
+        fwd_cycles += fs->core_cycles;
 #endif
+    }
     
     RTE_ETH_FOREACH_DEV(pt_id) {
 		if ((enabled_port_mask & (1 << pt_id)) == 0)
@@ -410,14 +431,17 @@ fwd_stats_reset(void)
     }
     start_tsc_stats = rte_get_tsc_cycles();
 
-	// for (sm_id = 0; sm_id < cur_fwd_config.nb_fwd_streams; sm_id++) {
-    struct fwd_stream *fs = &fwd_streams;
-    fs->rx_packets = 0;
-    fs->tx_packets = 0;
-    fs->fwd_dropped = 0;
-    fs->rx_bad_ip_csum = 0;
-    fs->rx_bad_l4_csum = 0;
-    fs->rx_bad_outer_l4_csum = 0;
+    streamid_t sm_id;
+    struct fwd_stream *fs;
+
+    for (sm_id = 0; sm_id < global_config.nb_fwd_streams; sm_id++) {
+        fs = &fwd_streams[sm_id];
+        fs->rx_packets = 0;
+        fs->tx_packets = 0;
+        fs->fwd_dropped = 0;
+        fs->rx_bad_ip_csum = 0;
+        fs->rx_bad_l4_csum = 0;
+        fs->rx_bad_outer_l4_csum = 0;
 
 #ifdef RTE_TEST_PMD_RECORD_BURST_STATS
 		memset(&fs->rx_burst_stats, 0, sizeof(fs->rx_burst_stats));
@@ -426,10 +450,191 @@ fwd_stats_reset(void)
 #ifdef RTE_TEST_PMD_RECORD_CORE_CYCLES
 		fs->core_cycles = 0;
 #endif
+    }
+}
+
+/*
+ * Latency histogram in TSC cycles, log-linear like HdrHistogram: values
+ * below 128 cycles have their own bucket, above that every power of two
+ * is split in 64 buckets, so a bucket is never wider than 1/64 of its
+ * value. Recording is a couple of shifts and an increment.
+ */
+#define LAT_SUB_BUCKET_BITS 7
+#define LAT_SUB_BUCKET_COUNT (1U << LAT_SUB_BUCKET_BITS)
+#define LAT_SUB_BUCKET_HALF (LAT_SUB_BUCKET_COUNT >> 1)
+#define LAT_NB_BUCKETS (LAT_SUB_BUCKET_COUNT + \
+		(64 - LAT_SUB_BUCKET_BITS) * LAT_SUB_BUCKET_HALF)
+
+static const double latency_percentiles[] = {50.0, 90.0, 99.0, 99.9, 99.99};
+
+static struct {
+	uint64_t buckets[LAT_NB_BUCKETS];
+	uint64_t count;
+	uint64_t sent;
+	uint64_t unexpected;
+	uint64_t min;
+	uint64_t max;
+	uint64_t sum;
+} latency_stats;
+
+static inline uint32_t
+latency_bucket_index(uint64_t cycles)
+{
+	uint32_t shift;
+
+	if (cycles < LAT_SUB_BUCKET_COUNT)
+		return (uint32_t) cycles;
+	shift = 64 - __builtin_clzll(cycles) - LAT_SUB_BUCKET_BITS;
+	return LAT_SUB_BUCKET_COUNT + (shift - 1) * LAT_SUB_BUCKET_HALF +
+		(uint32_t) ((cycles >> shift) - LAT_SUB_BUCKET_HALF);
+}
+
+/* lowest and highest value in cycles counted by a bucket */
+static void
+latency_bucket_range(uint32_t idx, uint64_t *low, uint64_t *high)
+{
+	uint32_t shift;
+	uint64_t sub;
+
+	if (idx < LAT_SUB_BUCKET_COUNT) {
+		*low = *high = idx;
+		return;
+	}
+	idx -= LAT_SUB_BUCKET_COUNT;
+	shift = idx / LAT_SUB_BUCKET_HALF + 1;
+	sub = idx % LAT_SUB_BUCKET_HALF + LAT_SUB_BUCKET_HALF;
+	*low = sub << shift;
+	*high = ((sub + 1) << shift) - 1;
+}
+
+static inline double
+cycles_to_ns(uint64_t cycles)
+{
+	return 1.0 * cycles * NS_PER_S / rte_get_tsc_hz();
+}
+
+/* highest value of the bucket holding the percentile, capped by max */
+static uint64_t
+latency_percentile(double percentile)
+{
+	uint64_t target, seen = 0, low, high;
+	uint32_t i;
+
+	if (latency_stats.count == 0)
+		return 0;
+	target = (uint64_t) (percentile / 100.0 * latency_stats.count + 0.5);
+	if (target == 0)
+		target = 1;
+	for (i = 0; i < LAT_NB_BUCKETS; i++) {
+		seen += latency_stats.buckets[i];
+		if (seen >= target) {
+			latency_bucket_range(i, &low, &high);
+			return RTE_MIN(high, latency_stats.max);
+		}
+	}
+	return latency_stats.max;
+}
+
+void
+latency_stats_reset(void)
+{
+	memset(&latency_stats, 0, sizeof(latency_stats));
+	latency_stats.min = UINT64_MAX;
+}
+
+void
+latency_stats_record(uint64_t cycles)
+{
+	latency_stats.buckets[latency_bucket_index(cycles)]++;
+	latency_stats.count++;
+	latency_stats.sum += cycles;
+	if (cycles < latency_stats.min)
+		latency_stats.min = cycles;
+	if (cycles > latency_stats.max)
+		latency_stats.max = cycles;
+}
+
+void
+latency_stats_record_sent(void)
+{
+	latency_stats.sent++;
+}
+
+void
+latency_stats_record_unexpected(void)
+{
+	latency_stats.unexpected++;
 }
 
 void
 latency_stats_display(void)
 {
-	printf("to be implemented.");
+	unsigned int i;
+	uint64_t lost = 0;
+
+	if (latency_stats.sent > latency_stats.count)
+		lost = latency_stats.sent - latency_stats.count;
+	printf("latency: sent %" PRIu64 " received %" PRIu64 " lost %" PRIu64
+			" unexpected %" PRIu64 "\n",
+			latency_stats.sent, latency_stats.count, lost,
+			latency_stats.unexpected);
+	if (latency_stats.count == 0)
+		return;
+	printf("latency: min %.3fus avg %.3fus max %.3fus\n",
+			cycles_to_ns(latency_stats.min) / 1000,
+			cycles_to_ns(latency_stats.sum) / latency_stats.count / 1000,
+			cycles_to_ns(latency_stats.max) / 1000);
+	for (i = 0; i < RTE_DIM(latency_percentiles); i++)
+		printf("latency: p%g %.3fus\n", latency_percentiles[i],
+				cycles_to_ns(latency_percentile(latency_percentiles[i])) / 1000);
+}
+
+/*
+ * Save the summary and the non-empty buckets as json:
+ * "buckets" is a list of [low_ns, high_ns, count].
+ */
+int
+latency_stats_save(const char *path)
+{
+	FILE *f;
+	unsigned int i;
+	uint64_t low, high;
+	int first = 1;
+
+	f = fopen(path, "w");
+	if (f == NULL) {
+		printf("Cannot open %s: %s\n", path, strerror(errno));
+		return -1;
+	}
+
+	fprintf(f, "{\"tsc_hz\": %" PRIu64 ", \"sent\": %" PRIu64
+			", \"count\": %" PRIu64 ", \"unexpected\": %" PRIu64,
+			rte_get_tsc_hz(), latency_stats.sent, latency_stats.count,
+			latency_stats.unexpected);
+	if (latency_stats.count > 0) {
+		fprintf(f, ", \"min_ns\": %.1f, \"avg_ns\": %.1f, \"max_ns\": %.1f",
+				cycles_to_ns(latency_stats.min),
+				cycles_to_ns(latency_stats.sum) / latency_stats.count,
+				cycles_to_ns(latency_stats.max));
+		fprintf(f, ", \"percentiles_ns\": {");
+		for (i = 0; i < RTE_DIM(latency_percentiles); i++)
+			fprintf(f, "%s\"%g\": %.1f", i ? ", " : "",
+					latency_percentiles[i],
+					cycles_to_ns(latency_percentile(latency_percentiles[i])));
+		fprintf(f, "}");
+	}
+	fprintf(f, ", \"buckets\": [");
+	for (i = 0; i < LAT_NB_BUCKETS; i++) {
+		if (latency_stats.buckets[i] == 0)
+			continue;
+		latency_bucket_range(i, &low, &high);
+		fprintf(f, "%s[%.1f, %.1f, %" PRIu64 "]", first ? "" : ", ",
+				cycles_to_ns(low), cycles_to_ns(high),
+				latency_stats.buckets[i]);
+		first = 0;
+	}
+	fprintf(f, "]}\n");
+	fclose(f);
+	printf("latency histogram saved to %s\n", path);
+	return 0;
 }
\ No newline at end of file
@@ -13,7 +13,12 @@ struct queue_stats_mappings {
 void fwd_stats_display(void);
 void fwd_stats_reset(void);
 void fwd_stats_display_neat(void);
+void latency_stats_reset(void);
+void latency_stats_record(uint64_t cycles);
+void latency_stats_record_sent(void);
+void latency_stats_record_unexpected(void);
 void latency_stats_display(void);
+int latency_stats_save(const char *path);
 
 
 void map_port_queue_stats_mapping_registers(portid_t pi, struct rte_port *port);
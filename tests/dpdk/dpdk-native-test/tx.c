@@ -47,15 +47,24 @@ static uint32_t tx_ip_dst_addr = (198U << 24) | (18 << 16) | (0 << 8) | 2;
 
 #define IP_DEFTTL  64   /* from RFC 1340. */
 
-static struct rte_ipv4_hdr pkt_ip_hdr; /**< IP header of transmitted packets. */
-//RTE_DEFINE_PER_LCORE(uint8_t, _ip_var); /**< IP address variation */
-static struct rte_udp_hdr pkt_udp_hdr; /**< UDP header of tx packets. */
+/* simple IMIX: 7:4:1 of 64, 576 and 1518 byte frames, including CRC */
+#define IMIX_PATTERN_LEN 12
+static const uint16_t imix_frame_sizes[IMIX_PATTERN_LEN] = {
+	64, 576, 64, 64, 576, 64, 1518, 64, 576, 64, 64, 576,
+};
+
+/* headers of one packet size, streams cycle through the templates */
+struct tx_pkt_template {
+	uint16_t data_len;
+	struct rte_ipv4_hdr ip_hdr;
+	struct rte_udp_hdr udp_hdr;
+};
+static struct tx_pkt_template pkt_templates[IMIX_PATTERN_LEN];
+static uint32_t nb_pkt_templates;
 
-#define TEST_INTERVAL_US 10e6  /* 10s of testing */
+/* written once in tx_only_begin, read only by the forwarding lcores */
 static uint64_t timer_start_tsc;
-static uint64_t timer_curr_tsc;
 static uint64_t timer_period;
-static uint64_t timer_diff_tsc;
 
 static void
 copy_buf_to_pkt_segs(void* buf, unsigned len, struct rte_mbuf *pkt,
@@ -131,13 +140,25 @@ setup_pkt_udp_ip_headers(struct rte_ipv4_hdr *ip_hdr,
 	ip_hdr->hdr_checksum = rte_ipv4_cksum(ip_hdr);
 }
 
+static void
+setup_pkt_template(struct tx_pkt_template *tmpl, uint16_t pkt_len)
+{
+	tmpl->data_len = pkt_len;
+	setup_pkt_udp_ip_headers(&tmpl->ip_hdr, &tmpl->udp_hdr,
+			(uint16_t) (pkt_len - (sizeof(struct rte_ether_hdr) +
+					sizeof(struct rte_ipv4_hdr) +
+					sizeof(struct rte_udp_hdr))));
+}
+
 static inline bool
 pkt_burst_prepare(struct rte_mbuf *pkt, struct rte_mempool *mbp,
 		struct rte_ether_hdr *eth_hdr, const uint16_t vlan_tci,
-		const uint16_t vlan_tci_outer, const uint64_t ol_flags)
+		const uint16_t vlan_tci_outer, const uint64_t ol_flags,
+		const struct tx_pkt_template *tmpl, const uint16_t udp_src_port)
 {
 	struct rte_mbuf *pkt_segs[RTE_MAX_SEGS_PER_PKT];
 	struct rte_mbuf *pkt_seg;
+	struct rte_udp_hdr *udp_hdr;
 	uint32_t nb_segs, pkt_len;
 	uint8_t i;
 
@@ -152,7 +173,7 @@ pkt_burst_prepare(struct rte_mbuf *pkt, struct rte_mempool *mbp,
 	}
 
 	rte_pktmbuf_reset_headroom(pkt);
-	pkt->data_len = tx_pkt_seg_lengths[0];
+	pkt->data_len = tmpl->data_len;
 	pkt->ol_flags = ol_flags;
 	pkt->vlan_tci = vlan_tci;
 	pkt->vlan_tci_outer = vlan_tci_outer;
@@ -172,12 +193,19 @@ pkt_burst_prepare(struct rte_mbuf *pkt, struct rte_mempool *mbp,
 	 * Copy headers in first packet segment(s).
 	 */
 	copy_buf_to_pkt(eth_hdr, sizeof(*eth_hdr), pkt, 0);
-	copy_buf_to_pkt(&pkt_ip_hdr, sizeof(pkt_ip_hdr), pkt,
+	copy_buf_to_pkt(&tmpl->ip_hdr, sizeof(tmpl->ip_hdr), pkt,
 			sizeof(struct rte_ether_hdr));
-	// if (txonly_multi_flow) { ...
-	copy_buf_to_pkt(&pkt_udp_hdr, sizeof(pkt_udp_hdr), pkt,
+	copy_buf_to_pkt(&tmpl->udp_hdr, sizeof(tmpl->udp_hdr), pkt,
 			sizeof(struct rte_ether_hdr) +
 			sizeof(struct rte_ipv4_hdr));
+	/*
+	 * One UDP source port per stream, so that the peer spreads the
+	 * streams over its queues with RSS. No UDP checksum to update.
+	 */
+	udp_hdr = rte_pktmbuf_mtod_offset(pkt, struct rte_udp_hdr *,
+			sizeof(struct rte_ether_hdr) +
+			sizeof(struct rte_ipv4_hdr));
+	udp_hdr->src_port = rte_cpu_to_be_16(udp_src_port);
 	/*
 	 * Complete first mbuf of packet and append it to the
 	 * burst of packets to be transmitted.
@@ -202,9 +230,11 @@ pkt_burst_transmit(struct fwd_stream *fs)
 	uint16_t nb_tx;
 	uint16_t nb_pkt;
 	uint16_t vlan_tci, vlan_tci_outer;
+	uint16_t udp_src_port;
 	uint32_t retry;
 	uint64_t ol_flags = 0;
 	uint64_t tx_offloads;
+	const struct tx_pkt_template *tmpl;
 #ifdef RTE_TEST_PMD_RECORD_CORE_CYCLES
 	uint64_t start_tsc;
 	uint64_t end_tsc;
@@ -234,14 +264,19 @@ pkt_burst_transmit(struct fwd_stream *fs)
 	rte_ether_addr_copy(&peer_eth_addrs[fs->peer_addr], &eth_hdr.d_addr);
 	rte_ether_addr_copy(&ports[fs->tx_port].eth_addr, &eth_hdr.s_addr);
 	eth_hdr.ether_type = rte_cpu_to_be_16(RTE_ETHER_TYPE_IPV4);
+	udp_src_port = (uint16_t) (tx_udp_src_port + fs->tx_queue);
 
 	if (rte_mempool_get_bulk(mbp, (void **)pkts_burst,
 				nb_pkt_per_burst) == 0) {
 		for (nb_pkt = 0; nb_pkt < nb_pkt_per_burst; nb_pkt++) {
+			tmpl = &pkt_templates[fs->pkt_idx];
+			if (++fs->pkt_idx == nb_pkt_templates)
+				fs->pkt_idx = 0;
 			if (unlikely(!pkt_burst_prepare(pkts_burst[nb_pkt], mbp,
 							&eth_hdr, vlan_tci,
 							vlan_tci_outer,
-							ol_flags))) {
+							ol_flags, tmpl,
+							udp_src_port))) {
 				rte_mempool_put_bulk(mbp,
 						(void **)&pkts_burst[nb_pkt],
 						nb_pkt_per_burst - nb_pkt);
@@ -253,10 +288,14 @@ pkt_burst_transmit(struct fwd_stream *fs)
 			pkt = rte_mbuf_raw_alloc(mbp);
 			if (pkt == NULL)
 				break;
+			tmpl = &pkt_templates[fs->pkt_idx];
+			if (++fs->pkt_idx == nb_pkt_templates)
+				fs->pkt_idx = 0;
 			if (unlikely(!pkt_burst_prepare(pkt, mbp, &eth_hdr,
 							vlan_tci,
 							vlan_tci_outer,
-							ol_flags))) {
+							ol_flags, tmpl,
+							udp_src_port))) {
 				rte_pktmbuf_free(pkt);
 				break;
 			}
@@ -300,9 +339,7 @@ pkt_burst_transmit(struct fwd_stream *fs)
 	fs->core_cycles = (uint64_t) (fs->core_cycles + core_cycles);
 #endif
 
-	timer_curr_tsc = rte_rdtsc();
-	timer_diff_tsc = timer_curr_tsc - timer_start_tsc;
-	if (unlikely(timer_diff_tsc > timer_period)) {
+	if (unlikely(rte_rdtsc() - timer_start_tsc > timer_period)) {
 		fs->done = true;
 	}
 }
@@ -310,16 +347,27 @@ pkt_burst_transmit(struct fwd_stream *fs)
 static void
 tx_only_begin(void *arg)
 {
-	uint16_t pkt_data_len;
+	struct fwd_stream *fsm = (struct fwd_stream *) arg;
+	streamid_t sm_id;
+	uint32_t i;
+
 	timer_period = (rte_get_tsc_hz() + US_PER_S - 1) / US_PER_S *
-			TEST_INTERVAL_US;
+			test_duration_us;
 
 	printf("starting... press ctrl + c to quit and see statistics\n");
-	pkt_data_len = (uint16_t) (tx_pkt_length - (
-					sizeof(struct rte_ether_hdr) +
-					sizeof(struct rte_ipv4_hdr) +
-					sizeof(struct rte_udp_hdr)));
-	setup_pkt_udp_ip_headers(&pkt_ip_hdr, &pkt_udp_hdr, pkt_data_len);
+	if (tx_pkt_imix) {
+		nb_pkt_templates = IMIX_PATTERN_LEN;
+		for (i = 0; i < nb_pkt_templates; i++)
+			setup_pkt_template(&pkt_templates[i],
+					imix_frame_sizes[i] - RTE_ETHER_CRC_LEN);
+	} else {
+		nb_pkt_templates = 1;
+		setup_pkt_template(&pkt_templates[0], tx_pkt_length);
+	}
+	/* start the streams at different places of the pattern */
+	for (sm_id = 0; sm_id < global_config.nb_fwd_streams; sm_id++)
+		fsm[sm_id].pkt_idx = sm_id % nb_pkt_templates;
+
 	timer_start_tsc = rte_rdtsc();
 	fwd_stats_reset();
 }
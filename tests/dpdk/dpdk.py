@@ -12,17 +12,28 @@ except ImportError:
 
 from hwcompatible.test import Test
 from hwcompatible.command import Command, CertCommandError
-from hwcompatible.document import CertDocument
+from hwcompatible.document import CertDocument, Document
 from hwcompatible.env import CertEnv
+from hwcompatible.commandUI import CommandUI
+from hwcompatible import instrument
+import hwcompatible.hugepageutil as hp
+from hwcompatible.dpdkutil import get_devices_with_compatible_driver
+from hwcompatible.pciutil import get_netdev_slot
 
-import hugepages as hp
+import placement
 # import devbind as db
 
+# simple IMIX sent by the native test app, frame sizes including CRC
+IMIX_FRAME_SIZES = [64] * 7 + [576] * 4 + [1518]
+# preamble, start of frame delimiter and inter-frame gap
+ETHER_FRAME_OVERHEAD = 20
+
 # TODO: do we need vfio modules?
 class DPDKTest(Test):
     def __init__(self):
         Test.__init__(self)
         self.requirements = []
+        self.benchmark = True
         self.subtests = [self.test_setup, self.test_speed,
                 self.test_latency]
         self.server_ip = None
@@ -32,6 +43,14 @@ class DPDKTest(Test):
         self.test_dir = os.path.dirname(os.path.realpath(__file__))
         self.dut = '' # name the the device under test
         self.portmask = "0xffff"
+        self.logdir = None
+        self.nb_lcores = 4      # forwarding lcores, one tx queue each
+        self.sweep_duration = 5 # seconds per packet size
+        self.link_speeds = {}   # Mb/s per port, as reported by the native test app
+        self.speed_results = []
+        self.echo_count = 1000  # icmp echo requests of the latency test
+        self.socket_mem = 2048  # MB of hugepages on the node of the device
+        self.placement = None
 
 
     def setup(self, args=None):
@@ -41,9 +60,7 @@ class DPDKTest(Test):
         """
         self.args = args or argparse.Namespace()
         self.dut = getattr(self.args, 'device', None)
-
-        if os.system("dpdk-hugepages.py --setup 2G") != 0:
-            print("Unable to run dpdk-hugepage script. Please check your dpdk installation.")
+        self.logdir = getattr(self.args, 'logdir', None)
 
         devtype = self._get_dev_name_type(self.dut)
         # get pci address
@@ -52,8 +69,12 @@ class DPDKTest(Test):
         else:
             self.pci_address = self.dut.get_name()
 
+        self.placement = placement.plan(self.pci_address, self.nb_lcores, self.socket_mem)
+        self._setup_hugepage()
+
         self.server_ip = CertDocument(CertEnv.certificationfile).get_server()
         self.peermac = ""
+        self.peermacs = []
 
     def test(self):
         """
@@ -83,9 +104,20 @@ class DPDKTest(Test):
             print("[X] Stop dpdk-testpmd server failed.")
             return False
 
+        if self.choose_multiport():
+            return self.test_multiport()
         return True
 
     def test_setup(self):
+        print("[.] %s is on numa node %d, using lcores %s of node %d." %
+              (self.pci_address, self.placement['device_node'],
+               ','.join(str(cpu) for cpu in self.placement['lcores']), self.placement['node']))
+        for warning in self.placement['warnings']:
+            print("Warning: %s" % warning)
+        if not self.placement['local']:
+            print("Warning: %s is not served from its own numa node, "
+                  "throughput and latency will suffer." % self.pci_address)
+
         if not self._check_hugepage_allocate():
             print("[X] No hugepage allocated.")
             return False
@@ -104,43 +136,205 @@ class DPDKTest(Test):
         return True
 
     def test_speed(self):
-        '''test (single-core) DPDK speed'''
+        """
+        Sweep DPDK tx throughput from 64 to 1518 bytes and IMIX,
+        with one lcore and one tx queue per forwarding core
+        :return:
+        """
         print("Please wait while speed test is running...")
-        self.packet_size = 1514
+        self.speed_results = self.run_speed_sweep([self.pci_address], [self.peermac])
+        if not self.speed_results:
+            return False
+        self.save_speed_results("dpdk-speed-%s.json" % self.pci_address, [self.pci_address])
+        return True
+
+    def run_speed_sweep(self, pci_addresses, peermacs):
+        """
+        Run the tx sweep on one or several ports driven by the same EAL
+        :param pci_addresses:
+        :param peermacs: MAC of the peer of each port
+        :return: list of per size results, empty on failure
+        """
+        eal_pci = ' '.join("-w %s" % pci for pci in pci_addresses)
+        portmask = (1 << len(pci_addresses)) - 1
         try:
-            comm = Command("cd %s; ./build/tx -l 0 -n 1 -w %s -- --peer %s -p 0x1 -l %d --tx-mode"
-                    % (self.test_dir, self.pci_address, self.peermac, self.packet_size))
+            comm = Command("cd %s; ./build/tx %s -n 1 %s -- --peer %s -p %#x "
+                           "--tx-mode --sweep --duration %d"
+                           % (self.test_dir, placement.eal_args(self.placement), eal_pci,
+                              ','.join(peermacs), portmask, self.sweep_duration))
             print(comm.command)
-            res = comm.get_str(regex="tx-pps: [0-9.]*", single_line=False)
-            pps = float(res.split(':')[-1].strip())
-            print("[.] The average speed is around %f Mbps" % (8 * self.packet_size * pps / 1e6))
+            lines = comm.get_str(regex=r"^(Port\d+ Link Up. Speed \d+ Mbps|sweep-size: \S+|"
+                                       r"(all|port \d+): tx-pps: [0-9.]+)",
+                                 single_line=False, return_list=True)
         except CertCommandError as concrete_error:
             print(concrete_error)
             print("[X] Speed test fail.\n")
+            return []
+
+        results = self.parse_speed_sweep(lines or [])
+        if not results:
+            print("[X] No throughput reported by the speed test.\n")
+            return []
+
+        print("%-8s %-12s %-12s %-12s" % ("size", "Mpps", "Gbps", "line rate"))
+        for result in results:
+            print("%-8s %-12.3f %-12.3f %.1f%%" %
+                  (result['size'], result['mpps'], result['gbps'], result['line_rate_percent']))
+            if len(result['ports']) > 1:
+                for port in result['ports']:
+                    print("  port %-3d %-12.3f %-12.3f %.1f%%" %
+                          (port['port'], port['mpps'], port['gbps'], port['line_rate_percent']))
+        return results
+
+    def get_rates(self, pps, frame_size, link_speed):
+        """
+        Throughput of a packet rate against the line rate of a link
+        :param pps:
+        :param frame_size: bytes, including CRC
+        :param link_speed: Mb/s
+        :return:
+        """
+        line_rate_pps = 0
+        if link_speed:
+            line_rate_pps = link_speed * 1e6 / ((frame_size + ETHER_FRAME_OVERHEAD) * 8)
+        return {
+            'mpps': pps / 1e6,
+            'gbps': pps * frame_size * 8 / 1e9,
+            'line_rate_mpps': line_rate_pps / 1e6,
+            'line_rate_percent': 100.0 * pps / line_rate_pps if line_rate_pps else 0,
+        }
+
+    def parse_speed_sweep(self, lines):
+        """
+        Turn the output of the tx sweep into per size results
+        :param lines: matched lines of the native test app output
+        :return: list of dict, one per packet size
+        """
+        results = []
+        size = None
+        ports = []
+        for line in lines:
+            if line.startswith("Port"):
+                port_id = int(line.split()[0][4:])
+                self.link_speeds[port_id] = int(line.split()[-2])
+            elif line.startswith("sweep-size:"):
+                size = line.split(':')[1].strip()
+                ports = []
+            elif line.startswith("port ") and size:
+                port_id = int(line.split()[1].rstrip(':'))
+                ports.append((port_id, float(line.split(':')[-1].strip())))
+            elif line.startswith("all: tx-pps:") and size:
+                pps = float(line.split(':')[-1].strip())
+                if size == "imix":
+                    frame_size = float(sum(IMIX_FRAME_SIZES)) / len(IMIX_FRAME_SIZES)
+                else:
+                    frame_size = int(size)
+                result = {'size': size, 'frame_size': frame_size, 'ports': []}
+                result.update(self.get_rates(pps, frame_size, sum(self.link_speeds.values())))
+                for port_id, port_pps in ports:
+                    port = {'port': port_id}
+                    port.update(self.get_rates(port_pps, frame_size, self.link_speeds.get(port_id, 0)))
+                    result['ports'].append(port)
+                results.append(result)
+                size = None
+        return results
+
+    def save_speed_results(self, filename, pci_addresses):
+        """
+        Save the throughput sweep as json in the job directory
+        :param filename:
+        :param pci_addresses:
+        :return:
+        """
+        if self.logdir:
+            filename = os.path.join(self.logdir, filename)
+        results = {'pci': pci_addresses,
+                   'link_speeds': self.link_speeds,
+                   'lcores': self.placement['lcores'],
+                   'placement': self.placement,
+                   'duration': self.sweep_duration,
+                   'results': self.speed_results}
+        if Document(filename, results).save():
+            instrument.output(filename)
+            print("[.] Speed results saved to %s" % filename)
+
+    def choose_multiport(self):
+        """
+        Ask whether to drive all DPDK ports at the same time, only once
+        from the first dpdk testcase
+        :return:
+        """
+        if self.dut.get_property("PORTNB") != 1:
+            return False
+        if len(get_devices_with_compatible_driver()) < 2:
             return False
+        return CommandUI().prompt_confirm("Run DPDK test on all ports at the same time?")
 
+    def test_multiport(self):
+        """
+        Sweep tx throughput on all DPDK ports from a single EAL instance
+        :return:
+        """
+        pci_addresses = get_devices_with_compatible_driver()
+        for pci in pci_addresses:
+            node = placement.get_device_node(pci)
+            if node >= 0 and node != self.placement['node']:
+                print("Warning: %s is on numa node %d, lcores are on node %d." %
+                      (pci, node, self.placement['node']))
+        # the queues of remote ports are set up on their own node
+        self.placement = placement.add_devices(self.placement, pci_addresses)
+        self._setup_hugepage()
+
+        if not self.call_remote_server('dpdk-testpmd', 'start', len(pci_addresses)):
+            print("[X] start dpdk-testpmd server failed.")
+            return False
+        if len(self.peermacs) < len(pci_addresses):
+            print("Warning: server has %d ports for %d local ports." %
+                  (len(self.peermacs), len(pci_addresses)))
+
+        print("[+] Testing %d ports at the same time..." % len(pci_addresses))
+        self.link_speeds = {}
+        self.speed_results = self.run_speed_sweep(pci_addresses, self.peermacs)
+        if not self.call_remote_server('dpdk-testpmd', 'stop'):
+            print("[X] Stop dpdk-testpmd server failed.")
+        if not self.speed_results:
+            return False
+        self.save_speed_results("dpdk-multiport.json", pci_addresses)
         return True
 
     def test_latency(self):
+        """
+        Measure icmp echo round trip time, the native test app keeps a
+        TSC histogram and saves it as json for us to load
+        :return:
+        """
         print('[+] running dpdk latency test...')
+        filename = os.path.abspath(os.path.join(self.logdir or self.test_dir,
+                                                "dpdk-latency-%s.json" % self.pci_address))
         try:
             # TODO: -w is deprecated since DPDK 20. I use -w for compatibility with version
             # before 20. Consider using -a instead
-            comm = Command("cd %s; ./build/tx -l 0 -n 1 -w %s -- --peer %s -p 0x1 --latency-mode"
-                    % (self.test_dir, self.pci_address, self.peermac))
-            rttstrs = comm.get_str(regex="rtt: [0-9.]*ms", single_line=False, return_list=True)
-            if not rttstrs or len(rttstrs) == 0:
-                print("[X] no response from server.")
-                return False
-            # rtt in ms
-            rtt = [float(res.split(':')[-1].strip()[:-2]) for res in rttstrs]
-            rtt_avg = sum(rtt) / len(rtt)
-            print("[.] Latency test done. The average latency is around %.4f ms" % rtt_avg)
-        except CertCommandError as concrete_error:
+            comm = Command("cd %s; ./build/tx %s -n 1 -w %s -- --peer %s -p 0x1 --latency-mode "
+                           "--echo-count %d --latency-file %s"
+                           % (self.test_dir, placement.eal_args(self.placement, 1),
+                              self.pci_address, self.peermac, self.echo_count, filename))
+            comm.run_quiet()
+            with open(filename) as latency_file:
+                latency = json.load(latency_file)
+        except (CertCommandError, IOError, ValueError) as concrete_error:
             print(concrete_error)
             print("[X] latency test fail.")
             return False
 
+        if not latency.get('count'):
+            print("[X] no response from server.")
+            return False
+        print("[.] Latency test done, %d of %d echo replies received." %
+              (latency['count'], latency['sent']))
+        print("[.] min %.3fus, avg %.3fus, max %.3fus" %
+              (latency['min_ns'] / 1e3, latency['avg_ns'] / 1e3, latency['max_ns'] / 1e3))
+        print("[.] " + ", ".join("p%s %.3fus" % (percentile, value / 1e3) for percentile, value in
+                                 sorted(latency['percentiles_ns'].items(), key=lambda x: float(x[0]))))
         return True
 
     def test_cpu_usage(self):
@@ -155,8 +349,22 @@ class DPDKTest(Test):
         else:
             hp.show_non_numa_pages()
 
+    def _setup_hugepage(self):
+        '''Reserve hugepages on the numa nodes of the placement'''
+        if not self.placement['numa']:
+            if os.system("dpdk-hugepages.py --setup %dM" % self.socket_mem) != 0:
+                print("Unable to run dpdk-hugepage script. Please check your dpdk installation.")
+            return
+
+        for node, memsize in enumerate(self.placement['socket_mem']):
+            if memsize and not hp.reserve_node_pages(node, memsize):
+                print("Warning: unable to reserve %dMB of hugepages on node %d." %
+                      (memsize, node))
+        if not hp.get_mountpoints() and os.system("dpdk-hugepages.py --mount") != 0:
+            print("Unable to run dpdk-hugepage script. Please check your dpdk installation.")
+
     def _check_hugepage_allocate(self):
-        return hp.check_hugepage_allocate(self.numa)
+        return hp.check_hugepage_allocate(self.numa, self.placement['node'])
     
     def _check_hugepage_mount(self):
         mounted = hp.get_mountpoints()
@@ -168,12 +376,13 @@ class DPDKTest(Test):
     def _check_lsmod(self):
         return db.is_module_loaded(self.supported_modules)
 
-    def call_remote_server(self, cmd, act='start'):
+    def call_remote_server(self, cmd, act='start', nb_ports=1):
         """
         Connect to the server somehow. 
         """
         form = dict()
         form['cmd'] = cmd
+        form['ports'] = nb_ports
         url = 'http://%s/api/dpdk/%s' % (self.server_ip, act)
         data = urlencode(form).encode('utf8')
         headers = {
@@ -187,7 +396,9 @@ class DPDKTest(Test):
             print(concrete_error)
             return False
         if act == 'start':
-            self.peermac = json.loads(response.read())['mac']
+            peer = json.loads(response.read())
+            self.peermac = peer['mac']
+            self.peermacs = peer.get('macs', [self.peermac])
 
         print("Status: %u %s" % (response.code, response.msg))
         return int(response.code) == 200
@@ -233,16 +444,7 @@ class DPDKTest(Test):
             return 'ib'
 
     def _get_pci_of_device(self, device):
-        name = device.get_name()
-        comm = Command("ethtool -i %s" % (name))
-        comm.start()
-        pci = ""
-        while True:
-            line = comm.readline()
-            if line.split(":", 1)[0].strip() == "bus-info":
-                pci = line.split(":", 1)[1].strip()
-                break
-        return pci
+        return get_netdev_slot(device.get_name())
 
     # def _get_driver_of_device(self, device):
     #     name =device.get_name()
@@ -0,0 +1,127 @@
+import os
+import glob
+
+from hwcompatible.pciutil import get_pci_inventory
+from hwcompatible.sysfsutil import read_sysfs
+
+SYSFS_NODE = '/sys/devices/system/node'
+SYSFS_CPU = '/sys/devices/system/cpu'
+
+
+def parse_cpulist(cpulist):
+    '''Expand a kernel cpu list such as "0-3,8,10-11"'''
+    cpus = []
+    for item in cpulist.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '-' in item:
+            first, last = item.split('-', 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(item))
+    return cpus
+
+
+def get_online_cpus():
+    '''Online cpus of the system'''
+    online = read_sysfs(os.path.join(SYSFS_CPU, 'online'))
+    if online:
+        return parse_cpulist(online)
+    return list(range(os.sysconf('SC_NPROCESSORS_ONLN')))
+
+
+def get_node_cpus():
+    '''Map every numa node to its online cpus, node 0 holds all cpus without numa'''
+    online = set(get_online_cpus())
+    nodes = dict()
+    for node_path in glob.glob(os.path.join(SYSFS_NODE, 'node[0-9]*')):
+        node = int(os.path.basename(node_path)[4:])
+        cpus = parse_cpulist(read_sysfs(os.path.join(node_path, 'cpulist')))
+        nodes[node] = [cpu for cpu in cpus if cpu in online]
+    if not nodes:
+        nodes[0] = sorted(online)
+    return nodes
+
+
+def get_node_distances(node):
+    '''Distance from a numa node to every node, as listed by the kernel'''
+    distances = read_sysfs(os.path.join(SYSFS_NODE, 'node%d' % node, 'distance'))
+    return [int(distance) for distance in distances.split()]
+
+
+def get_device_node(pci_address):
+    '''Numa node of a pci device, -1 when the firmware does not tell'''
+    dev = get_pci_inventory().get(pci_address)
+    return dev['numa_node'] if dev else -1
+
+
+def plan(pci_address, nb_lcores, socket_mem):
+    '''
+    Place the lcores and hugepage memory of a DPDK run next to the device.
+    Returns a dict with the device node, the node serving it, the lcores,
+    the --socket-mem list (MB per node) and the warnings found on the way.
+    '''
+    nodes = get_node_cpus()
+    device_node = get_device_node(pci_address)
+    warnings = []
+
+    node = device_node
+    if node not in nodes:
+        node = min(nodes)
+        if len(nodes) > 1:
+            warnings.append("numa node of %s is unknown, using node %d" % (pci_address, node))
+    if not nodes[node]:
+        # memory only node, fall back to the closest node with cpus
+        distances = get_node_distances(node)
+        candidates = [n for n in nodes if nodes[n]]
+        candidates.sort(key=lambda n: distances[n] if n < len(distances) else n)
+        warnings.append("node %d of %s has no online cpu, using node %d" %
+                        (node, pci_address, candidates[0]))
+        node = candidates[0]
+
+    cpus = nodes[node]
+    # leave cpu 0 to the system when the node has enough cpus
+    if len(cpus) > nb_lcores and 0 in cpus:
+        cpus = [cpu for cpu in cpus if cpu != 0]
+    lcores = cpus[:nb_lcores]
+    if len(lcores) < nb_lcores:
+        warnings.append("node %d only has %d cpus for %d lcores" %
+                        (node, len(lcores), nb_lcores))
+
+    mem = [0] * (max(nodes) + 1)
+    mem[node] = socket_mem
+    return {'pci': pci_address,
+            'device_node': device_node,
+            'node': node,
+            'local': device_node < 0 or node == device_node,
+            'numa': len(nodes) > 1,
+            'lcores': lcores,
+            'socket_mem': mem,
+            'warnings': warnings}
+
+
+def add_devices(placement, pci_addresses):
+    '''
+    Copy of a placement that also reserves its socket memory on the numa
+    node of every other device driven by the same EAL, so that their rx and
+    tx queues can be set up on their own node.
+    '''
+    mem = list(placement['socket_mem'])
+    socket_mem = mem[placement['node']]
+    for pci in pci_addresses:
+        node = get_device_node(pci)
+        if 0 <= node < len(mem):
+            mem[node] = socket_mem
+    widened = dict(placement)
+    widened['socket_mem'] = mem
+    return widened
+
+
+def eal_args(placement, nb_lcores=None):
+    '''EAL options for a placement, optionally restricted to its first lcores'''
+    lcores = placement['lcores'][:nb_lcores] if nb_lcores else placement['lcores']
+    args = "-l %s" % ','.join(str(cpu) for cpu in lcores)
+    if placement['numa']:
+        args += " --socket-mem %s" % ','.join(str(mem) for mem in placement['socket_mem'])
+    return args
@@ -1,34 +1,236 @@
 import os
-import time
+import re
+import shutil
 import argparse
-try:
-    from urllib.parse import urlencode
-    from urllib.request import urlopen, Request
-    from urllib.error import HTTPError
-except ImportError:
-    from urllib import urlencode
-    from urllib2 import urlopen, Request, HTTPError
 
 from hwcompatible.test import Test
-from hwcompatible.command import Command
-from hwcompatible.document import CertDocument
-from hwcompatible.env import CertEnv
+from hwcompatible.command import Command, CertCommandError
+from hwcompatible.document import Document
+from hwcompatible.commandUI import CommandUI
+from hwcompatible import instrument
+import hwcompatible.hugepageutil as hp
+
+import placement
+
+# spdk_nvme_perf is the name since SPDK 21.01, older trees build examples/nvme/perf
+PERF_COMMANDS = ['spdk_nvme_perf', 'build/bin/spdk_nvme_perf', 'build/examples/perf']
+PERCENTILES = ['50', '90', '99', '99.9', '99.99']
+
+# "PCIE (0000:3b:00.0) NSID 1 from core  2:  297893.12  1163.64  107.38  13.46  2318.52"
+RE_NAMESPACE = re.compile(r"^\s*PCIE \((\S+)\) NSID (\d+) from core\s+(\d+):\s+"
+                          r"([0-9.]+)\s+([0-9.]+)\s+([0-9.]+)\s+([0-9.]+)\s+([0-9.]+)")
+RE_TOTAL = re.compile(r"^\s*Total\s*:\s+([0-9.]+)\s+([0-9.]+)\s+([0-9.]+)\s+([0-9.]+)\s+([0-9.]+)")
+# "  99.90000% :  1234.567us"
+RE_PERCENTILE = re.compile(r"^\s*([0-9.]+)%\s*:\s*([0-9.]+)us")
+
 
 class SPDKTest(Test):
     def __init__(self):
         Test.__init__(self)
-        self.requirements = ['test-pmd']
-        self.subtests = []
-        self.server_ip = None
+        self.requirements = ['spdk']
+        self.benchmark = True
+        self.subtests = [self.test_setup, self.test_speed]
+        self.args = None
+        self.logdir = None
+        self.pci_address = None
+        self.perf = None
+        self.numa = hp.is_numa()
+        self.socket_mem = 1024  # MB of hugepages on the node of the controller
+        self.placement = None
+        self.duration = 10      # seconds per sweep point
+        self.queue_depths = [1, 4, 16, 32, 128]
+        self.workloads = [('randread', 4096), ('randwrite', 4096),
+                          ('read', 131072), ('write', 131072)]
+        self.results = []
+
+    def setup(self, args=None):
+        """
+        Initialization before test
+        :return:
+        """
+        self.args = args or argparse.Namespace()
+        self.logdir = getattr(self.args, 'logdir', None)
+        self.pci_address = getattr(self.args, 'device', None).get_name()
+        self.perf = self.find_perf()
+
+        self.placement = placement.plan(self.pci_address, 1, self.socket_mem)
+        if self.placement['numa']:
+            if not hp.reserve_node_pages(self.placement['node'], self.socket_mem):
+                print("Warning: unable to reserve %dMB of hugepages on node %d." %
+                      (self.socket_mem, self.placement['node']))
+        elif os.system("dpdk-hugepages.py --setup %dM" % self.socket_mem) != 0:
+            print("Unable to run dpdk-hugepage script. Please check your dpdk installation.")
+
+    def test(self):
+        """
+        test case
+        :return:
+        """
+        for subtest in self.subtests:
+            if not subtest():
+                return False
+        return True
+
+    def find_perf(self):
+        '''Path of the SPDK NVMe perf tool, from PATH or $SPDK_DIR'''
+        spdk_dir = os.environ.get('SPDK_DIR', '/usr/share/spdk')
+        for perf in PERF_COMMANDS:
+            path = shutil.which(perf) or os.path.join(spdk_dir, perf)
+            if os.access(path, os.X_OK):
+                return path
+        return None
+
+    def test_setup(self):
+        """
+        Check the perf tool, hugepages and cpu placement before running
+        :return:
+        """
+        if not self.perf:
+            print("[X] spdk_nvme_perf not found, install spdk or set SPDK_DIR.")
+            return False
+        print("[.] Using %s" % self.perf)
+
+        print("[.] %s is on numa node %d, using lcore %d of node %d." %
+              (self.pci_address, self.placement['device_node'],
+               self.placement['lcores'][0], self.placement['node']))
+        for warning in self.placement['warnings']:
+            print("Warning: %s" % warning)
+        if not self.placement['local']:
+            print("Warning: %s is not served from its own numa node, "
+                  "IOPS and latency will suffer." % self.pci_address)
+
+        if not hp.check_hugepage_allocate(self.numa, self.placement['node']):
+            print("[X] No hugepage allocated.")
+            return False
+        if not hp.get_mountpoints():
+            print("[X] No hugepage mounted.")
+            return False
+        print("[.] Hugepage successfully configured.")
+
+        if not CommandUI().prompt_confirm("Write workloads will destroy all data on %s, continue?"
+                                          % self.pci_address):
+            self.workloads = [workload for workload in self.workloads if 'write' not in workload[0]]
+        return True
 
     def test_speed(self):
-        pass
+        """
+        Sweep queue depth and block size with spdk_nvme_perf and save
+        IOPS, bandwidth, latency percentiles and cycles per IO as json
+        :return:
+        """
+        cpu_hz = self.get_cpu_hz(self.placement['lcores'][0])
+        print("Please wait while the SPDK perf sweep is running...")
+        print("%-10s %-8s %-5s %-12s %-10s %-10s %-10s %-10s %-10s" %
+              ("workload", "size", "qd", "IOPS", "MiB/s", "avg(us)", "p99(us)", "p99.99(us)",
+               "cycles/IO"))
+        self.results = []
+        for workload, io_size in self.workloads:
+            for queue_depth in self.queue_depths:
+                result = self.run_perf(workload, io_size, queue_depth)
+                if not result:
+                    return False
+                # spdk polls, the core is busy for the whole run
+                result['cycles_per_io'] = cpu_hz / result['iops'] if cpu_hz and result['iops'] else None
+                self.results.append(result)
+                print("%-10s %-8d %-5d %-12.1f %-10.2f %-10.2f %-10s %-10s %-10s" %
+                      (workload, io_size, queue_depth, result['iops'], result['mibps'],
+                       result['avg_us'], result['percentiles_us'].get('99', '-'),
+                       result['percentiles_us'].get('99.99', '-'),
+                       "%.0f" % result['cycles_per_io'] if result['cycles_per_io'] else '-'))
 
-    def test_latency(self):
-        pass
+        filename = "spdk-%s.json" % self.pci_address
+        if self.logdir:
+            filename = os.path.join(self.logdir, filename)
+        results = {'pci': self.pci_address,
+                   'placement': self.placement,
+                   'cpu_hz': cpu_hz,
+                   'duration': self.duration,
+                   'results': self.results}
+        if Document(filename, results).save():
+            instrument.output(filename)
+            print("[.] SPDK results saved to %s" % filename)
+        return True
 
-    def test_cpu_usage(self):
-        pass
+    def run_perf(self, workload, io_size, queue_depth):
+        """
+        Run one spdk_nvme_perf point on the controller under test
+        :param workload: randread, randwrite, read or write
+        :param io_size: bytes
+        :param queue_depth:
+        :return: dict, None on failure
+        """
+        try:
+            comm = Command("%s -q %d -o %d -w %s -t %d -c %#x -L "
+                           "-r 'trtype:PCIe traddr:%s'"
+                           % (self.perf, queue_depth, io_size, workload, self.duration,
+                              1 << self.placement['lcores'][0], self.pci_address))
+            lines = comm.get_str(regex=r"^\s*(PCIE \(|Total\s*:|[0-9.]+%\s*:).*",
+                                 single_line=False, return_list=True)
+        except CertCommandError as concrete_error:
+            print(concrete_error)
+            print("[X] spdk_nvme_perf fail.")
+            return None
 
+        result = self.parse_perf(lines or [])
+        if not result:
+            print("[X] No IOPS reported by spdk_nvme_perf.")
+            return None
+        result.update({'workload': workload, 'io_size': io_size, 'queue_depth': queue_depth})
+        return result
 
+    def parse_perf(self, lines):
+        """
+        Parse the summary of spdk_nvme_perf -L
+        :param lines:
+        :return: dict, None if there is no total
+        """
+        result = None
+        namespaces = []
+        percentiles = dict()
+        for line in lines:
+            match = RE_NAMESPACE.match(line)
+            if match:
+                namespaces.append({'nsid': int(match.group(2)),
+                                   'core': int(match.group(3)),
+                                   'iops': float(match.group(4)),
+                                   'mibps': float(match.group(5))})
+                continue
+            match = RE_TOTAL.match(line)
+            if match:
+                result = {'iops': float(match.group(1)),
+                          'mibps': float(match.group(2)),
+                          'avg_us': float(match.group(3)),
+                          'min_us': float(match.group(4)),
+                          'max_us': float(match.group(5))}
+                continue
+            match = RE_PERCENTILE.match(line)
+            if match:
+                percentile = '%g' % float(match.group(1))
+                if percentile in PERCENTILES and percentile not in percentiles:
+                    percentiles[percentile] = float(match.group(2))
+        if not result:
+            return None
+        result['namespaces'] = namespaces
+        result['percentiles_us'] = percentiles
+        return result
 
+    def get_cpu_hz(self, cpu):
+        '''Nominal frequency of a cpu, 0 when unknown'''
+        try:
+            with open('/sys/devices/system/cpu/cpu%d/cpufreq/cpuinfo_max_freq' % cpu) as freq_file:
+                return int(freq_file.read()) * 1000
+        except (IOError, OSError, ValueError):
+            pass
+        processor = None
+        try:
+            with open('/proc/cpuinfo') as cpuinfo:
+                for line in cpuinfo:
+                    key, _, value = line.partition(':')
+                    key = key.strip()
+                    if key == 'processor':
+                        processor = int(value)
+                    elif key == 'cpu MHz' and processor in (cpu, None):
+                        return int(float(value) * 1e6)
+        except (IOError, OSError, ValueError):
+            pass
+        return 0
@@ -21,50 +21,148 @@
 #include <unistd.h>
 #include <sys/mman.h>
 #include <fcntl.h>
+#include <time.h>
 
 #define LENGTH (1024UL*1024*1024)
 #define RANGE 128
 #define FLAGS (MAP_PRIVATE | MAP_ANONYMOUS | MAP_HUGETLB)
+#define RANDOM_ACCESSES (16UL*1024*1024)
+#define TOUCH_SIZE 4096
+#ifndef MAP_HUGE_SHIFT
+#define MAP_HUGE_SHIFT 26
+#endif
+
+unsigned long length = LENGTH;
+unsigned long page_kb = 0;
+int normal_pages = 0;
+volatile unsigned long sink;
+
+void usage(void)
+{
+	printf("Usage: hugetlb_test [-h] [-m size] [-p pagesize] [-n]\n");
+	printf("  -h: show this help\n");
+	printf("  -m: memory size,unit MB. default: 1024MB\n");
+	printf("  -p: huge page size,unit kB. default: the default huge page size\n");
+	printf("  -n: use normal pages, to compare with huge pages\n");
+}
+
+static double now(void)
+{
+	struct timespec ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+static void fault_test(char *addr)
+{
+	unsigned long i;
+	double start = now();
+
+	for (i = 0; i < length; i += TOUCH_SIZE)
+		*(addr + i) = 0;
+	printf("fault-in: %.1f ms\n", (now() - start) * 1e3);
+}
 
 static void write_test(char *addr)
 {
 	unsigned long i;
+	double start;
 	printf("Writing...\n");
-	for (i = 0; i < LENGTH; i++)
+	start = now();
+	for (i = 0; i < length; i++)
 		*(addr + i) = i % RANGE;
+	printf("write: %.1f MB/s\n", length / (now() - start) / 1e6);
 }
 
 static int read_test(char *addr)
 {
 	unsigned long i;
+	double start;
 	printf("Reading...\n");
-	for (i = 0; i < LENGTH; i++) {
+	start = now();
+	for (i = 0; i < length; i++) {
 		if (*(addr + i) != (i % RANGE)) {
 			printf("Mismatch at %lu\n", i);
 			return 1;
 		}
 	}
+	printf("read: %.1f MB/s\n", length / (now() - start) / 1e6);
 	return 0;
 }
 
+/* random word reads over the whole mapping, bound by TLB misses */
+static void random_test(char *addr)
+{
+	unsigned long i, x = 88172645463325252UL, sum = 0;
+	unsigned long words = length / sizeof(unsigned long);
+	double start = now();
+
+	for (i = 0; i < RANDOM_ACCESSES; i++) {
+		x ^= x << 13;
+		x ^= x >> 7;
+		x ^= x << 17;
+		sum += ((unsigned long *)addr)[x % words];
+	}
+	sink = sum;
+	printf("random: %.2f Maccess/s\n", RANDOM_ACCESSES / (now() - start) / 1e6);
+}
+
 int main(int argc, char **argv)
 {
 	void *addr;
 	int ret;
-	size_t length = LENGTH;
+	int ch = 0;
+	int flags = FLAGS;
+
+	while ((ch = getopt(argc, argv, "hm:p:n")) != -1) {
+		switch (ch) {
+			case 'h':
+				usage();
+				return 0;
+			case 'm':
+				length = strtoul(optarg, NULL, 0);
+				if (!length) {
+					fprintf(stderr, "bad memory size\n");
+					return 1;
+				}
+				length <<= 20;
+				break;
+			case 'p':
+				page_kb = strtoul(optarg, NULL, 0);
+				if (!page_kb || (page_kb & (page_kb - 1))) {
+					fprintf(stderr, "bad page size\n");
+					return 1;
+				}
+				break;
+			case 'n':
+				normal_pages = 1;
+				break;
+		}
+	}
+
+	if (normal_pages)
+		flags = MAP_PRIVATE | MAP_ANONYMOUS;
+	else if (page_kb)
+		flags |= __builtin_ctzl(page_kb * 1024) << MAP_HUGE_SHIFT;
 
-	printf("Mapping %lu Mbytes\n", (unsigned long)length >> 20);
-	addr = mmap(NULL, length, PROT_READ | PROT_WRITE, FLAGS, -1, 0);
+	printf("Mapping %lu Mbytes\n", length >> 20);
+	addr = mmap(NULL, length, PROT_READ | PROT_WRITE, flags, -1, 0);
 	if (addr == MAP_FAILED) {
 		perror("mmap");
 		exit(1);
 	}
+	/* keep transparent huge pages out of the normal page baseline */
+	if (normal_pages)
+		madvise(addr, length, MADV_NOHUGEPAGE);
 
+	fault_test(addr);
 	write_test(addr);
 	ret = read_test(addr);
+	random_test(addr);
 
-	printf("Unmapping %lu Mbytes\n", (unsigned long)length >> 20);
-	if (munmap(addr, LENGTH)) {
+	printf("Unmapping %lu Mbytes\n", length >> 20);
+	if (munmap(addr, length)) {
 		perror("munmap");
 		exit(1);
 	}
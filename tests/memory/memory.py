@@ -17,8 +17,16 @@
 import os
 import time
 import re
+import signal
+import shutil
+import tempfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from hwcompatible.test import Test
 from hwcompatible.command import Command, CertCommandError
+from hwcompatible.document import Document
+from hwcompatible import instrument
+import hwcompatible.hugepageutil as hp
 
 
 class MemoryTest(Test):
@@ -27,22 +35,34 @@ class MemoryTest(Test):
     """
     def __init__(self):
         Test.__init__(self)
-        self.requirements = ["libhugetlbfs-utils"]
+        self.requirements = ["numactl"]
+        self.benchmark = True
+        self.args = None
+        self.logdir = None
         self.free_memory = 0
         self.system_memory = 0
         self.swap_memory = 0
-        self.huge_pages = 1000
         self.hugepage_size = 0
         self.hugepage_total = 0
         self.hugepage_free = 0
         self.retry_list = list()
         self.test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.rw_fraction = 0.5    # part of the free memory of each node given to memtester
+        self.rw_max_memory = 1024*4  # MB per node, so that one loop fits the time budget
+        self.rw_time_budget = 900 # seconds for all memtester workers
+        self.perf_memory = 768    # MB of the bandwidth arrays of memperf_test
+        self.perf_latency_memory = 256
+        self.hotplug_batch_size = 8
+        self.hotplug_workers = 4
+        self.hotplug_retry_max = 64  # seconds, doubling from 1
 
     def setup(self, args=None):
         """
         Initialization before test
         :return:
         """
+        self.args = args or argparse.Namespace()
+        self.logdir = getattr(self.args, "logdir", None)
         self.get_memory()
 
     def test(self):
@@ -53,6 +73,9 @@ class MemoryTest(Test):
         if not self.memory_rw():
             return False
 
+        if not self.memory_perf():
+            return False
+
         if not self.eat_memory():
             return False
 
@@ -99,6 +122,42 @@ class MemoryTest(Test):
         proc_meminfo.close()
         self.free_memory = self.free_memory/1024
 
+    def get_numa_nodes(self):
+        """
+        Free memory of every numa node with memory
+        :return: dict of node -> free MB
+        """
+        nodes = dict()
+        node_dir = "/sys/devices/system/node/"
+        if not os.path.exists(node_dir):
+            return nodes
+        for node_name in os.listdir(node_dir):
+            if not re.match("^node[0-9]+$", node_name):
+                continue
+            try:
+                with open(os.path.join(node_dir, node_name, "meminfo")) as meminfo:
+                    for line in meminfo:
+                        # Node 0 MemFree:        12345678 kB
+                        tokens = line.split()
+                        if len(tokens) == 5 and tokens[2] == "MemFree:":
+                            if int(tokens[3]):
+                                nodes[int(node_name[4:])] = int(tokens[3])/1024
+                            break
+            except (IOError, OSError, ValueError):
+                continue
+        return nodes
+
+    def has_numactl(self):
+        """
+        Whether processes can be bound to numa nodes with numactl
+        :return:
+        """
+        try:
+            Command("numactl --hardware").run_quiet()
+            return True
+        except CertCommandError:
+            return False
+
     def memory_rw(self):
         """
         Test memory request
@@ -108,6 +167,10 @@ class MemoryTest(Test):
             print("Error: get system memory fail.")
             return False
 
+        nodes = self.get_numa_nodes() if self.has_numactl() else dict()
+        if nodes:
+            return self.memory_rw_numa(nodes)
+
         test_mem = self.free_memory*90/100
         if test_mem > 1024*4:
             test_mem = 1024*4
@@ -117,6 +180,188 @@ class MemoryTest(Test):
 
         return True
 
+    def memory_rw_numa(self, nodes):
+        """
+        Run one memtester per numa node, bound to the memory and cpus of
+        that node, on a fraction of its free memory and within a time budget.
+        A node fails when memtester reports a failure or does not complete
+        its pass in time
+        :param nodes: dict of node -> free MB
+        :return:
+        """
+        print("Running memtester on %d numa nodes, %d%% of free memory up to %dMB, "
+              "%ds budget..." % (len(nodes), self.rw_fraction * 100, self.rw_max_memory,
+                                 self.rw_time_budget))
+        log_dir = self.logdir or tempfile.mkdtemp()
+        workers = dict()
+        for node, free_mem in sorted(nodes.items()):
+            test_mem = min(int(free_mem * self.rw_fraction), self.rw_max_memory)
+            if test_mem <= 0:
+                continue
+            log_file = os.path.join(log_dir, "memtester-node%d.log" % node)
+            # exec so that the pid is memtester's, not the shell's
+            comm = Command("exec numactl --membind=%d --cpunodebind=%d memtester %dM 1 > %s 2>&1"
+                           % (node, node, test_mem, log_file))
+            comm.start()
+            workers[node] = {"command": comm, "size_mb": test_mem, "log": log_file,
+                             "start": time.time(), "end": None}
+
+        deadline = time.time() + self.rw_time_budget
+        while time.time() < deadline:
+            running = [worker for worker in workers.values() if worker["end"] is None]
+            for worker in running:
+                if worker["command"].poll() is not None:
+                    worker["end"] = time.time()
+            if len(running) == 0:
+                break
+            time.sleep(1)
+
+        return_code = True
+        results = dict()
+        print("%-6s %-12s %-10s %-12s %s" % ("node", "tested(MB)", "time(s)", "MB/s", "result"))
+        for node, worker in sorted(workers.items()):
+            comm = worker["command"]
+            failures = self.get_memtester_failures(worker["log"])
+            if worker["end"] is None:
+                os.kill(comm.pid(), signal.SIGTERM)
+                comm.pipe.wait()
+                worker["end"] = time.time()
+                status = "fail" if failures else "timeout"
+                return_code = False
+            elif comm.pipe.returncode == 0 and not failures:
+                status = "pass"
+            else:
+                status = "fail"
+                return_code = False
+            elapsed = worker["end"] - worker["start"]
+            coverage = worker["size_mb"] / elapsed if status == "pass" and elapsed else 0
+            print("%-6d %-12d %-10.1f %-12.1f %s" %
+                  (node, worker["size_mb"], elapsed, coverage, status))
+            results[node] = {"size_mb": worker["size_mb"], "time": elapsed,
+                             "mbps": coverage, "result": status}
+            if status == "timeout":
+                print("Error: memtester on node %d did not complete a pass within %ds." %
+                      (node, self.rw_time_budget))
+            elif status == "fail":
+                print("Error: memtester fail on node %d." % node)
+                for line in failures[:10]:
+                    print("    %s" % line)
+
+        if not self.logdir:
+            shutil.rmtree(log_dir, ignore_errors=True)
+        if self.logdir:
+            filename = os.path.join(self.logdir, "memtester.json")
+            if Document(filename, results).save():
+                instrument.output(filename)
+        return return_code
+
+    def get_memtester_failures(self, log_file):
+        """
+        Failures memtester reported in its log, also while it still runs
+        :param log_file:
+        :return: list of lines
+        """
+        try:
+            with open(log_file, "r", errors="replace") as memtester_log:
+                return [line.strip() for line in memtester_log if "FAILURE" in line]
+        except (IOError, OSError):
+            return list()
+
+    def get_node_cpus(self, node):
+        """
+        Number of cpus of a numa node
+        :param node:
+        :return:
+        """
+        try:
+            with open("/sys/devices/system/node/node%d/cpulist" % node) as cpulist_file:
+                cpulist = cpulist_file.read().strip()
+        except (IOError, OSError):
+            return 0
+        count = 0
+        for item in cpulist.split(","):
+            if "-" in item:
+                first, last = item.split("-", 1)
+                count += int(last) - int(first) + 1
+            elif item:
+                count += 1
+        return count
+
+    def run_memperf(self, cpu_node, mem_node, threads, test_mem, latency_mem):
+        """
+        Run memperf_test with its cpus on cpu_node and its memory on mem_node
+        :return: dict of copy/scale/add/triad MB/s and latency ns, None on failure
+        """
+        numa = ""
+        if cpu_node is not None:
+            numa = "numactl --cpunodebind=%d --membind=%d " % (cpu_node, mem_node)
+        try:
+            lines = Command("cd %s; %s./memperf_test -m %d -l %d -t %d" %
+                            (self.test_dir, numa, test_mem, latency_mem, threads)).get_str(
+                                regex=r"^(copy|scale|add|triad|latency): [0-9.]+",
+                                single_line=False, return_list=True)
+        except CertCommandError as concrete_error:
+            print(concrete_error)
+            return None
+        result = dict()
+        for line in lines:
+            name, value = line.split(": ")
+            result[name + "_ns" if name == "latency" else name + "_mbps"] = float(value)
+        return result
+
+    def memory_perf(self):
+        """
+        Memory bandwidth and latency between every pair of numa nodes
+        :return:
+        """
+        print("\nMemory performance testing...")
+        self.get_memory()
+        test_mem = min(self.perf_memory, self.free_memory/4)
+        latency_mem = min(self.perf_latency_memory, self.free_memory/8)
+        if test_mem < 48 or latency_mem < 16:
+            print("Error: free memory of %u MB is too small." % self.free_memory)
+            return False
+
+        nodes = sorted(self.get_numa_nodes()) if self.has_numactl() else list()
+
+        matrix = dict()
+        if not nodes:
+            result = self.run_memperf(None, None, os.sysconf("SC_NPROCESSORS_ONLN"),
+                                      test_mem, latency_mem)
+            if not result:
+                print("Error: memperf_test fail.")
+                return False
+            matrix["0"] = {"0": result}
+            nodes = [0]
+        else:
+            for cpu_node in nodes:
+                threads = self.get_node_cpus(cpu_node)
+                if not threads:
+                    continue
+                matrix[str(cpu_node)] = dict()
+                for mem_node in nodes:
+                    result = self.run_memperf(cpu_node, mem_node, threads, test_mem, latency_mem)
+                    if not result:
+                        print("Error: memperf_test fail from node %d to node %d." %
+                              (cpu_node, mem_node))
+                        return False
+                    matrix[str(cpu_node)][str(mem_node)] = result
+
+        for title, key, unit in [("Triad bandwidth", "triad_mbps", "MB/s"),
+                                 ("Latency", "latency_ns", "ns")]:
+            print("%s (%s), cpu node by row, memory node by column:" % (title, unit))
+            print("      " + "".join("%-12s" % ("node%d" % node) for node in nodes))
+            for cpu_node in sorted(matrix, key=int):
+                print("%-6s" % ("node" + cpu_node) + "".join(
+                    "%-12.1f" % matrix[cpu_node][str(node)].get(key, 0) for node in nodes))
+
+        if self.logdir:
+            filename = os.path.join(self.logdir, "memory-perf.json")
+            if Document(filename, {"memory_mb": test_mem, "latency_memory_mb": latency_mem,
+                                   "matrix": matrix}).save():
+                instrument.output(filename)
+        return True
+
     def eat_memory(self):
         """
         Eat memory test
@@ -145,6 +390,29 @@ class MemoryTest(Test):
 
         return True
 
+    def run_hugetlb(self, node, options):
+        """
+        Run hugetlb_test, bound to a numa node when node is not None
+        :param node:
+        :param options:
+        :return: dict of fault-in ms, write/read MB/s and random Maccess/s, None on failure
+        """
+        numa = ""
+        if node is not None:
+            numa = "numactl --cpunodebind=%d --membind=%d " % (node, node)
+        try:
+            lines = Command("cd %s; %s./hugetlb_test %s" % (self.test_dir, numa, options)).get_str(
+                regex=r"^(fault-in|write|read|random): [0-9.]+",
+                single_line=False, return_list=True)
+        except CertCommandError as concrete_error:
+            print(concrete_error)
+            return None
+        result = dict()
+        for line in lines:
+            name, value = line.split(": ")
+            result[name] = float(value)
+        return result
+
     def hugetlb_test(self):
         """
         hugetlb test
@@ -152,41 +420,67 @@ class MemoryTest(Test):
         """
         print("\nHugetlb testing...")
         self.get_memory()
-        print("HugePages Total: %u" % self.hugepage_total)
-        print("HugePages Free: %u" % self.hugepage_free)
-        print("HugePages Size: %uMB" % self.hugepage_size)
-        update_hugepage = 1
-        if self.hugepage_size >= 512:
-            self.huge_pages = 10
-        if not self.hugepage_total:
-            os.system("hugeadm --create-mounts")
-            os.system("hugeadm --pool-pages-min %dMB:%d" %
-                      (self.hugepage_size, self.huge_pages))
-        elif self.hugepage_free < self.huge_pages:
-            os.system("hugeadm --pool-pages-min %dMB:%d" %
-                      (self.hugepage_size, self.hugepage_total + self.huge_pages))
-        else:
-            update_hugepage = 0
-
-        self.get_memory()
-        if update_hugepage == 1:
-            print("Updated hugepages:")
-            print("HugePages Total: %u" % self.hugepage_total)
-            print("HugePages Free: %u" % self.hugepage_free)
-            print("HugePages Size: %uMB" % self.hugepage_size)
-
-        if self.hugepage_free < self.huge_pages/2:
-            print("Error: hugepages reserve fail.")
+        default_kb = hp.get_default_pagesize()
+        # leave 16G pages and larger out, one of them is more than the test needs
+        sizes = [kb for kb in hp.get_pagesizes() if kb <= 1024*1024]
+        if not default_kb or default_kb not in sizes:
+            print("Error: no huge page size supported.")
             return False
+        test_mem = int(min(1024, self.free_memory/4))
+        nodes = hp.get_numa_nodes()
+        bind = self.has_numactl() and hp.is_numa()
+        print("HugePages Size: %s" % ", ".join(hp.fmt_memsize(kb) for kb in sizes))
+        print("Numa nodes: %s" % ", ".join(str(node) for node in nodes))
 
-        try:
-            Command("cd %s; ./hugetlb_test" % self.test_dir).echo()
+        return_code = True
+        results = dict()
+        print("%-6s %-8s %-12s %-14s %-12s %-12s %-14s" % ("node", "size", "reserve(s)",
+              "fault-in(ms)", "write(MB/s)", "read(MB/s)", "random(Macc/s)"))
+        for node in nodes:
+            if hp.is_numa() and not os.path.exists("/sys/devices/system/node/node%d/hugepages"
+                                                   % node):
+                continue
+            results[node] = dict()
+            baseline = self.run_hugetlb(node if bind else None, "-n -m %d" % test_mem)
+            if baseline:
+                results[node]["normal"] = baseline
+                print("%-6d %-8s %-12s %-14.1f %-12.1f %-12.1f %-14.2f" %
+                      (node, "normal", "-", baseline["fault-in"], baseline["write"],
+                       baseline["read"], baseline["random"]))
+            for kb in sizes:
+                count = max(1, test_mem * 1024 // kb)
+                nr_pages = hp.get_node_pages(node, kb)[0]
+                reserved, seconds = hp.reserve_pages(node, kb, count)
+                result = None
+                if reserved:
+                    result = self.run_hugetlb(node if bind else None,
+                                              "-p %d -m %d" % (kb, count * kb // 1024))
+                # give the memory back to the system
+                hp.set_node_pages(node, kb, nr_pages)
+                if not result:
+                    if kb == default_kb:
+                        print("Error: %s hugepages %s fail on node %d." %
+                              (hp.fmt_memsize(kb), "test" if reserved else "reserve", node))
+                        return_code = False
+                    else:
+                        print("Warning: %s hugepages %s fail on node %d." %
+                              (hp.fmt_memsize(kb), "test" if reserved else "reserve", node))
+                    continue
+                result["reserve"] = seconds
+                results[node][hp.fmt_memsize(kb)] = result
+                print("%-6d %-8s %-12.3f %-14.1f %-12.1f %-12.1f %-14.2f" %
+                      (node, hp.fmt_memsize(kb), seconds, result["fault-in"], result["write"],
+                       result["read"], result["random"]))
+
+        if self.logdir:
+            filename = os.path.join(self.logdir, "hugetlb.json")
+            if Document(filename, results).save():
+                instrument.output(filename)
+        if return_code:
             print("Hugetlb test succ.\n")
-        except CertCommandError as concrete_error:
-            print(concrete_error)
+        else:
             print("Error: hugepages test fail.\n")
-            return False
-        return True
+        return return_code
 
     def hot_plug_verify(self):
         """
@@ -203,63 +497,111 @@ class MemoryTest(Test):
             return False
         return True
 
-    def hotplug_memory_test(self, memory_path):
+    def get_mem_total(self):
         """
-        Hotplug memory test
-        :param memory_path:
+        MemTotal of /proc/meminfo in kB, without parsing the rest of the file
         :return:
         """
-        print("Keep %s online before test." % memory_path)
-        if not self.online_memory(memory_path):
-            return False
-
-        print("Try to offline...")
-        self.get_memory()
-        total_mem_1 = self.system_memory
-        if not self.offline_memory(memory_path):
-            return False
+        with open("/proc/meminfo", "r") as proc_meminfo:
+            for line in proc_meminfo:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1])
+        return 0
 
-        self.get_memory()
-        total_mem_2 = self.system_memory
-        if total_mem_2 >= total_mem_1:
-            return False
-
-        print("Try to online...")
-        if not self.online_memory(memory_path):
-            self.retry_list.append(memory_path)
-            return False
-        self.get_memory()
-        total_mem_3 = self.system_memory
-        if total_mem_3 != total_mem_1:
-            return False
-
-    def online_memory(self, memory_path):
+    def get_memory_blocks(self):
         """
-        Set memory online
-        :param memory_path:
-        :return:
+        Removable memory blocks, in one pass over /sys/devices/system/memory
+        :return: list of block paths
         """
-        try:
-            Command("echo 1 > %s/online" % memory_path).run()
-            Command("cat %s/state" % memory_path).get_str("online")
-            return True
-        except Exception:
-            print("Error: fail to online %s." % memory_path)
-            return False
+        blocks = list()
+        memory_dir = "/sys/devices/system/memory"
+        pattern = re.compile("^memory[0-9]+$")
+        for mem_dirname in sorted(filter(pattern.search, os.listdir(memory_dir)),
+                                  key=lambda name: int(name[6:])):
+            memory_path = os.path.join(memory_dir, mem_dirname)
+            try:
+                with open(os.path.join(memory_path, "removable")) as removable:
+                    if removable.read().strip() == "1":
+                        blocks.append(memory_path)
+            except (IOError, OSError):
+                continue
+        return blocks
 
-    def offline_memory(self, memory_path):
+    def set_memory_state(self, memory_path, online):
         """
-        Set memory offline
+        Online or offline a memory block through sysfs
         :param memory_path:
-        :return:
+        :param online:
+        :return: seconds taken, None on failure
         """
+        state = "online" if online else "offline"
+        start = time.time()
         try:
-            Command("echo 0 > %s/online" % memory_path).run()
-            Command("cat %s/state" % memory_path).get_str("offline")
-            return True
-        except Exception:
-            print("Error: fail to online %s." % memory_path)
-            return False
+            with open(os.path.join(memory_path, "online"), "w") as online_file:
+                online_file.write("1" if online else "0")
+            with open(os.path.join(memory_path, "state")) as state_file:
+                if state_file.read().strip() != state:
+                    raise IOError("state is not %s" % state)
+        except (IOError, OSError) as concrete_error:
+            print("Error: fail to %s %s: %s" % (state, os.path.basename(memory_path),
+                                                concrete_error))
+            return None
+        return time.time() - start
+
+    def hotplug_batch(self, blocks, pool, results):
+        """
+        Offline then online a batch of memory blocks from the worker pool,
+        checking MemTotal once per step
+        :param blocks:
+        :param pool:
+        :param results: per block latencies, updated
+        :return: blocks that could not be put back online
+        """
+        # keep them online before test
+        for memory_path, latency in zip(blocks, pool.map(
+                lambda path: self.set_memory_state(path, True), blocks)):
+            if latency is None:
+                results[os.path.basename(memory_path)] = {"result": "fail"}
+        blocks = [path for path in blocks if os.path.basename(path) not in results]
+
+        total_mem_1 = self.get_mem_total()
+        offlined = list()
+        for memory_path, latency in zip(blocks, pool.map(
+                lambda path: self.set_memory_state(path, False), blocks)):
+            name = os.path.basename(memory_path)
+            if latency is None:
+                results[name] = {"result": "fail"}
+            else:
+                results[name] = {"offline": latency}
+                offlined.append(memory_path)
+        if not offlined:
+            return list()
+
+        total_mem_2 = self.get_mem_total()
+        if total_mem_2 >= total_mem_1:
+            print("Error: MemTotal did not decrease after offlining %s." %
+                  ", ".join(os.path.basename(path) for path in offlined))
+            for memory_path in offlined:
+                results[os.path.basename(memory_path)]["result"] = "fail"
+
+        retry_list = list()
+        for memory_path, latency in zip(offlined, pool.map(
+                lambda path: self.set_memory_state(path, True), offlined)):
+            result = results[os.path.basename(memory_path)]
+            if latency is None:
+                result["result"] = "fail"
+                retry_list.append(memory_path)
+            else:
+                result["online"] = latency
+                result.setdefault("result", "pass")
+
+        total_mem_3 = self.get_mem_total()
+        if not retry_list and total_mem_3 != total_mem_1:
+            print("Error: MemTotal is %d kB after onlining, %d kB before." %
+                  (total_mem_3, total_mem_1))
+            for memory_path in offlined:
+                results[os.path.basename(memory_path)]["result"] = "fail"
+        return retry_list
 
     def memory_hotplug(self):
         """
@@ -272,43 +614,50 @@ class MemoryTest(Test):
             return True
 
         print("Searching removable memory...")
-        if not os.path.exists("/sys/devices/system/node/"):
-            return False
-
-        return_code = True
-        mem_path_list = list()
-        pattern = re.compile("^memory[0-9]*$")
-        for (dirpath, dirs, filenames) in os.walk("/sys/devices/system/node/"):
-            mem_dirs = filter(pattern.search, dirs)
-            for mem_dirname in mem_dirs:
-                mem_path_list.append(os.path.join(dirpath, mem_dirname))
-
-        if not mem_path_list:
+        if not os.path.exists("/sys/devices/system/memory/"):
             print("Error: no memory found.")
             return False
 
-        test_flag = 0
-        for memory_path in mem_path_list:
-            try:
-                Command("cat %s/removable" % memory_path).get_str("1")
-                print("%s is removable, start testing..." % os.path.basename(memory_path))
-                test_flag = 1
-            except:
-                continue
-            if not self.hotplug_memory_test(memory_path):
-                print("%s hotplug test fail." % os.path.basename(memory_path))
-                return_code = False
-
-        if test_flag == 0:
+        blocks = self.get_memory_blocks()
+        if not blocks:
             print("No removable memory found.")
+            return True
+        print("%d removable memory blocks, testing %d at a time..." %
+              (len(blocks), self.hotplug_batch_size))
 
+        results = dict()
+        self.retry_list = list()
+        with ThreadPoolExecutor(max_workers=self.hotplug_workers) as pool:
+            for index in range(0, len(blocks), self.hotplug_batch_size):
+                self.retry_list.extend(self.hotplug_batch(
+                    blocks[index:index + self.hotplug_batch_size], pool, results))
+
+        # memory still in use when offlined may take a while to come back
+        delay = 1
+        while self.retry_list and delay <= self.hotplug_retry_max:
+            print("Retry to online %d memory blocks after %ds." % (len(self.retry_list), delay))
+            time.sleep(delay)
+            self.retry_list = [path for path in self.retry_list
+                               if self.set_memory_state(path, True) is None]
+            delay *= 2
+
+        failed = sorted((name for name, result in results.items() if result["result"] != "pass"),
+                        key=lambda name: int(name[6:]))
+        for step in ["offline", "online"]:
+            latencies = [result[step] for result in results.values() if step in result]
+            if latencies:
+                print("%s latency: min %.3fs, avg %.3fs, max %.3fs" %
+                      (step, min(latencies), sum(latencies) / len(latencies), max(latencies)))
+        if failed:
+            print("%s hotplug test fail." % ", ".join(failed))
         if self.retry_list:
-            print("Retry to online memory after 2mins.")
-            time.sleep(120)
-            for memory_path in self.retry_list:
-                self.online_memory(memory_path)
-
-        return return_code
+            print("Error: %s still offline." %
+                  ", ".join(os.path.basename(path) for path in self.retry_list))
+        if self.logdir:
+            filename = os.path.join(self.logdir, "memory-hotplug.json")
+            if Document(filename, results).save():
+                instrument.output(filename)
+        return not failed
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+/*
+ * Copyright (c) 2020 Huawei Technologies Co., Ltd.
+ *
+ * This program is free software; you can redistribute it and/or
+ * modify it under the terms of version 2 of the GNU General Public
+ * License as published by the Free Software Foundation.
+ *
+ * This program is distributed in the hope that it will be useful, but
+ * WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+ * General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+ * 02110-1301, USA
+ */
+
+#include <stdlib.h>
+#include <stdio.h>
+#include <unistd.h>
+#include <time.h>
+#include <pthread.h>
+
+#define NTIMES 5
+#define CACHE_LINE 64
+#define CHASE_STEPS (16UL * 1024 * 1024)
+#define SCALAR 3.0
+
+enum kernel { INIT, COPY, SCALE, ADD, TRIAD, NR_KERNELS };
+
+static const char *kernel_names[NR_KERNELS] = {"init", "copy", "scale", "add", "triad"};
+/* arrays read and written by each kernel */
+static const int kernel_arrays[NR_KERNELS] = {3, 2, 2, 3, 3};
+
+unsigned long num_threads = 1;
+unsigned long memsize = 768UL * 1024 * 1024;
+unsigned long chase_size = 256UL * 1024 * 1024;
+double *a, *b, *c;
+unsigned long array_len;
+void * volatile chase_sink;
+
+struct stream_arg {
+	enum kernel kernel;
+	unsigned long begin;
+	unsigned long end;
+};
+
+void usage(void)
+{
+	printf("Usage: memperf_test [-h] [-m size] [-l size] [-t threads]\n");
+	printf("  -h: show this help\n");
+	printf("  -m: memory of the three bandwidth arrays,unit MB. default: 768MB\n");
+	printf("  -l: memory of the latency chain,unit MB. default: 256MB\n");
+	printf("  -t: bandwidth threads. default: 1\n");
+}
+
+static double now(void)
+{
+	struct timespec ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+void *stream_worker(void *data)
+{
+	struct stream_arg *arg = data;
+	unsigned long j;
+
+	switch (arg->kernel) {
+	case INIT:
+		for (j = arg->begin; j < arg->end; j++) {
+			a[j] = 1.0;
+			b[j] = 2.0;
+			c[j] = 0.0;
+		}
+		break;
+	case COPY:
+		for (j = arg->begin; j < arg->end; j++)
+			c[j] = a[j];
+		break;
+	case SCALE:
+		for (j = arg->begin; j < arg->end; j++)
+			b[j] = SCALAR * c[j];
+		break;
+	case ADD:
+		for (j = arg->begin; j < arg->end; j++)
+			c[j] = a[j] + b[j];
+		break;
+	case TRIAD:
+		for (j = arg->begin; j < arg->end; j++)
+			a[j] = b[j] + SCALAR * c[j];
+		break;
+	default:
+		break;
+	}
+	return NULL;
+}
+
+/* run a kernel on all threads, return the elapsed seconds */
+static double run_kernel(enum kernel kernel, pthread_t *threads, struct stream_arg *args)
+{
+	unsigned long i, chunk = array_len / num_threads;
+	double start;
+
+	start = now();
+	for (i = 0; i < num_threads; i++) {
+		args[i].kernel = kernel;
+		args[i].begin = i * chunk;
+		args[i].end = (i == num_threads - 1) ? array_len : (i + 1) * chunk;
+		if (pthread_create(&threads[i], NULL, stream_worker, &args[i]) != 0) {
+			fprintf(stderr, "thread %lu create fail\n", i);
+			exit(1);
+		}
+	}
+	for (i = 0; i < num_threads; i++)
+		pthread_join(threads[i], NULL);
+	return now() - start;
+}
+
+static int stream_test(void)
+{
+	pthread_t *threads;
+	struct stream_arg *args;
+	double best[NR_KERNELS], elapsed;
+	int k, n;
+
+	array_len = memsize / 3 / sizeof(double);
+	a = malloc(array_len * sizeof(double));
+	b = malloc(array_len * sizeof(double));
+	c = malloc(array_len * sizeof(double));
+	threads = malloc(num_threads * sizeof(pthread_t));
+	args = malloc(num_threads * sizeof(struct stream_arg));
+	if (!a || !b || !c || !threads || !args) {
+		fprintf(stderr, "malloc fail\n");
+		return 1;
+	}
+
+	/* each thread first touches the part of the arrays it works on */
+	run_kernel(INIT, threads, args);
+	for (k = COPY; k < NR_KERNELS; k++)
+		best[k] = 0;
+	/* the first pass warms up, keep the best of the others */
+	for (n = 0; n < NTIMES; n++) {
+		for (k = COPY; k < NR_KERNELS; k++) {
+			elapsed = run_kernel(k, threads, args);
+			if (n && (!best[k] || elapsed < best[k]))
+				best[k] = elapsed;
+		}
+	}
+	for (k = COPY; k < NR_KERNELS; k++)
+		printf("%s: %.1f MB/s\n", kernel_names[k],
+		       kernel_arrays[k] * array_len * sizeof(double) / best[k] / 1e6);
+
+	free(args);
+	free(threads);
+	free(c);
+	free(b);
+	free(a);
+	return 0;
+}
+
+static int latency_test(void)
+{
+	unsigned long nr_lines = chase_size / CACHE_LINE, i, j, tmp;
+	unsigned long *order;
+	char *buf;
+	void **p;
+	double start, elapsed;
+
+	if (posix_memalign((void **)&buf, 4096, nr_lines * CACHE_LINE)) {
+		fprintf(stderr, "malloc fail\n");
+		return 1;
+	}
+	order = malloc(nr_lines * sizeof(unsigned long));
+	if (!order) {
+		fprintf(stderr, "malloc fail\n");
+		return 1;
+	}
+
+	/* Sattolo's shuffle gives a single cycle through all cache lines */
+	for (i = 0; i < nr_lines; i++)
+		order[i] = i;
+	srandom(time(NULL));
+	for (i = nr_lines - 1; i > 0; i--) {
+		j = random() % i;
+		tmp = order[i];
+		order[i] = order[j];
+		order[j] = tmp;
+	}
+	for (i = 0; i < nr_lines; i++)
+		*(void **)(buf + i * CACHE_LINE) = buf + order[i] * CACHE_LINE;
+	free(order);
+
+	p = (void **)buf;
+	for (i = 0; i < nr_lines; i++)
+		p = *p;
+	start = now();
+	for (i = 0; i < CHASE_STEPS; i++)
+		p = *p;
+	elapsed = now() - start;
+	chase_sink = p;
+
+	printf("latency: %.1f ns\n", elapsed * 1e9 / CHASE_STEPS);
+	free(buf);
+	return 0;
+}
+
+int main(int argc, char **argv)
+{
+	int ch = 0;
+	while ((ch = getopt(argc, argv, "hm:l:t:")) != -1) {
+		switch (ch) {
+			case 'h':
+				usage();
+				return 0;
+			case 'm':
+				memsize = strtoul(optarg, NULL, 0);
+				if (!memsize) {
+					fprintf(stderr, "bad memory size\n");
+					return 1;
+				}
+				memsize <<= 20;
+				break;
+			case 'l':
+				chase_size = strtoul(optarg, NULL, 0);
+				if (!chase_size) {
+					fprintf(stderr, "bad latency memory size\n");
+					return 1;
+				}
+				chase_size <<= 20;
+				break;
+			case 't':
+				num_threads = strtoul(optarg, NULL, 0);
+				if (!num_threads) {
+					fprintf(stderr, "bad thread number\n");
+					return 1;
+				}
+				break;
+		}
+	}
+	printf("Memory size: %luMB\tLatency size: %luMB\tThreads: %lu\n",
+	       memsize >> 20, chase_size >> 20, num_threads);
+
+	if (stream_test())
+		return 1;
+	if (latency_test())
+		return 1;
+	return 0;
+}
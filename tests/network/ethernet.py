@@ -14,11 +14,11 @@
 
 """ethernet test"""
 
-import os
 import argparse
 
 from hwcompatible.env import CertEnv
 from hwcompatible.document import CertDocument
+from hwcompatible.rdmautil import get_rdma_port
 from rdma import RDMATest
 
 
@@ -41,11 +41,7 @@ class EthernetTest(RDMATest):
         Judge whether ethernet is roce
         :return:
         """
-        path_netdev = ''.join(['/sys', self.device.get_property("DEVPATH")])
-        path_pci = path_netdev.split('net')[0]
-        cmd = "ls %s | grep -q infiniband" % path_pci
-        print(cmd)
-        return os.system(cmd) == 0
+        return get_rdma_port(self.interface) is not None
 
     def setup(self, args=None):
         """
@@ -56,6 +52,7 @@ class EthernetTest(RDMATest):
         self.args = args or argparse.Namespace()
         self.device = getattr(self.args, 'device', None)
         self.interface = self.device.get_property("INTERFACE")
+        self.logdir = getattr(self.args, 'logdir', None)
         self.cert = CertDocument(CertEnv.certificationfile)
         self.server_ip = self.cert.get_server()
 
@@ -73,6 +70,8 @@ class EthernetTest(RDMATest):
             self.link_layer = 'Ethernet'
             self.subtests = [self.test_ip_info, self.test_ibstatus,
                              self.test_eth_link, self.test_icmp, self.test_rdma]
+            self.choose_perftest()
+            self.choose_multiport()
 
     def test(self):
         """
@@ -28,8 +28,9 @@ except ImportError:
 
 from hwcompatible.test import Test
 from hwcompatible.command import Command
-from hwcompatible.document import CertDocument
+from hwcompatible.document import CertDocument, Document
 from hwcompatible.env import CertEnv
+from hwcompatible import instrument
 
 
 class NetworkTest(Test):
@@ -42,6 +43,7 @@ class NetworkTest(Test):
         self.cert = None
         self.device = None
         self.requirements = ['ethtool', 'iproute', 'psmisc', 'qperf']
+        self.benchmark = True
         self.subtests = [self.test_ip_info, self.test_eth_link, self.test_icmp,
                          self.test_udp_tcp, self.test_http]
         self.interface = None
@@ -51,6 +53,8 @@ class NetworkTest(Test):
         self.speed = 1000   # Mb/s
         self.target_bandwidth_percent = 0.8
         self.testfile = 'testfile'
+        self.logdir = None
+        self.qperf_results = {}
 
     def ifdown(self, interface):
         """
@@ -199,28 +203,40 @@ class NetworkTest(Test):
         print("Status: %u %s" % (response.code, response.msg))
         return int(response.code) == 200
 
-    def test_udp_latency(self):
+    def get_latency(self, test):
         """
-        Test udp latency
+        Run a qperf latency test and keep its result
+        :param test: udp_lat or tcp_lat
         :return:
         """
-        cmd = "qperf %s udp_lat" % self.server_ip
+        cmd = "qperf %s %s" % (self.server_ip, test)
         print(cmd)
+        com = Command(cmd)
+        pattern = r"\s+latency\s+=\s+(?P<latency>[\.0-9]+ (ns|us|ms|sec))"
+        scales = {'ns': 0.001, 'us': 1, 'ms': 1000, 'sec': 1000000}
         for _ in range(self.retries):
-            if os.system(cmd) == 0:
+            try:
+                latency = com.get_str(pattern, 'latency', False)
+                com.print_output()
+                value, unit = latency.split()
+                self.qperf_results[test] = {'latency_us': float(value) * scales[unit]}
                 return True
+            except Exception as concrete_error:
+                print(concrete_error)
         return False
 
+    def test_udp_latency(self):
+        """
+        Test udp latency
+        :return:
+        """
+        return self.get_latency('udp_lat')
+
     def test_tcp_latency(self):
         """
         tcp test
         """
-        cmd = "qperf %s tcp_lat" % self.server_ip
-        print(cmd)
-        for _ in range(self.retries):
-            if os.system(cmd) == 0:
-                return True
-        return False
+        return self.get_latency('tcp_lat')
 
     def test_tcp_bandwidth(self):
         """
@@ -243,6 +259,8 @@ class NetworkTest(Test):
                 target_bandwidth = self.target_bandwidth_percent * self.speed
                 print("Current bandwidth is %.2fMb/s, target is %.2fMb/s" %
                       (bandwidth, target_bandwidth))
+                self.qperf_results['tcp_bw'] = {'bandwidth_mbps': bandwidth,
+                                                'target_bandwidth_mbps': target_bandwidth}
                 if bandwidth > target_bandwidth:
                     return True
             except Exception as concrete_error:
@@ -341,24 +359,39 @@ class NetworkTest(Test):
             print("[X] start qperf server failed.")
             return False
 
-        print("[+] Testing udp latency...")
-        if not self.test_udp_latency():
-            print("[X] Test udp latency failed.")
-            return False
+        self.qperf_results = {}
+        try:
+            print("[+] Testing udp latency...")
+            if not self.test_udp_latency():
+                print("[X] Test udp latency failed.")
+                return False
 
-        print("[+] Testing tcp latency...")
-        if not self.test_tcp_latency():
-            print("[X] Test tcp latency failed.")
-            return False
+            print("[+] Testing tcp latency...")
+            if not self.test_tcp_latency():
+                print("[X] Test tcp latency failed.")
+                return False
 
-        print("[+] Testing tcp bandwidth...")
-        if not self.test_tcp_bandwidth():
-            print("[X] Test tcp bandwidth failed.")
-            return False
+            print("[+] Testing tcp bandwidth...")
+            if not self.test_tcp_bandwidth():
+                print("[X] Test tcp bandwidth failed.")
+                return False
+        finally:
+            self.save_qperf_results()
 
         self.call_remote_server('qperf', 'stop')
         return True
 
+    def save_qperf_results(self):
+        """
+        Save the qperf results measured so far
+        :return:
+        """
+        if not self.logdir or not self.qperf_results:
+            return
+        filename = os.path.join(self.logdir, "qperf-%s.json" % self.interface)
+        if Document(filename, self.qperf_results).save():
+            instrument.output(filename)
+
     def test_http(self):
         """
         Test http
@@ -444,6 +477,7 @@ class NetworkTest(Test):
         """
         self.args = args or argparse.Namespace()
         self.device = getattr(self.args, 'device', None)
+        self.logdir = getattr(self.args, 'logdir', None)
         self.interface = self.device.get_property("INTERFACE")
 
         self.cert = CertDocument(CertEnv.certificationfile)
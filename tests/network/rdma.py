@@ -15,12 +15,15 @@
 """RDMA Test"""
 
 import os
-import re
 import argparse
+import threading
 
-from hwcompatible.command import Command
-from hwcompatible.document import CertDocument
+from hwcompatible.command import Command, CertCommandError
+from hwcompatible.commandUI import CommandUI
+from hwcompatible.document import CertDocument, Document
 from hwcompatible.env import CertEnv
+from hwcompatible import instrument
+from hwcompatible.rdmautil import get_rdma_port, get_rdma_ports
 from network import NetworkTest
 
 
@@ -49,54 +52,47 @@ class RDMATest(NetworkTest):
         self.server_ip = None
         self.speed = None   # Mb/s
         self.target_bandwidth_percent = 0.5
+        self.logdir = None
+        self.perftest_bw_cmds = ['ib_read_bw', 'ib_write_bw', 'ib_send_bw']
+        self.perftest_lat_cmds = ['ib_read_lat', 'ib_write_lat', 'ib_send_lat']
+        self.perftest_qps = [1, 2, 4, 8]
+        self.saturation_percent = 0.9
+        self.perftest_results = dict()
+        self.multiport_duration = 10
+        self.multiport_tcp_port = 18515
+        self.multiport_scaling_percent = 0.8
 
     def get_ibstatus(self):
         """
         Get ibstatus
         :return:
         """
-        path_netdev = ''.join(['/sys', self.device.get_property("DEVPATH")])
-        path_pci = path_netdev.split('net')[0]
-        path_ibdev = 'infiniband_verbs/uverb*/ibdev'
-        path_ibdev = ''.join([path_pci, path_ibdev])
-        cmd = "cat %s" % path_ibdev
-        com = Command(cmd)
-        try:
-            self.ib_device = com.read()
-        except Exception as concrete_error:
-            print(concrete_error)
+        rdma_port = get_rdma_port(self.interface)
+        if not rdma_port:
+            print("[X] No RDMA device found for %s." % self.interface)
             return False
 
-        path_ibport = '/sys/class/net/%s/dev_id' % self.interface
-        cmd = "cat %s" % path_ibport
-        com = Command(cmd)
-        try:
-            self.ib_port = int(com.read(), 16) + 1
-        except Exception as concrete_error:
-            print(concrete_error)
-            return False
-
-        ib_str = "Infiniband device '%s' port %d" % (self.ib_device, self.ib_port)
-        print("Interface %s ===> %s" % (self.interface, ib_str))
-
-        cmd = "ibstatus"
-        print(cmd)
-        com = Command(cmd)
-        try:
-            output = com.read()
-            for info in output.split('\n\n'):
-                if ib_str not in info:
-                    continue
-                print(info)
-                self.gid = re.search(r"default gid:\s+(.*)", info).group(1)
-                self.base_lid = re.search(r"base lid:\s+(.*)", info).group(1)
-                self.sm_lid = re.search(r"sm lid:\s+(.*)", info).group(1)
-                self.state = re.search(r"state:\s+(.*)", info).group(1)
-                self.phys_state = re.search(r"phys state:\s+(.*)", info).group(1)
-                self.link_layer = re.search(r"link_layer:\s+(.*)", info).group(1)
-                self.speed = int(re.search(r"rate:\s+(\d*)", info).group(1)) * 1024
-        except Exception as concrete_error:
-            print(concrete_error)
+        self.ib_device = rdma_port['ib_device']
+        self.ib_port = rdma_port['ib_port']
+        print("Interface %s ===> Infiniband device '%s' port %d" %
+              (self.interface, self.ib_device, self.ib_port))
+
+        self.gid = rdma_port['gid']
+        self.base_lid = rdma_port['lid']
+        self.sm_lid = rdma_port['sm_lid']
+        self.state = rdma_port['state']
+        self.phys_state = rdma_port['phys_state']
+        self.link_layer = rdma_port['link_layer']
+        self.speed = rdma_port['speed']
+        print("\tdefault gid:\t %s" % self.gid)
+        print("\tbase lid:\t 0x%x" % self.base_lid)
+        print("\tsm lid:\t\t 0x%x" % self.sm_lid)
+        print("\tstate:\t\t %s" % self.state)
+        print("\tphys state:\t %s" % self.phys_state)
+        print("\trate:\t\t %s" % rdma_port['rate'])
+        print("\tlink_layer:\t %s" % self.link_layer)
+        if not self.speed:
+            print("[X] Fail to get rate of %s." % self.interface)
             return False
 
         return True
@@ -200,6 +196,320 @@ class RDMATest(NetworkTest):
 
         return True
 
+    def parse_perftest_table(self, output, fields):
+        """
+        Parse the result table printed by perftest with -a
+        :param output: output lines of ib_*_bw or ib_*_lat
+        :param fields: column names, starting with bytes and iterations
+        :return: list of rows, one dict per message size
+        """
+        rows = list()
+        for line in output or []:
+            values = line.split()
+            if len(values) < 3:
+                continue
+            try:
+                numbers = [float(value) for value in values]
+            except ValueError:
+                continue
+            row = dict(zip(fields, numbers))
+            row['bytes'] = int(row['bytes'])
+            row['iterations'] = int(row['iterations'])
+            rows.append(row)
+        return rows
+
+    def run_perftest(self, cmd):
+        """
+        Run one perftest command against the remote server
+        :param cmd: perftest command with its options, e.g. "ib_write_bw -a -q 2"
+        :return: output lines, or None on failure
+        """
+        if self.link_layer == 'Ethernet':
+            cmd = cmd + ' -R'
+
+        if not self.call_remote_server(cmd, 'start', self.server_ip):
+            print("start %s server failed." % cmd)
+            return None
+
+        cmd = "%s %s -d %s -i %s" % (cmd, self.server_ip, self.ib_device, self.ib_port)
+        print(cmd)
+        com = Command(cmd)
+        try:
+            com.run()
+            return com.output
+        except CertCommandError as concrete_error:
+            print(concrete_error)
+            self.call_remote_server(cmd.split()[0], 'stop')
+            return None
+
+    def get_saturation(self, curve):
+        """
+        Get the saturation point of a bandwidth curve, which is the smallest
+        message size reaching saturation_percent of the peak average bandwidth
+        :param curve: rows parsed from ib_*_bw
+        :return: (message size, peak average bandwidth in Mb/s)
+        """
+        peak_bw = max(row['bw_avg'] for row in curve) * 8
+        for row in curve:
+            if row['bw_avg'] * 8 >= self.saturation_percent * peak_bw:
+                return row['bytes'], peak_bw
+        return curve[-1]['bytes'], peak_bw
+
+    def test_perftest_bw(self, cmd):
+        """
+        Sweep message sizes and QP counts for a bandwidth test
+        :param cmd: ib_read_bw, ib_write_bw or ib_send_bw
+        :return:
+        """
+        fields = ['bytes', 'iterations', 'bw_peak', 'bw_avg', 'msg_rate']
+        result = dict()
+        best_bw = 0
+        for qp_num in self.perftest_qps:
+            output = self.run_perftest("%s -a -F -q %d" % (cmd, qp_num))
+            curve = self.parse_perftest_table(output, fields)
+            if not curve:
+                print("[X] No result of %s with %d QPs." % (cmd, qp_num))
+                return False
+
+            size, peak_bw = self.get_saturation(curve)
+            print("[.] %d QPs: peak bandwidth %.2fMb/s, saturated at %u bytes" %
+                  (qp_num, peak_bw, size))
+            result[qp_num] = {'curve': curve, 'peak_bw': peak_bw, 'saturation_size': size}
+            best_bw = max(best_bw, peak_bw)
+
+        tgt_bw = self.target_bandwidth_percent * self.speed
+        print("Saturated bandwidth is %.2fMb/s, target is %.2fMb/s" % (best_bw, tgt_bw))
+        self.perftest_results[cmd] = {'qps': result, 'peak_bw': best_bw,
+                                      'target_bw': tgt_bw, 'pass': best_bw > tgt_bw}
+        return best_bw > tgt_bw
+
+    def test_perftest_lat(self, cmd):
+        """
+        Sweep message sizes for a latency test
+        :param cmd: ib_read_lat, ib_write_lat or ib_send_lat
+        :return:
+        """
+        fields = ['bytes', 'iterations', 't_min', 't_max', 't_typical',
+                  't_avg', 't_stdev', 'p99', 'p99.9']
+        output = self.run_perftest("%s -a -F" % cmd)
+        curve = self.parse_perftest_table(output, fields)
+        if not curve:
+            print("[X] No result of %s." % cmd)
+            return False
+
+        print("[.] %s: typical latency %.2fus at %u bytes, %.2fus at %u bytes" %
+              (cmd, curve[0]['t_typical'], curve[0]['bytes'],
+               curve[-1]['t_typical'], curve[-1]['bytes']))
+        self.perftest_results[cmd] = {'curve': curve}
+        return True
+
+    def save_perftest_results(self):
+        """
+        Save perftest curves as json in the job directory
+        :return:
+        """
+        filename = "perftest-%s.json" % self.interface
+        if self.logdir:
+            filename = os.path.join(self.logdir, filename)
+        results = {'interface': self.interface,
+                   'ib_device': self.ib_device,
+                   'ib_port': self.ib_port,
+                   'link_layer': self.link_layer,
+                   'speed': self.speed,
+                   'results': self.perftest_results}
+        if Document(filename, results).save():
+            instrument.output(filename)
+            print("[.] Perftest results saved to %s" % filename)
+
+    def test_perftest(self):
+        """
+        Test RDMA bandwidth and latency curves with perftest
+        :return:
+        """
+        return_code = True
+        self.perftest_results = dict()
+        for cmd in self.perftest_bw_cmds:
+            print("[+] Sweeping %s..." % cmd)
+            if not self.test_perftest_bw(cmd):
+                print("[X] Test %s sweep failed." % cmd)
+                return_code = False
+
+        for cmd in self.perftest_lat_cmds:
+            print("[+] Sweeping %s..." % cmd)
+            if not self.test_perftest_lat(cmd):
+                print("[X] Test %s sweep failed." % cmd)
+                return_code = False
+
+        self.save_perftest_results()
+        return return_code
+
+    def choose_perftest(self):
+        """
+        Ask whether to run the perftest benchmark after the RDMA tests
+        :return:
+        """
+        if self.test_perftest in self.subtests:
+            return
+        if CommandUI().prompt_confirm("Run RDMA benchmark (perftest message size "
+                                      "and QP sweep)?"):
+            self.subtests.append(self.test_perftest)
+
+    def start_multiport_servers(self, cmd, rdma_ports):
+        """
+        Start one perftest server per port on the remote server at the same time
+        :param cmd:
+        :param rdma_ports:
+        :return:
+        """
+        results = [False] * len(rdma_ports)
+
+        def start_server(index, rdma_port):
+            server_cmd = "%s -p %d" % (cmd, rdma_port['tcp_port'])
+            results[index] = self.call_remote_server(server_cmd, 'start',
+                                                     rdma_port['server_ip'])
+
+        threads = list()
+        for index, rdma_port in enumerate(rdma_ports):
+            thread = threading.Thread(target=start_server, args=(index, rdma_port))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return all(results)
+
+    def test_multiport_bw(self, cmd, rdma_ports):
+        """
+        Run a bandwidth test on all ports at the same time
+        :param cmd: ib_read_bw, ib_write_bw or ib_send_bw
+        :param rdma_ports:
+        :return:
+        """
+        cmd = "%s -F -D %d" % (cmd, self.multiport_duration)
+        if rdma_ports[0]['link_layer'] == 'Ethernet':
+            cmd = cmd + ' -R'
+
+        if not self.start_multiport_servers(cmd, rdma_ports):
+            print("start %s servers failed." % cmd)
+            self.call_remote_server(cmd.split()[0], 'stop')
+            return None
+
+        coms = list()
+        for rdma_port in rdma_ports:
+            com = Command("%s %s -d %s -i %d -p %d" %
+                          (cmd, rdma_port['server_ip'], rdma_port['ib_device'],
+                           rdma_port['ib_port'], rdma_port['tcp_port']))
+            print(com.command)
+            com.start()
+            coms.append(com)
+
+        fields = ['bytes', 'iterations', 'bw_peak', 'bw_avg', 'msg_rate']
+        port_bws = list()
+        for com in coms:
+            output, _ = com.pipe.communicate()
+            rows = self.parse_perftest_table(output.splitlines(), fields)
+            if com.pipe.returncode != 0 or not rows:
+                print("[X] %s failed." % com.command)
+                port_bws.append(0)
+            else:
+                port_bws.append(rows[-1]['bw_avg'] * 8)
+        return port_bws
+
+    def get_multiport_ports(self):
+        """
+        Active RDMA ports with the link layer of this test, on the interfaces
+        the job tests, in job order
+        :return:
+        """
+        devices = getattr(self.args, 'devices', None) or [self.device]
+        interfaces = [device.get_property("INTERFACE") for device in devices]
+        rdma_ports = [rdma_port for rdma_port in get_rdma_ports()
+                      if rdma_port['interface'] in interfaces and
+                      'ACTIVE' in rdma_port['state'] and
+                      rdma_port['link_layer'] == self.link_layer]
+        rdma_ports.sort(key=lambda rdma_port: interfaces.index(rdma_port['interface']))
+        return rdma_ports
+
+    def test_multiport(self):
+        """
+        Test aggregate RDMA bandwidth of all ports running at the same time,
+        against the bandwidth each port reaches alone
+        :return:
+        """
+        rdma_ports = self.get_multiport_ports()
+        if len(rdma_ports) < 2:
+            print("[.] Less than 2 active RDMA ports found, skip multi-port test.")
+            return True
+
+        try:
+            input = raw_input
+        except NameError:
+            from builtins import input
+
+        for index, rdma_port in enumerate(rdma_ports):
+            message = "Please enter the IP of remote interface for %s: (default %s)\n> " % \
+                      (rdma_port['interface'], self.server_ip)
+            rdma_port['server_ip'] = input(message) or self.server_ip
+            rdma_port['tcp_port'] = self.multiport_tcp_port + index
+
+        return_code = True
+        results = {'ports': rdma_ports, 'results': dict()}
+        for cmd in self.perftest_bw_cmds:
+            print("[+] Testing %s on each port alone..." % cmd)
+            single_bws = list()
+            for rdma_port in rdma_ports:
+                port_bws = self.test_multiport_bw(cmd, [rdma_port])
+                single_bws.append(port_bws[0] if port_bws else 0)
+                print("[.] %s: %.2fMb/s" % (rdma_port['interface'], single_bws[-1]))
+            if not all(single_bws):
+                print("[X] Test %s on a single port failed." % cmd)
+                return_code = False
+                continue
+
+            print("[+] Testing %s on %d ports..." % (cmd, len(rdma_ports)))
+            port_bws = self.test_multiport_bw(cmd, rdma_ports)
+            if not port_bws:
+                print("[X] Test %s on multiple ports failed." % cmd)
+                return_code = False
+                continue
+
+            for rdma_port, port_bw, single_bw in zip(rdma_ports, port_bws, single_bws):
+                print("[.] %s: %.2fMb/s, %.2fMb/s alone" %
+                      (rdma_port['interface'], port_bw, single_bw))
+            aggregate_bw = sum(port_bws)
+            single_total = sum(single_bws)
+            tgt_bw = self.multiport_scaling_percent * single_total
+            print("Aggregate bandwidth is %.2fMb/s (%.1f%% of the ports alone), "
+                  "target is %.2fMb/s" % (aggregate_bw, 100.0 * aggregate_bw / single_total,
+                                          tgt_bw))
+            results['results'][cmd] = {'port_bw': port_bws, 'single_port_bw': single_bws,
+                                       'aggregate_bw': aggregate_bw, 'target_bw': tgt_bw}
+            if aggregate_bw <= tgt_bw:
+                print("[X] Aggregate bandwidth of %s does not scale with ports." % cmd)
+                return_code = False
+
+        filename = "rdma-multiport.json"
+        if self.logdir:
+            filename = os.path.join(self.logdir, filename)
+        if Document(filename, results).save():
+            instrument.output(filename)
+            print("[.] Multi-port results saved to %s" % filename)
+        return return_code
+
+    def choose_multiport(self):
+        """
+        Ask whether to run the bandwidth tests on all RDMA ports at the same
+        time, only once from the testcase of the first port
+        :return:
+        """
+        if self.test_multiport in self.subtests:
+            return
+        rdma_ports = self.get_multiport_ports()
+        if len(rdma_ports) < 2 or rdma_ports[0]['interface'] != self.interface:
+            return
+        if CommandUI().prompt_confirm("Run RDMA bandwidth test on all %d ports at the "
+                                      "same time?" % len(rdma_ports)):
+            self.subtests.append(self.test_multiport)
+
     def test_ibstatus(self):
         """
         Test ibstatus
@@ -228,6 +538,7 @@ class RDMATest(NetworkTest):
         self.args = args or argparse.Namespace()
         self.device = getattr(self.args, 'device', None)
         self.interface = self.device.get_property("INTERFACE")
+        self.logdir = getattr(self.args, 'logdir', None)
 
         self.cert = CertDocument(CertEnv.certificationfile)
         self.server_ip = self.cert.get_server()
@@ -245,6 +556,8 @@ class RDMATest(NetworkTest):
         message = "Please enter the IP of InfiniBand interface on remote server: \
                    (default %s)\n> " % self.server_ip
         self.server_ip = input(message) or self.server_ip
+        self.choose_perftest()
+        self.choose_multiport()
 
         for subtest in self.subtests:
             if not subtest():
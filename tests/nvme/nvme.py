@@ -15,10 +15,29 @@
 """Test Non-Volatile Memory express"""
 
 import os
+import re
 import sys
+import json
+import time
+import threading
 import argparse
 from hwcompatible.test import Test
-from hwcompatible.command import Command
+from hwcompatible.command import Command, CertCommandError
+from hwcompatible.commandUI import CommandUI
+from hwcompatible.document import Document
+from hwcompatible import instrument
+from hwcompatible.pciutil import get_pci_inventory
+from hwcompatible.blockutil import get_block_topology
+
+# smart-log counters that move when the controller throttles itself
+THROTTLE_COUNTERS = ["warning_temp_time", "critical_comp_time",
+                     "thm_temp1_trans_count", "thm_temp2_trans_count",
+                     "thm_temp1_total_time", "thm_temp2_total_time"]
+PCI_SLOT = r"^[0-9a-f]{4}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-9a-f]$"
+
+# (job log directory, namespace) -> whether it passed, for the namespaces
+# already tested by the parallel run of a job
+parallel_results = dict()
 
 
 class NvmeTest(Test):
@@ -28,8 +47,17 @@ class NvmeTest(Test):
     def __init__(self):
         Test.__init__(self)
         self.requirements = ["nvme-cli"]
+        self.benchmark = True
         self.args = None
         self.device = None
+        self.logdir = None
+        self.com_ui = CommandUI()
+        self.workers_per_port = 2
+        self.runtime = 30
+        self.queue_depths = [1, 4, 16, 64]
+        self.numjobs = [1, 4]
+        self.workloads = [("randread", "4k"), ("randwrite", "4k"),
+                          ("read", "128k"), ("write", "128k")]
 
     def setup(self, args=None):
         """
@@ -39,6 +67,8 @@ class NvmeTest(Test):
         """
         self.args = args or argparse.Namespace()
         self.device = getattr(args, "device", None)
+        self.logdir = getattr(args, "logdir", None)
+        get_block_topology(refresh=True)
         Command("nvme list").echo(ignore_errors=True)
 
     def test(self):
@@ -47,74 +77,366 @@ class NvmeTest(Test):
         :return:
         """
         disk = self.device.get_name()
+        if (self.logdir, disk) in parallel_results:
+            print("%s was tested in parallel with the other namespaces." % disk)
+            return parallel_results[(self.logdir, disk)]
+
         if self.in_use(disk):
             print("%s is in use now, skip this test." % disk)
             return False
 
+        if self.choose_parallel(disk):
+            # the other namespaces report their own result from parallel_results
+            self.test_parallel()
+            return_code = parallel_results.get((self.logdir, disk), False)
+        else:
+            return_code = self.test_namespace(disk) is not None
+            Command("nvme list").echo(ignore_errors=True)
+        if not return_code:
+            return False
+
+        if self.choose_benchmark(disk):
+            return self.test_benchmark()
+        return True
+
+    def test_namespace(self, disk, quiet=False):
+        """
+        Format, write, read and check the logs of one namespace
+        :param disk:
+        :param quiet: keep the command output for the log file instead of
+                      printing it, used by parallel workers
+        :return: dict of timings and logs, None on failure
+        """
         size = Command("cat /sys/block/%s/size" % disk).get_str()
         size = int(int(size))/2/2
         if size <= 0:
             print("Error: the size of %s is not suitable for this test." % disk)
+            return None
+        elif size > 10*1024*1024*1024:
+            size = 10*1024*1024*1024
+
+        steps = [("format", "Formatting...", "nvme format -l 0 -i 0 /dev/%s" % disk),
+                 ("write", "Writting...",
+                  "nvme write -z %d -s 0 -d /dev/urandom /dev/%s 2> /dev/null" % (size, disk)),
+                 ("read", "Reading...",
+                  "nvme read -s 0 -z %d /dev/%s &> /dev/null" % (size, disk)),
+                 ("smart_log", "Smart Log:", "nvme smart-log /dev/%s 2> /dev/null" % disk),
+                 ("log", "Log:", "nvme get-log -i 1 -l 128 /dev/%s 2> /dev/null" % disk)]
+        result = {"disk": disk, "size": size, "output": []}
+        try:
+            for step, title, command in steps:
+                start = time.time()
+                comm = Command(command)
+                if quiet:
+                    comm.run_quiet()
+                    result["output"].append(title)
+                    result["output"].extend(comm.output or [])
+                else:
+                    print("\n" + title)
+                    comm.echo()
+                    sys.stdout.flush()
+                result[step] = {"start": start, "end": time.time()}
+        except Exception as concrete_error:
+            print("Error: nvme cmd fail on %s." % disk)
+            print(concrete_error)
+            return None
+        if not quiet:
+            print("")
+        return result
+
+    def choose_parallel(self, disk):
+        """
+        Ask whether to test the selected idle namespaces at the same time,
+        only once from the testcase of the first namespace
+        :param disk:
+        :return:
+        """
+        namespaces = self.get_namespaces()
+        if len(namespaces) < 2 or disk != namespaces[0]:
             return False
-        elif size > 10*1024*1014*1024:
-            size = 10*1024*1014*1024
+        return self.com_ui.prompt_confirm("Run nvme test on the %d selected idle namespaces "
+                                          "in parallel?" % len(namespaces))
 
+    def get_topology(self, disk):
+        """
+        PCIe root port and numa node of the controller of a namespace,
+        controllers behind the same root port (directly or through a
+        switch) share its uplink
+        :param disk:
+        :return: (root port, numa node)
+        """
+        path = os.path.realpath("/sys/block/%s/device/device" % disk)
+        slots = [item for item in path.split("/") if re.match(PCI_SLOT, item)]
+        if not slots:
+            return ("", -1)
+        dev = get_pci_inventory().get(slots[-1])
+        return (slots[0], dev["numa_node"] if dev else -1)
+
+    def get_node_cpus(self, node):
+        """
+        Cpus of a numa node, empty when unknown
+        :param node:
+        :return:
+        """
         try:
-            print("\nFormatting...")
-            Command("nvme format -l 0 -i 0 /dev/%s" % disk).echo()
-            sys.stdout.flush()
+            with open("/sys/devices/system/node/node%d/cpulist" % node) as cpulist_file:
+                cpulist = cpulist_file.read().strip()
+        except (IOError, OSError):
+            return set()
+        cpus = set()
+        for item in cpulist.split(","):
+            if "-" in item:
+                first, last = item.split("-", 1)
+                cpus.update(range(int(first), int(last) + 1))
+            elif item:
+                cpus.add(int(item))
+        return cpus
 
-            print("\nWritting...")
-            Command("nvme write -z %d -s 0 -d /dev/urandom /dev/%s 2> /dev/null" \
-                    % (size, disk)).echo()
-            sys.stdout.flush()
+    def parallel_worker(self, node, disks, results, lock):
+        """
+        Test namespaces of one root port one after the other, running on
+        the cpus of their numa node
+        :return:
+        """
+        cpus = self.get_node_cpus(node) if node >= 0 else set()
+        if cpus:
+            try:
+                # pid 0 is the calling thread, nvme-cli children inherit it
+                os.sched_setaffinity(0, cpus)
+            except (AttributeError, OSError):
+                pass
+        while True:
+            with lock:
+                if not disks:
+                    return
+                disk = disks.pop(0)
+            result = self.test_namespace(disk, quiet=True)
+            with lock:
+                results[disk] = result
+                print("%s %s" % (disk, "done" if result else "fail"))
+                sys.stdout.flush()
 
-            print("\nReading...")
-            Command("nvme read -s 0 -z %d /dev/%s &> /dev/null" % (size, disk)).echo()
-            sys.stdout.flush()
+    def test_parallel(self):
+        """
+        Run the nvme test on the selected idle namespaces in worker threads, a
+        limited number per PCIe root port, and report per device and
+        aggregate throughput
+        :return:
+        """
+        groups = dict()
+        for disk in self.get_namespaces():
+            groups.setdefault(self.get_topology(disk), []).append(disk)
 
-            print("\nSmart Log:")
-            Command("nvme smart-log /dev/%s 2> /dev/null" % disk).echo()
-            sys.stdout.flush()
+        print("\nTesting in parallel:")
+        for (root_port, node), disks in sorted(groups.items()):
+            print("  root port %s, numa node %d: %s" % (root_port or "-", node, ", ".join(disks)))
+        sys.stdout.flush()
 
-            print("\nLog:")
-            Command("nvme get-log -i 1 -l 128 /dev/%s 2> /dev/null" % disk).echo()
-            print("")
-            sys.stdout.flush()
+        results = dict()
+        lock = threading.Lock()
+        workers = list()
+        for (root_port, node), disks in groups.items():
+            for _ in range(min(len(disks), self.workers_per_port)):
+                worker = threading.Thread(target=self.parallel_worker,
+                                          args=(node, disks, results, lock))
+                worker.start()
+                workers.append(worker)
+        for worker in workers:
+            worker.join()
 
-            Command("nvme list").echo(ignore_errors=True)
-            return True
-        except Exception as concrete_error:
-            print("Error: nvme cmd fail.")
-            print(concrete_error)
+        return_code = True
+        summary = {"devices": dict(), "aggregate": dict()}
+        for disk, result in sorted(results.items()):
+            parallel_results[(self.logdir, disk)] = result is not None
+            if not result:
+                return_code = False
+                continue
+            print("\n".join(["", "==== %s ====" % disk] + result.pop("output")))
+            device = {"size": result["size"]}
+            for step in ["write", "read"]:
+                elapsed = result[step]["end"] - result[step]["start"]
+                device[step + "_mbps"] = result["size"] / elapsed / 1e6 if elapsed else 0
+            summary["devices"][disk] = device
+
+        print("\n%-12s %-12s %-12s" % ("namespace", "write MB/s", "read MB/s"))
+        for disk, device in sorted(summary["devices"].items()):
+            print("%-12s %-12.1f %-12.1f" % (disk, device["write_mbps"], device["read_mbps"]))
+        for step in ["write", "read"]:
+            done = [result for result in results.values() if result]
+            if not done:
+                break
+            elapsed = max(result[step]["end"] for result in done) - \
+                min(result[step]["start"] for result in done)
+            total = sum(result["size"] for result in done)
+            summary["aggregate"][step + "_mbps"] = total / elapsed / 1e6 if elapsed else 0
+        if summary["aggregate"]:
+            print("%-12s %-12.1f %-12.1f" % ("all", summary["aggregate"]["write_mbps"],
+                                             summary["aggregate"]["read_mbps"]))
+
+        Command("nvme list").echo(ignore_errors=True)
+        if self.logdir:
+            filename = os.path.join(self.logdir, "nvme-parallel.json")
+            if Document(filename, summary).save():
+                instrument.output(filename)
+        return return_code
+
+    def get_namespaces(self):
+        """
+        Namespaces of the nvme testcases selected in this job that are not
+        in use, in job order, other namespaces of the host are never touched
+        :return:
+        """
+        devices = getattr(self.args, "devices", None) or [self.device]
+        namespaces = list()
+        for device in devices:
+            disk = device.get_name()
+            if re.match(r"^nvme\d+n\d+$", disk) and disk not in namespaces and \
+                    os.path.exists("/sys/block/%s" % disk) and not self.in_use(disk):
+                namespaces.append(disk)
+        return namespaces
+
+    def choose_benchmark(self, disk):
+        """
+        Ask whether to benchmark the selected namespaces at the same time,
+        only once from the testcase of the first namespace
+        :param disk:
+        :return:
+        """
+        namespaces = self.get_namespaces()
+        if not namespaces or disk != namespaces[0]:
             return False
+        return self.com_ui.prompt_confirm("Run fio benchmark on the %d selected idle nvme "
+                                          "namespaces at the same time?" % len(namespaces))
+
+    def get_ioengine(self):
+        """
+        io_uring when fio and the kernel support it, libaio otherwise
+        :return:
+        """
+        try:
+            Command("fio --enghelp=io_uring").run_quiet()
+            return "io_uring"
+        except CertCommandError:
+            return "libaio"
+
+    def get_smart_log(self, controller):
+        """
+        Temperature and throttle counters of a controller
+        :param controller: nvme0
+        :return: dict, empty if smart-log fails
+        """
+        try:
+            comm = Command("nvme smart-log /dev/%s -o json" % controller)
+            comm.run_quiet()
+            smart_log = json.loads(comm.origin_output)
+        except (CertCommandError, TypeError, ValueError) as concrete_error:
+            print("Warning: could not read smart log of %s." % controller)
+            print(concrete_error)
+            return dict()
+        result = {"temperature": smart_log.get("temperature", 0) - 273}
+        for counter in THROTTLE_COUNTERS:
+            if counter in smart_log:
+                result[counter] = smart_log[counter]
+        return result
+
+    def run_fio(self, namespaces, ioengine, workload, block_size, queue_depth, numjobs):
+        """
+        Run one fio point on all namespaces at once, one job per namespace
+        :return: dict of namespace -> result, empty on failure
+        """
+        jobs = " ".join("--name=%s --filename=/dev/%s" % (disk, disk) for disk in namespaces)
+        try:
+            comm = Command("fio --output-format=json --direct=1 --ioengine=%s --rw=%s --bs=%s "
+                           "--iodepth=%d --numjobs=%d --time_based --runtime=%d --ramp_time=2 %s"
+                           % (ioengine, workload, block_size, queue_depth, numjobs,
+                              self.runtime, jobs))
+            comm.run_quiet()
+            output = comm.origin_output
+            fio_result = json.loads(output[output.index("{"):])
+        except (CertCommandError, TypeError, ValueError) as concrete_error:
+            print(concrete_error)
+            print("Error: fio fail.")
+            return dict()
+
+        results = dict()
+        direction = "write" if "write" in workload else "read"
+        for job in fio_result.get("jobs", []):
+            stats = job[direction]
+            clat = stats.get("clat_ns", {})
+            percentiles = clat.get("percentile", {})
+            result = results.setdefault(job["jobname"], {"iops": 0, "bw_kib": 0, "mean_us": 0,
+                                                         "p99_us": 0, "p99.99_us": 0})
+            # numjobs clones of a namespace, sum the throughput and keep the worst tail
+            result["iops"] += stats["iops"]
+            result["bw_kib"] += stats["bw"]
+            result["mean_us"] = max(result["mean_us"], clat.get("mean", 0) / 1e3)
+            result["p99_us"] = max(result["p99_us"], percentiles.get("99.000000", 0) / 1e3)
+            result["p99.99_us"] = max(result["p99.99_us"], percentiles.get("99.990000", 0) / 1e3)
+        return results
+
+    def test_benchmark(self):
+        """
+        Sweep queue depth and numjobs with fio on the selected idle namespaces,
+        checking smart temperature and throttle counters around the run
+        :return:
+        """
+        namespaces = self.get_namespaces()
+        controllers = sorted(set(re.match(r"^(nvme\d+)", disk).group(1) for disk in namespaces))
+        ioengine = self.get_ioengine()
+        print("\nBenchmarking %s with fio %s..." % (", ".join(namespaces), ioengine))
+
+        smart_before = dict((controller, self.get_smart_log(controller))
+                            for controller in controllers)
+        results = dict((controller, {"namespaces": dict()}) for controller in controllers)
+        print("%-10s %-6s %-4s %-4s %-10s %-12s %-10s %-10s %-10s" %
+              ("workload", "bs", "qd", "jobs", "namespace", "IOPS", "MiB/s", "mean(us)", "p99(us)"))
+        for workload, block_size in self.workloads:
+            for numjobs in self.numjobs:
+                for queue_depth in self.queue_depths:
+                    point = self.run_fio(namespaces, ioengine, workload, block_size,
+                                         queue_depth, numjobs)
+                    if not point:
+                        return False
+                    for disk, result in sorted(point.items()):
+                        result.update({"workload": workload, "bs": block_size,
+                                       "iodepth": queue_depth, "numjobs": numjobs})
+                        controller = re.match(r"^(nvme\d+)", disk).group(1)
+                        results[controller]["namespaces"].setdefault(disk, []).append(result)
+                        print("%-10s %-6s %-4d %-4d %-10s %-12.1f %-10.2f %-10.2f %-10.2f" %
+                              (workload, block_size, queue_depth, numjobs, disk, result["iops"],
+                               result["bw_kib"] / 1024, result["mean_us"], result["p99_us"]))
+                    sys.stdout.flush()
+
+        return_code = True
+        for controller in controllers:
+            before = smart_before[controller]
+            after = self.get_smart_log(controller)
+            throttled = [counter for counter in THROTTLE_COUNTERS
+                         if after.get(counter, 0) > before.get(counter, 0)]
+            results[controller].update({"ioengine": ioengine,
+                                        "smart_before": before,
+                                        "smart_after": after,
+                                        "throttled": throttled})
+            print("%s temperature %sC -> %sC" % (controller, before.get("temperature", "-"),
+                                                 after.get("temperature", "-")))
+            if throttled:
+                print("Warning: %s throttled during the benchmark (%s)."
+                      % (controller, ", ".join(throttled)))
+
+            filename = "nvme-benchmark-%s.json" % controller
+            if self.logdir:
+                filename = os.path.join(self.logdir, filename)
+            if Document(filename, results[controller]).save():
+                instrument.output(filename)
+            else:
+                return_code = False
+        return return_code
 
     def in_use(self, disk):
         """
-        Determine whether the swapon is in use
+        Determine whether the namespace, its partitions or a device stacked
+        on them is mounted, used as swap, RAID member or LVM PV
         :param disk:
         :return:
         """
-        os.system("swapon -a 2>/dev/null")
-        swap_file = open("/proc/swaps", "r")
-        swap = swap_file.read()
-        swap_file.close()
-
-        mdstat_file = open("/proc/mdstat", "r")
-        mdstat = mdstat_file.read()
-        mdstat_file.close()
-
-        mtab_file = open("/etc/mtab", "r")
-        mtab = mtab_file.read()
-        mtab_file.close()
-
-        mount_file = open("/proc/mounts", "r")
-        mounts = mount_file.read()
-        mount_file.close()
-
-        if ("/dev/%s" % disk) in swap or disk in mdstat:
-            return True
-        if ("/dev/%s" % disk) in mounts or ("/dev/%s" % disk) in mtab:
-            return True
-        if os.system("pvs 2>/dev/null | grep -q '/dev/%s'" % disk) == 0:
-            return True
+        return get_block_topology().is_busy(disk)
@@ -20,10 +20,12 @@ import re
 import argparse
 
 from hwcompatible.test import Test
-from hwcompatible.command import Command
+from hwcompatible.command import Command, CertCommandError
 from hwcompatible.sysinfo import SysInfo
 from hwcompatible.env import CertEnv
 from hwcompatible.document import Document
+from hwcompatible.inventoryutil import get_system_inventory
+from hwcompatible import kabiutil, rpmutil
 
 
 class SystemTest(Test):
@@ -51,11 +53,10 @@ class SystemTest(Test):
         test case
         :return:
         """
-        os.system("uname -a")
-        print("")
-        os.system("lsmod")
-        print("")
-        os.system("dmidecode")
+        inventory = get_system_inventory()
+        inventory.show()
+        if self.logdir:
+            Document(os.path.join(self.logdir, "inventory.json"), inventory.to_dict()).save()
         sys.stdout.flush()
 
         return_code = True
@@ -78,15 +79,18 @@ class SystemTest(Test):
         print("\nChecking installed cert package...")
         return_code = True
         for cert_package in ["oec-hardware"]:
-            rpm_verify = Command("rpm -V --nomtime --nomode --nocontexts %s" % cert_package)
             try:
-                rpm_verify.echo()
-                sys.stdout.flush()
-                if rpm_verify.output and len(rpm_verify.output) > 0:
-                    return_code = False
-            except Exception:
+                changes = rpmutil.verify_package(cert_package)
+            except CertCommandError as concrete_error:
+                print(concrete_error)
+                print("Error: %s is not installed." % cert_package)
+                return_code = False
+                continue
+            if changes:
+                print("\n".join(changes))
                 print("Error: files in %s have been tampered." % cert_package)
                 return_code = False
+        sys.stdout.flush()
         return return_code
 
     def check_kernel(self):
@@ -137,9 +141,9 @@ class SystemTest(Test):
                     print("Out-of-tree modules:")
                     for module in modules:
                         print(module)
-                        # self.abi_check(module)
-                        return_code = False
                     print("")
+                    if not self.abi_check(modules):
+                        return_code = False
 
                 if tainted & (1 << 13):
                     modules = self.get_modules("E")
@@ -156,8 +160,13 @@ class SystemTest(Test):
 
         except_list = ["/modules.dep$", "/modules.symbols$", "/modules.dep.bin$", \
                        "/modules.symbols.bin$"]
-        if os.system("rpm -V --nomtime --nomode --nocontexts %s | grep -Ev '%s'" % \
-                     (kernel_rpm, "|".join(except_list))) is 0:
+        try:
+            changes = rpmutil.verify_package(kernel_rpm, except_list)
+        except CertCommandError as concrete_error:
+            print(concrete_error)
+            changes = ["%s is not installed" % kernel_rpm]
+        if changes:
+            print("\n".join(changes))
             print("Error: files from %s were modified." % kernel_rpm)
             print("")
             return_code = False
@@ -189,130 +198,45 @@ class SystemTest(Test):
         proc_modules.close()
         return modules
 
-    def abi_check(self, module):
+    def abi_check(self, modules):
         """
-        Check abi whitelist
-        :param module:
+        Check the symbols used by modules against the kabi whitelist and
+        the CRCs of the running kernel
+        :param modules:
         :return:
         """
-        whitelist_path = [("/lib/modules/kabi-current/kabi_whitelist_" + self.sysinfo.arch),
-                          ("/lib/modules/kabi/kabi_whitelist_" + self.sysinfo.arch),
-                          ("/usr/src/kernels/%s/kabi_whitelist" % self.sysinfo.kernel)
-                          ]
-        whitelist = ""
-        for whitelist in whitelist_path:
-            if os.path.exists(whitelist):
-                break
-
-        if not os.path.exists(whitelist):
-            print("Error: could not find whitelist file in any of the following locations:")
-            print("\n".join(whitelist_path))
+        results = kabiutil.check_modules(modules, self.sysinfo.arch, self.sysinfo.kernel)
+        if results is None:
+            print("Error: could not find kabi whitelist of %s." % self.sysinfo.kernel)
             return False
 
-        whitelist_symbols = self.read_abi_whitelist(whitelist)
-        if not whitelist_symbols:
-            return False
-        module_symbols = self.read_module(module)
-        if not module_symbols:
-            return False
-        extra_symbols = list()
-        for symbol in module_symbols:
-            if symbol not in whitelist_symbols:
-                extra_symbols.append(symbol)
-
-        black_symbols = list()
-        if extra_symbols:
-            greylist = "/usr/share/doc/kmod-%s/greylist.txt" % module
-            if os.path.exists(greylist):
-                print("checking greylist for %s" % module)
-                greylist_symbols = self.read_abi_whitelist(greylist)
-                for symbol in extra_symbols:
-                    if symbol not in greylist_symbols:
-                        black_symbols.append(symbol)
-            else:
-                black_symbols = extra_symbols
-
-        if black_symbols:
-            print("Error: The following symbols are used by %s are not on the ABI \
-            whitelist." % module)
-            for symbol in black_symbols:
-                print(symbol)
-            return False
-
-        print("")
-        return True
-
-    def read_abi_whitelist(self, whitelist):
-        """
-        Read abi whitelist
-        :param whitelist:
-        :return:
-        """
-        symbols = list()
-        if not os.path.isfile(whitelist):
-            print("Error: Cannot read whitelist file")
-            return None
-
-        whitelistfile = open(whitelist, "r")
-        while True:
-            line = whitelistfile.readline()
-            if line == "":
-                break
-            if line == "\n":
-                continue
-            line.split()
-            if line[0] == '[':
-                # group = line[1:-2]
+        return_code = True
+        for result in results:
+            if result["error"]:
+                print("Error: could not check %s: %s" % (result["module"], result["error"]))
+                return_code = False
                 continue
-            symbol = line.strip()
-            symbols.append(symbol)
-
-        return symbols
-
-    def read_module(self, module):
-        """
-        Read module
-        :param module:
-        :return:
-        """
-        symbols = list()
-        module_file = self.get_modulefile(module)
-
-        if not module_file:
-            print("Error: Can not find module file for %s" % module)
-            return None
-        if not os.path.isfile(module_file):
-            print("Error: Cannot read module file %s" % module_file)
-            return None
-
-        if module_file[-2:] == "ko":
-            n_m = os.popen('modprobe --dump-modversions ' + module_file)
-        else:
-            n_m = open(module_file, "r")
-
-        while True:
-            line = n_m.readline()
-            if line == "":
-                break
-            symbols.append(line)
-
-        n_m.close()
-        return self.readSymbols(symbols)
+            if result["not_whitelisted"]:
+                print("Error: The following symbols are used by %s are not on the ABI "
+                      "whitelist." % result["module"])
+                for symbol in result["not_whitelisted"]:
+                    print(symbol)
+                return_code = False
+            if result["crc_mismatch"]:
+                print("Error: The following symbols of %s do not match the kernel CRC."
+                      % result["module"])
+                for mismatch in result["crc_mismatch"]:
+                    print("%s %s (kernel %s)" % (mismatch["symbol"], mismatch["module_crc"],
+                                                 mismatch["kernel_crc"]))
+                return_code = False
+            if not result["not_whitelisted"] and not result["crc_mismatch"]:
+                print("%s: %d symbols, all on the ABI whitelist." %
+                      (result["module"], result["symbols"]))
+        print("")
 
-    def get_modulefile(self, module):
-        """
-        Get module file
-        :param module:
-        :return:
-        """
-        try:
-            modulefile = Command("modinfo -F filename %s" % module).get_str()
-            if os.path.islink(modulefile):
-                modulefile = os.readlink(modulefile)
-            return modulefile
-        except Exception:
-            print("Error: could no find module file for %s:" % module)
-            return None
+        if self.logdir:
+            Document(os.path.join(self.logdir, "kabi.json"), results).save()
+        return return_code
 
     def check_selinux(self):
         """